@@ -0,0 +1,266 @@
+# Alinhamento (registro) de cada imagem de exame com a referência do seu layout, antes dos recortes.
+# Exportações deslocadas (ou com pequena diferença de escala) fazem as coordenadas fixas do registro_layouts.json
+# caírem fora dos valores; aqui o deslocamento é estimado uma vez por imagem, por correlação de fase em regiões âncora
+# (trechos fixos do layout, fora dos campos), e aplicado às caixas de todos os campos (TabelaRecortes.alinhada).
+# Uso: python alinhamento.py calibrar <diretorio_imagens> [arquivo_saida]
+#      python alinhamento.py medir <imagem> [<imagem> ...]
+
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+
+ANCORAS_FILE = 'ancoras_layout.npz' # Arquivo com as âncoras de cada layout (gerado pela calibração), no diretório raiz
+TAMANHO_ANCORA = 64       # Lado (px) de cada região âncora
+N_ANCORAS = 6             # Âncoras por layout (espalhadas pela imagem, para que a escala também possa ser estimada)
+DESLOCAMENTO_MAX = 16     # Deslocamento máximo procurado (px) em cada direção
+ESCALA_MAX = 0.01         # Variação máxima de escala aceita (1%; nas âncoras mais distantes ela também precisa caber em DESLOCAMENTO_MAX)
+MARGEM_CAMPOS = 4         # Margem (px) em volta das caixas dos campos que não pode entrar nas âncoras (os valores mudam entre exames)
+CORRELACAO_ANCORA = 0.5   # Correlação mínima de uma âncora, depois de alinhada, para entrar na estimativa
+
+
+def _janela_hann(lado):
+  h = np.hanning(lado).astype(np.float32)
+  return np.outer(h, h)
+
+
+def _lado_janela():
+  return TAMANHO_ANCORA + 2 * DESLOCAMENTO_MAX
+
+
+'''
+Janelas de busca das âncoras em uma imagem (cada âncora com DESLOCAMENTO_MAX px em volta), em tons de cinza.
+Só as janelas são recortadas e convertidas; fora da imagem o recorte do PIL é preenchido com preto.
+Retorna um array K x lado x lado (float32).
+'''
+def janelas_ancoras(img, ancoras):
+  lado = _lado_janela()
+  janelas = np.empty((len(ancoras), lado, lado), dtype=np.float32)
+  for i, (x, y) in enumerate(ancoras):
+    x0, y0 = int(x) - DESLOCAMENTO_MAX, int(y) - DESLOCAMENTO_MAX
+    janelas[i] = np.asarray(img.crop((x0, y0, x0 + lado, y0 + lado)).convert('L'), dtype=np.float32)
+  return janelas
+
+
+'''
+Espectro (rfft2) das janelas com média zero e janela de Hann, usado na correlação de fase.
+'''
+def _espectro(janelas):
+  janelas = janelas - janelas.mean(axis=(1, 2), keepdims=True)
+  return np.fft.rfft2(janelas * _janela_hann(janelas.shape[-1]))
+
+
+'''
+Escolhe as âncoras de um layout na imagem média `media` (tons de cinza), com `variacao` o desvio padrão por pixel
+entre os exemplos e `caixas` as caixas [x, y, largura, altura] dos campos.
+As candidatas são janelas TAMANHO_ANCORA x TAMANHO_ANCORA em uma grade com meio lado de passo, longe das bordas e
+dos campos. A nota de cada uma é a menor energia de gradiente entre as direções x e y (uma linha reta só fixa uma
+direção), dividida pela variação entre os exemplos (partes que mudam de exame para exame não servem de referência).
+As âncoras são escolhidas pela nota, sem sobreposição. Retorna um array K x 2 (x, y) int32.
+'''
+def escolher_ancoras(media, variacao, caixas):
+  altura, largura = media.shape
+  lado, borda = TAMANHO_ANCORA, DESLOCAMENTO_MAX
+  proibido = np.zeros((altura + 1, largura + 1), dtype=np.float32)
+  for x, y, w, h in caixas:
+    proibido[max(0, y - MARGEM_CAMPOS):max(0, y + h + MARGEM_CAMPOS), max(0, x - MARGEM_CAMPOS):max(0, x + w + MARGEM_CAMPOS)] = 1
+  gy, gx = np.gradient(media)
+
+  def somas_janelas(arr, xs, ys):
+    # Soma de `arr` em cada janela da grade, pela imagem integral
+    integral = np.zeros((altura + 1, largura + 1), dtype=np.float64)
+    integral[1:, 1:] = arr[:altura, :largura].cumsum(0).cumsum(1)
+    return (integral[ys + lado][:, xs + lado] - integral[ys][:, xs + lado]
+            - integral[ys + lado][:, xs] + integral[ys][:, xs])
+
+  xs = np.arange(borda, largura - lado - borda + 1, lado // 2)
+  ys = np.arange(borda, altura - lado - borda + 1, lado // 2)
+  if not len(xs) or not len(ys):
+    return np.zeros((0, 2), dtype=np.int32)
+  energia = np.minimum(somas_janelas(gx * gx, xs, ys), somas_janelas(gy * gy, xs, ys)) / (lado * lado)
+  nota = np.sqrt(np.maximum(energia, 0)) / (1.0 + somas_janelas(variacao, xs, ys) / (lado * lado))
+  nota[somas_janelas(proibido, xs, ys) > 0.5] = 0
+
+  ancoras = []
+  for indice in np.argsort(nota, axis=None)[::-1]:
+    iy, ix = np.unravel_index(indice, nota.shape)
+    if nota[iy, ix] <= 0 or len(ancoras) == N_ANCORAS:
+      break
+    x, y = int(xs[ix]), int(ys[iy])
+    if all(abs(x - ax) >= lado or abs(y - ay) >= lado for ax, ay in ancoras):
+      ancoras.append((x, y))
+  return np.array(ancoras, dtype=np.int32).reshape(-1, 2)
+
+
+'''
+Constrói as âncoras de cada layout a partir de exemplos rotulados (iterável de (imagem, padrão)) e do registro
+(padrão -> TabelaRecortes). A referência de cada layout é a média dos exemplos do tamanho de imagem mais frequente.
+Retorna um dicionário padrão -> {'tamanho': (largura, altura), 'ancoras': K x 2, 'janelas': K x lado x lado}.
+'''
+def calibrar_ancoras(exemplos, registro):
+  somas = {}
+  for img, padrao in exemplos:
+    if padrao not in registro:
+      continue
+    arr = np.asarray(img.convert('L'), dtype=np.float64)
+    soma = somas.setdefault((padrao, img.size), [0, 0.0, 0.0])
+    soma[0] += 1
+    soma[1] = soma[1] + arr
+    soma[2] = soma[2] + arr * arr
+
+  modelos = {}
+  for padrao in sorted({p for p, _ in somas}):
+    tamanho = max((t for p, t in somas if p == padrao), key=lambda t: somas[(padrao, t)][0])
+    n, soma, quadrados = somas[(padrao, tamanho)]
+    media = soma / n
+    variacao = np.sqrt(np.maximum(quadrados / n - media * media, 0))
+    ancoras = escolher_ancoras(media, variacao, registro[padrao].caixas)
+    referencia = Image.fromarray(np.clip(np.rint(media), 0, 255).astype(np.uint8))
+    modelos[padrao] = {'tamanho': tamanho, 'ancoras': ancoras, 'janelas': janelas_ancoras(referencia, ancoras)}
+  return modelos
+
+
+def salvar_ancoras(caminho, modelos):
+  arrays = {}
+  for padrao, modelo in modelos.items():
+    arrays['tamanho_%d' % padrao] = np.array(modelo['tamanho'], dtype=np.int32)
+    arrays['ancoras_%d' % padrao] = modelo['ancoras']
+    arrays['janelas_%d' % padrao] = modelo['janelas'].astype(np.uint8)
+  np.savez_compressed(caminho, **arrays)
+
+
+'''
+Carrega as âncoras gravadas por salvar_ancoras. O espectro das janelas de referência é calculado aqui, uma única vez.
+'''
+def carregar_ancoras(caminho):
+  modelos = {}
+  with np.load(caminho) as arrays:
+    for nome in arrays.files:
+      if nome.startswith('ancoras_'):
+        padrao = int(nome.split('_')[1])
+        janelas = arrays['janelas_%d' % padrao].astype(np.float32)
+        if janelas.shape[-1] != _lado_janela():
+          raise ValueError('âncoras do padrão %d calibradas com outro TAMANHO_ANCORA/DESLOCAMENTO_MAX' % padrao)
+        modelos[padrao] = {
+          'tamanho': tuple(arrays['tamanho_%d' % padrao].tolist()),
+          'ancoras': arrays[nome],
+          'janelas': janelas,
+          'espectro': np.conj(_espectro(janelas)),
+        }
+  return modelos
+
+
+'''
+Deslocamento de cada janela da imagem em relação à janela de referência, por correlação de fase (todas as âncoras
+em um único rfft2/irfft2), com refinamento subpixel por parábola em volta do pico. Só deslocamentos de até
+DESLOCAMENTO_MAX são considerados. Retorna (dx, dy) como arrays de K floats: o conteúdo da imagem está dx px à
+direita e dy px abaixo da referência.
+'''
+def deslocamentos(janelas, espectro_referencia):
+  lado = janelas.shape[-1]
+  cruzado = _espectro(janelas) * espectro_referencia
+  cruzado /= np.abs(cruzado) + 1e-9
+  correlacao = np.fft.irfft2(cruzado, s=(lado, lado))
+  d = DESLOCAMENTO_MAX
+  correlacao = np.roll(correlacao, (d + 1, d + 1), axis=(1, 2))[:, :2 * d + 3, :2 * d + 3]
+  busca = correlacao[:, 1:-1, 1:-1].reshape(len(janelas), -1)
+  iy, ix = np.unravel_index(busca.argmax(axis=1), (2 * d + 1, 2 * d + 1))
+  k = np.arange(len(janelas))
+
+  def subpixel(antes, pico, depois):
+    denominador = antes - 2 * pico + depois
+    return np.where(denominador < 0, 0.5 * (antes - depois) / np.where(denominador < 0, denominador, 1), 0.0)
+
+  pico = correlacao[k, iy + 1, ix + 1]
+  dx = ix - d + subpixel(correlacao[k, iy + 1, ix], pico, correlacao[k, iy + 1, ix + 2])
+  dy = iy - d + subpixel(correlacao[k, iy, ix + 1], pico, correlacao[k, iy + 2, ix + 1])
+  return dx, dy
+
+
+'''
+Correlação normalizada entre a âncora de referência e a região da imagem deslocada de (dx, dy) (arredondados),
+para cada âncora. É a medida de qualidade do alinhamento (1: idênticas).
+'''
+def correlacoes(janelas, janelas_referencia, dx, dy):
+  d, lado = DESLOCAMENTO_MAX, TAMANHO_ANCORA
+  referencia = janelas_referencia[:, d:d + lado, d:d + lado]
+  regioes = np.empty_like(referencia)
+  for i, (x, y) in enumerate(zip(np.rint(dx).astype(int), np.rint(dy).astype(int))):
+    regioes[i] = janelas[i, d + y:d + y + lado, d + x:d + x + lado]
+  referencia = referencia - referencia.mean(axis=(1, 2), keepdims=True)
+  regioes = regioes - regioes.mean(axis=(1, 2), keepdims=True)
+  normas = np.sqrt((referencia ** 2).sum(axis=(1, 2)) * (regioes ** 2).sum(axis=(1, 2)))
+  return np.where(normas > 0, (referencia * regioes).sum(axis=(1, 2)) / np.where(normas > 0, normas, 1), 0.0)
+
+
+'''
+Estima o alinhamento de uma imagem com a referência do seu layout (`modelo`, um item de carregar_ancoras).
+Com escala=True (e pelo menos 3 âncoras confiáveis) ajusta também uma escala: x' = escala * x + dx (idem para y),
+por mínimos quadrados nos deslocamentos das âncoras; sem isso, o deslocamento é a mediana das âncoras confiáveis.
+Retorna {'dx', 'dy', 'escala', 'qualidade', 'ancoras'}: qualidade é a mediana da correlação normalizada das âncoras
+já alinhadas e 'ancoras' o número de âncoras usadas (acima de CORRELACAO_ANCORA).
+'''
+def estimar_alinhamento(img, modelo, escala=False):
+  ancoras = modelo['ancoras']
+  if not len(ancoras):
+    return {'dx': 0.0, 'dy': 0.0, 'escala': 1.0, 'qualidade': 0.0, 'ancoras': 0}
+  janelas = janelas_ancoras(img, ancoras)
+  dx, dy = deslocamentos(janelas, modelo['espectro'])
+  correlacao = correlacoes(janelas, modelo['janelas'], dx, dy)
+  confiaveis = correlacao >= CORRELACAO_ANCORA
+  resultado = {'dx': 0.0, 'dy': 0.0, 'escala': 1.0, 'qualidade': float(np.median(correlacao)),
+               'ancoras': int(confiaveis.sum())}
+  if not confiaveis.any():
+    return resultado
+  resultado['dx'], resultado['dy'] = float(np.median(dx[confiaveis])), float(np.median(dy[confiaveis]))
+
+  if escala and confiaveis.sum() >= 3:
+    centros = ancoras[confiaveis] + TAMANHO_ANCORA / 2
+    n = len(centros)
+    a = np.zeros((2 * n, 3))
+    a[:n, 0], a[:n, 1] = centros[:, 0], 1
+    a[n:, 0], a[n:, 2] = centros[:, 1], 1
+    k, tx, ty = np.linalg.lstsq(a, np.concatenate([dx[confiaveis], dy[confiaveis]]), rcond=None)[0]
+    if abs(k) <= ESCALA_MAX:
+      resultado.update(dx=float(tx), dy=float(ty), escala=float(1 + k))
+  return resultado
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3 or sys.argv[1] not in ('calibrar', 'medir'):
+    print('Uso: python alinhamento.py calibrar <diretorio_imagens> [arquivo_saida]')
+    print('     python alinhamento.py medir <imagem> [<imagem> ...]')
+    sys.exit(1)
+  import sarmento_ocr as so
+  raiz = os.path.dirname(os.path.abspath(__file__))
+
+  if sys.argv[1] == 'calibrar':
+    from layout import exemplos_rotulados
+    exemplos = exemplos_rotulados(sys.argv[2], os.path.join(raiz, 'ground_truth.csv'))
+
+    def imagens_exemplos():
+      # Cada imagem é fechada assim que calibrar_ancoras passa para a seguinte
+      for caminho, padrao in exemplos:
+        with Image.open(caminho) as img:
+          yield img, padrao
+
+    modelos = calibrar_ancoras(imagens_exemplos(), so.obter_registro())
+    saida = sys.argv[3] if len(sys.argv) > 3 else os.path.join(raiz, ANCORAS_FILE)
+    salvar_ancoras(saida, modelos)
+    for padrao, modelo in sorted(modelos.items()):
+      print('padrão %d: %d âncoras, referência %dx%d' % ((padrao, len(modelo['ancoras'])) + modelo['tamanho']))
+    print('Âncoras de %d layouts (%d exemplos) gravadas em %s' % (len(modelos), len(exemplos), saida))
+  else:
+    so.diretorio_raiz = raiz
+    so.carregar_layouts(raiz)
+    if not so.ancoras_layout:
+      print('Sem âncoras de layout: execute "python alinhamento.py calibrar <diretorio_imagens>" antes')
+      sys.exit(1)
+    if not so.modelos_layout:
+      so.obter_reader()
+    for caminho in sys.argv[2:]:
+      with Image.open(caminho) as img:
+        padrao, _ = so.detectar_padrao(img)
+        _, alinhamento = so.alinhar_layout(img, padrao)
+      print(caminho, 'padrão', padrao, alinhamento)
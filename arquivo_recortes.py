@@ -0,0 +1,140 @@
+# Gravação assíncrona dos recortes (imagens das regiões lidas pelo OCR), fora do caminho crítico do OCR
+
+import io
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+import numpy as np
+from PIL import Image
+
+from dataset_recortes import EscritorDataset
+
+
+FORMATOS_ARQUIVO = ('', 'tar', 'zip', 'dataset')  # '' grava cada recorte como um .jpg solto; 'tar'/'zip' agrupa os recortes de cada exame;
+                                                  # 'dataset' empacota os recortes da execução (ver dataset_recortes.py)
+
+fila = None               # Fila de exames com recortes aguardando gravação
+thread = None             # Thread que consome a fila e grava em disco
+pendentes = threading.local() # pendentes.recortes: recortes do exame em andamento na thread, [(nome do arquivo, imagem, campo, valor, confiança)]
+nome_execucao = 'recortes' # Diretório (em RECORTES_DIR) do conjunto empacotado da execução atual, no formato 'dataset'
+escritor_dataset = None   # Parte do conjunto empacotado deste processo, aberta na primeira gravação
+
+
+'''
+Inicia a thread de gravação. `tamanho_fila` limita quantos exames podem aguardar gravação;
+quando a fila está cheia, o OCR espera (evita acumular imagens na memória se o disco for mais lento).
+'''
+def iniciar_gravador(tamanho_fila=64):
+  global fila, thread
+  if thread is not None:
+    return
+  fila = queue.Queue(maxsize=tamanho_fila)
+  thread = threading.Thread(target=_consumir_fila, name='gravador-recortes', daemon=True)
+  thread.start()
+
+
+'''
+Aguarda a gravação de todos os recortes enfileirados e encerra a thread.
+'''
+def encerrar_gravador():
+  global fila, thread
+  if thread is None:
+    return
+  fila.put(None)
+  thread.join()
+  fila = None
+  thread = None
+  _fechar_dataset()
+
+
+def _fechar_dataset():
+  global escritor_dataset
+  if escritor_dataset is not None:
+    escritor_dataset.fechar()
+    escritor_dataset = None
+
+
+'''
+Começa os recortes de um exame na thread atual, descartando o que tiver sobrado de um exame anterior que falhou.
+O OCR de um exame roda inteiro em uma única thread (etapa_ocr, ou a requisição no servico_ocr.py), por isso os
+recortes ficam com a thread e não com o paciente: exames simultâneos do mesmo paciente não se misturam.
+'''
+def iniciar_exame():
+  pendentes.recortes = []
+
+
+'''
+Guarda um recorte do exame em andamento na thread. Nada é gravado até finalizar_exame.
+campo, valor e conf vão para o índice do formato 'dataset' (nos outros formatos o valor já está no nome do arquivo).
+'''
+def adicionar_recorte(nome_arquivo, img, campo=None, valor=None, conf=None):
+  if getattr(pendentes, 'recortes', None) is None:
+    pendentes.recortes = []
+  pendentes.recortes.append((nome_arquivo, img, campo, valor, conf))
+
+
+'''
+Envia os recortes do exame em andamento na thread para a thread de gravação.
+- diretorio: diretório de destino (RECORTES_DIR);
+- formato: '' para arquivos .jpg soltos, 'tar' ou 'zip' para um único arquivo "<nome_exame>.tar/.zip" por exame,
+  'dataset' para o conjunto empacotado em "<diretorio>/<nome_execucao>";
+- nome_exame: nome do arquivo .tar/.zip, único por exame (o paciente_base é o mesmo para todos os exames de um
+  paciente, e o arquivo de um exame substituiria o do anterior); sem ele, é usado o paciente_base.
+'''
+def finalizar_exame(paciente_base, diretorio, formato='', nome_exame=None):
+  recortes = getattr(pendentes, 'recortes', None)
+  pendentes.recortes = None
+  if not recortes:
+    return
+  if thread is None:
+    iniciar_gravador()
+  fila.put((paciente_base, diretorio, formato, recortes, nome_exame or paciente_base))
+
+
+'''
+Os recortes podem chegar como PIL.Image ou como array (pré-processamento em lote); a conversão é feita aqui, fora do OCR.
+'''
+def _imagem(img):
+  return Image.fromarray(img) if isinstance(img, np.ndarray) else img
+
+
+def _jpeg(img):
+  img = _imagem(img)
+  buffer = io.BytesIO()
+  img.save(buffer, format='JPEG')
+  return buffer.getvalue()
+
+
+def _gravar_exame(paciente_base, diretorio, formato, recortes, nome_exame):
+  global escritor_dataset
+  if formato == 'dataset':
+    if escritor_dataset is None:
+      escritor_dataset = EscritorDataset(os.path.join(diretorio, nome_execucao))
+    escritor_dataset.gravar_exame(paciente_base, [(campo, valor, conf, img) for _, img, campo, valor, conf in recortes])
+  elif formato == 'tar':
+    with tarfile.open(os.path.join(diretorio, nome_exame + '.tar'), 'w') as tar:
+      for nome, img, *_ in recortes:
+        dados = _jpeg(img)
+        info = tarfile.TarInfo(nome)
+        info.size = len(dados)
+        tar.addfile(info, io.BytesIO(dados))
+  elif formato == 'zip':
+    with zipfile.ZipFile(os.path.join(diretorio, nome_exame + '.zip'), 'w', zipfile.ZIP_STORED) as zf:
+      for nome, img, *_ in recortes:
+        zf.writestr(nome, _jpeg(img))
+  else:
+    for nome, img, *_ in recortes:
+      _imagem(img).save(os.path.join(diretorio, nome))
+
+
+def _consumir_fila():
+  while True:
+    item = fila.get()
+    if item is None:
+      break
+    try:
+      _gravar_exame(*item)
+    except Exception as e:
+      print('erro ao gravar os recortes de "%s"' % item[0], e)
@@ -0,0 +1,202 @@
+# Avaliação de acurácia e desempenho do pipeline sobre as imagens rotuladas no ground_truth.csv
+# Uso: python avaliacao.py <diretorio_imagens> [--mag 4] [--bin 200] [--blur 1] [--adaptativo] [--limite N] [--saida resultado.json]
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from PIL import Image
+
+import sarmento_ocr as so
+import ocr_adaptativo
+import reconciliacao
+from layout import exemplos_rotulados
+from saida import abrir_escritor
+
+
+FAIXAS_CONFIANCA = 10     # Número de faixas de confiança (0-0.1, 0.1-0.2, ...) na tabela de calibração
+
+
+'''
+Acumula tempos (em segundos) por etapa e por campo.
+'''
+def _somar(tempos, chave, inicio):
+  duracao = time.perf_counter() - inicio
+  tempos[chave] = tempos.get(chave, 0.0) + duracao
+  return duracao
+
+
+'''
+Processa uma imagem campo a campo, como getting_infos_data/getting_exam_data/getting_maps_data, medindo cada etapa.
+Com OCR_ADAPTATIVO os níveis seguintes pré-processam o recorte de novo, e esse tempo é contado como OCR.
+Retorna o row_data e a lista de (campo, grupo, valor, confiança) lidos. Como no sarmento_ocr, a imagem não passa pelo
+OCR se o layout não foi reconhecido (LAYOUT_DESCONHECIDO) ou não está no registro de layouts, ou se o alinhamento ficou
+abaixo de ALINHAMENTO_QUALIDADE_MINIMA; nesses casos retorna o motivo ('sem_layout' ou 'desalinhada').
+'''
+def processar_imagem(img, tempos_etapa, tempos_campo):
+  inicio = time.perf_counter()
+  padrao, _ = so.detectar_padrao(img)
+  _somar(tempos_etapa, 'layout', inicio)
+  inicio = time.perf_counter()
+  tabela, alinhamento = so.alinhar_layout(img, padrao)
+  _somar(tempos_etapa, 'alinhamento', inicio)
+  if tabela is None:
+    return 'sem_layout'
+  if alinhamento is not None and alinhamento['qualidade'] < so.ALINHAMENTO_QUALIDADE_MINIMA:
+    return 'desalinhada'
+
+  grupos = [
+    ('info', so.info_crops(tabela), so.recorte_info),
+    ('exame', so.exam_crops(tabela), so.recorte_exame),
+    ('mapa', so.get_map_crops(tabela), so.recorte_mapa),
+  ]
+  formatos = tabela.formatos
+
+  row_data = so.colunas_alinhamento(alinhamento) if alinhamento is not None else {}
+  leituras = []
+  for grupo, pontos, preprocessa in grupos:
+    for k, v in (pontos or {}).items():
+      nivel = None
+      if so.OCR_ADAPTATIVO:
+        nivel = so.OCR_NIVEIS[ocr_adaptativo.nivel_inicial(so.OCR_NIVEIS, formatos.get(k), grupo != 'info')]
+      inicio = time.perf_counter()
+      pronto = preprocessa(img, v, nivel)
+      t_pre = _somar(tempos_etapa, 'preprocessamento', inicio)
+
+      # O primeiro nível usa o recorte já pré-processado (e medido) acima
+      def preprocessa_medido(img, v, n, pronto=pronto, preprocessa=preprocessa, nivel=nivel):
+        return pronto if n is nivel else preprocessa(img, v, n)
+
+      inicio = time.perf_counter()
+      _, ocr_result = so.ler_campo(img, k, v, grupo, preprocessa_medido, formatos.get(k))
+      t_ocr = _somar(tempos_etapa, 'ocr', inicio)
+      tempos_campo[k] = tempos_campo.get(k, 0.0) + t_pre + t_ocr
+
+      valor = ocr_result[0][1] if ocr_result else ''
+      conf = None
+      if grupo != 'info':
+        conf = float(ocr_result[0][2]) if ocr_result else 0.0
+        row_data[k + '_conf'] = conf
+      row_data[k] = valor
+      leituras.append((k, grupo, valor, conf))
+  return row_data, leituras
+
+
+'''
+Tabela de calibração: para cada faixa de confiança, a quantidade de leituras, a confiança média e a acurácia observada.
+Também calcula o erro de calibração esperado (ECE), a média das diferenças |acurácia - confiança| ponderada pelas faixas.
+'''
+def calibracao(pares):
+  faixas = []
+  ece = 0.0
+  for i in range(FAIXAS_CONFIANCA):
+    minimo, maximo = i / FAIXAS_CONFIANCA, (i + 1) / FAIXAS_CONFIANCA
+    na_faixa = [(c, a) for c, a in pares if minimo <= c < maximo or (i == FAIXAS_CONFIANCA - 1 and c == 1.0)]
+    if not na_faixa:
+      continue
+    conf_media = sum(c for c, _ in na_faixa) / len(na_faixa)
+    acuracia = sum(a for _, a in na_faixa) / len(na_faixa)
+    ece += len(na_faixa) / len(pares) * abs(acuracia - conf_media)
+    faixas.append({'faixa': [minimo, maximo], 'n': len(na_faixa), 'confianca_media': conf_media, 'acuracia': acuracia})
+  return {'faixas': faixas, 'ece': ece}
+
+
+'''
+Executa a avaliação sobre as imagens de `diretorio_imagens` presentes no ground truth e devolve o relatório (dicionário).
+Imagens sem layout reconhecido ou desalinhadas ficam fora da saída (como no sarmento_ocr) e são listadas em
+'imagens_sem_layout' e 'imagens_desalinhadas'; as médias por imagem consideram só as imagens processadas.
+'''
+def avaliar(diretorio_imagens, limite=None):
+  exemplos = exemplos_rotulados(diretorio_imagens, os.path.join(so.diretorio_raiz, 'ground_truth.csv'))[:limite]
+  tempos_etapa = {}
+  tempos_campo = {}
+  recusadas = {'sem_layout': [], 'desalinhada': []}
+
+  with tempfile.TemporaryDirectory() as temporario:
+    caminho_saida = os.path.join(temporario, 'saida.csv')
+    escritor = abrir_escritor('csv', caminho_saida, so.esquema_saida())
+    inicio_total = time.perf_counter()
+    for caminho, _ in exemplos:
+      img = Image.open(caminho)
+      img.load()
+      resultado = processar_imagem(img, tempos_etapa, tempos_campo)
+      if isinstance(resultado, str):
+        print('%s no arquivo "%s"' % ('layout não reconhecido' if resultado == 'sem_layout' else 'imagem desalinhada do layout', caminho))
+        recusadas[resultado].append(os.path.relpath(caminho, diretorio_imagens))
+        continue
+      row_data, _ = resultado
+
+      inicio = time.perf_counter()
+      escritor.escrever(caminho, [os.path.basename(os.path.dirname(caminho)), row_data])
+      _somar(tempos_etapa, 'saida', inicio)
+    tempo_total = time.perf_counter() - inicio_total
+    escritor.fechar()
+
+    # Acurácia: a saída gravada é comparada com o ground truth de uma vez (reconciliacao.py)
+    leituras = reconciliacao.carregar_saida(caminho_saida)
+    ground_truth = reconciliacao.carregar_ground_truth(os.path.join(so.diretorio_raiz, 'ground_truth.csv'),
+                                                       leituras['campo'].cat.categories)
+    tabela = reconciliacao.reconciliar(leituras, ground_truth)
+
+  n_imagens = len(exemplos) - len(recusadas['sem_layout']) - len(recusadas['desalinhada'])
+  n_campos = len(tabela)
+  por_campo = reconciliacao.acuracia(tabela, ['campo'])
+  por_grupo = reconciliacao.acuracia(tabela, ['grupo'])
+  com_confianca = tabela[tabela['conf'].notna()]
+  pares_confianca = list(zip(com_confianca['conf'].tolist(), com_confianca['acerto'].tolist()))
+  return {
+    'parametros': {'IMG_MAG': so.IMG_MAG, 'BIN_THRESHOLD': so.BIN_THRESHOLD, 'IMG_BLUR': so.IMG_BLUR,
+                   'OCR_CACHE': so.OCR_CACHE,
+                   'OCR_ADAPTATIVO': so.OCR_ADAPTATIVO, 'OCR_NIVEIS': so.OCR_NIVEIS if so.OCR_ADAPTATIVO else None,
+                   'OCR_BACKEND': so.OCR_BACKEND, 'OCR_THREADS': so.OCR_THREADS},
+    'imagens': n_imagens,
+    'imagens_sem_layout': recusadas['sem_layout'],
+    'imagens_desalinhadas': recusadas['desalinhada'],
+    'imagens_por_segundo': n_imagens / tempo_total if tempo_total else 0,
+    'ms_por_imagem': 1000 * tempo_total / n_imagens if n_imagens else 0,
+    'ms_por_etapa': {etapa: 1000 * t / n_imagens for etapa, t in tempos_etapa.items()} if n_imagens else {},
+    'ms_por_campo': {k: 1000 * t / n_imagens for k, t in tempos_campo.items()} if n_imagens else {},
+    'acuracia_total': int(tabela['acerto'].sum()) / n_campos if n_campos else 0,
+    'acuracia_por_campo': {r.campo: {'n': int(r.n), 'acertos': int(r.acertos), 'acuracia': float(r.acuracia)}
+                           for r in por_campo.itertuples()},
+    'acuracia_por_grupo': {r.grupo: {'n': int(r.n), 'acertos': int(r.acertos), 'acuracia': float(r.acuracia)}
+                           for r in por_grupo.itertuples()},
+    'calibracao': calibracao(pares_confianca) if pares_confianca else None,
+    'niveis': [{'nivel': nivel, 'leituras': ocr_adaptativo.contadores['tentativas'][i],
+                'aceitas': ocr_adaptativo.contadores['aceitas'][i]} for i, nivel in enumerate(so.OCR_NIVEIS)]
+              if so.OCR_ADAPTATIVO else None,
+  }
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Avaliação de acurácia e desempenho do OCR contra o ground_truth.csv')
+  parser.add_argument('diretorio', help='diretório com as subpastas de imagens rotuladas')
+  parser.add_argument('--mag', type=int, default=so.IMG_MAG, help='fator de ampliação (IMG_MAG)')
+  parser.add_argument('--bin', type=int, default=so.BIN_THRESHOLD, help='limiar de binarização (BIN_THRESHOLD)')
+  parser.add_argument('--blur', type=float, default=so.IMG_BLUR, help='intensidade do desfoque (IMG_BLUR)')
+  parser.add_argument('--adaptativo', action='store_true', help='usa a releitura adaptativa por níveis (OCR_ADAPTATIVO)')
+  parser.add_argument('--backend', choices=so.backends_ocr.BACKENDS, default=so.OCR_BACKEND, help='backend de OCR (OCR_BACKEND)')
+  parser.add_argument('--threads', type=int, default=so.OCR_THREADS, help='threads de CPU do leitor (OCR_THREADS)')
+  parser.add_argument('--limite', type=int, default=None, help='avalia apenas as N primeiras imagens')
+  parser.add_argument('--cache', action='store_true', help='usa o cache de OCR (os tempos de OCR deixam de ser representativos)')
+  parser.add_argument('--saida', default=None, help='arquivo JSON com o relatório (padrão: saída padrão)')
+  args = parser.parse_args()
+
+  so.IMG_MAG, so.BIN_THRESHOLD, so.IMG_BLUR = args.mag, args.bin, args.blur
+  so.OCR_CACHE = args.cache
+  so.OCR_ADAPTATIVO = args.adaptativo
+  so.OCR_BACKEND, so.OCR_THREADS = args.backend, args.threads
+  ocr_adaptativo.iniciar_contadores(len(so.OCR_NIVEIS))
+  so.diretorio_raiz = os.path.dirname(os.path.abspath(so.__file__))
+  so.carregar_layouts(so.diretorio_raiz)
+  if so.OCR_CACHE:
+    so.abrir_cache_ocr(so.diretorio_raiz)
+  so.obter_reader()
+
+  relatorio = json.dumps(avaliar(args.diretorio, args.limite), indent=2, ensure_ascii=False)
+  if args.saida:
+    with open(args.saida, 'w', encoding='utf-8') as f:
+      f.write(relatorio)
+  else:
+    print(relatorio)
@@ -0,0 +1,177 @@
+# Backends de OCR: implementações do leitor usado por sarmento_ocr (mesma interface do easyocr.Reader: readtext e recognize)
+#
+# - 'easyocr': o easyocr.Reader original, em PyTorch (referência de acurácia). Na CPU o EasyOCR já aplica a quantização
+#   dinâmica int8 do torch (quantize=True) ao detector e ao reconhecedor: é essa a linha de base da CPU;
+# - 'onnx': o mesmo easyocr.Reader na CPU, com o modelo de reconhecimento exportado para ONNX, quantizado para int8
+#   (quantização dinâmica dos pesos) e executado pelo ONNX Runtime. O detector de texto (CRAFT) continua em PyTorch,
+#   igual ao do 'easyocr'. Requer onnx e onnxruntime (pip install onnx onnxruntime). O modelo é exportado em fp32 a
+#   partir do reconhecedor sem quantização (quantize=False; os módulos quantizados do torch não são exportáveis) e
+#   quantizado na primeira execução (preparar_modelos); os dois arquivos ficam em DIRETORIO_MODELOS e as execuções
+#   seguintes só os carregam;
+# - 'onnx_fp32': como 'onnx', mas com o modelo fp32 exportado, sem a quantização; separa, na comparação com o
+#   'easyocr' (benchmark.py backends), o efeito do ONNX Runtime do efeito da quantização int8.
+
+import contextlib
+import os
+
+
+BACKENDS = ('easyocr', 'onnx', 'onnx_fp32')
+DIRETORIO_MODELOS = 'modelos_onnx'  # Diretório (relativo ao diretório raiz) dos modelos ONNX exportados
+LARGURA_EXPORTACAO = 256            # Largura do recorte usado na exportação (a largura é dinâmica no modelo exportado)
+
+
+'''
+Cria o leitor do backend `backend`.
+- idiomas: idiomas do EasyOCR (ex: ['pt']);
+- gpu: usa a GPU no backend 'easyocr' (os backends ONNX são sempre CPU);
+- threads: threads de CPU usadas pelo leitor (torch e ONNX Runtime); 0 mantém o padrão das bibliotecas;
+- raiz: diretório raiz, onde fica DIRETORIO_MODELOS;
+- fp32: exige o reconhecedor sem quantização int8 (usado pelo OCR em lote, ver ocr_lote.py): no 'easyocr' na CPU
+  o reader é criado com quantize=False; o 'onnx' (int8) não é aceito.
+O reader recebe o atributo reconhecedor_fp32, que indica se o reconhecedor é fp32.
+'''
+def criar_reader(backend='easyocr', idiomas=('pt',), gpu=False, threads=0, raiz='.', fp32=False):
+  if backend not in BACKENDS:
+    raise ValueError('backend de OCR desconhecido: %s (opções: %s)' % (backend, ', '.join(BACKENDS)))
+  if fp32 and backend == 'onnx':
+    raise ValueError("o backend 'onnx' tem o reconhecedor int8; com o OCR em lote use 'easyocr' ou 'onnx_fp32'")
+  import easyocr
+  if threads:
+    import torch
+    torch.set_num_threads(threads)
+  if backend == 'easyocr':
+    reader = easyocr.Reader(list(idiomas), gpu=gpu, quantize=not fp32)
+    reader.reconhecedor_fp32 = fp32 or reader.device != 'cpu'  # O EasyOCR só quantiza na CPU
+    return reader
+
+  caminho = preparar_modelos(backend, idiomas, raiz)
+  reader = easyocr.Reader(list(idiomas), gpu=False)
+  reader.recognizer = ReconhecedorOnnx(caminho, threads)
+  reader.reconhecedor_fp32 = backend == 'onnx_fp32'
+  return reader
+
+
+'''
+Exporta (e, no backend 'onnx', quantiza) o modelo ONNX do reconhecedor, se ainda não existir em DIRETORIO_MODELOS, e
+retorna o caminho do modelo usado pelo backend ('easyocr' não tem modelo: retorna None).
+Com vários processos (N_PROCESSOS > 1) deve ser chamada no processo principal antes de criar o pool, para que os
+processos só carreguem o modelo. A exportação é feita sob uma trava de arquivo (travar_diretorio), para que execuções
+simultâneas não exportem o mesmo modelo ao mesmo tempo, e cada arquivo é gravado com um nome temporário e renomeado
+(os.replace) no fim, para que nenhum leitor carregue um modelo pela metade.
+'''
+def preparar_modelos(backend, idiomas=('pt',), raiz='.'):
+  if backend == 'easyocr':
+    return None
+  diretorio = os.path.join(raiz, DIRETORIO_MODELOS)
+  caminho_fp32 = os.path.join(diretorio, 'reconhecedor_%s_fp32.onnx' % '_'.join(idiomas))
+  caminho_int8 = caminho_fp32.replace('_fp32.onnx', '_int8.onnx')
+  caminho = caminho_int8 if backend == 'onnx' else caminho_fp32
+  if os.path.exists(caminho):
+    return caminho
+  os.makedirs(diretorio, exist_ok=True)
+  with travar_diretorio(diretorio):
+    if not os.path.exists(caminho_fp32):
+      import easyocr
+      # Só o reconhecedor, sem a quantização do torch (os módulos quantizados do torch não são exportáveis)
+      original = easyocr.Reader(list(idiomas), gpu=False, quantize=False, detector=False, verbose=False)
+      gravar_atomico(caminho_fp32, lambda temporario: exportar_reconhecedor(original, temporario))
+    if not os.path.exists(caminho):
+      gravar_atomico(caminho, lambda temporario: quantizar_modelo(caminho_fp32, temporario))
+  return caminho
+
+
+'''
+Trava exclusiva do diretório dos modelos entre processos (fcntl.flock no arquivo .trava), liberada ao sair do bloco.
+Sem fcntl (Windows) não há trava: a exportação antes do pool e o os.replace de gravar_atomico continuam valendo.
+'''
+@contextlib.contextmanager
+def travar_diretorio(diretorio):
+  try:
+    import fcntl
+  except ImportError:
+    yield
+    return
+  with open(os.path.join(diretorio, '.trava'), 'w') as trava:
+    fcntl.flock(trava, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(trava, fcntl.LOCK_UN)
+
+
+'''
+Executa gravar(caminho temporário) e renomeia o arquivo gravado para `caminho`; o temporário é removido em caso de erro.
+'''
+def gravar_atomico(caminho, gravar):
+  temporario = '%s.%d.tmp.onnx' % (caminho[:-len('.onnx')], os.getpid())
+  try:
+    gravar(temporario)
+    os.replace(temporario, caminho)
+  finally:
+    if os.path.exists(temporario):
+      os.remove(temporario)
+
+
+'''
+Exporta o modelo de reconhecimento do reader (PyTorch, criado com quantize=False) para ONNX, com lote e largura do
+recorte dinâmicos. A altura é a do EasyOCR (easyocr.easyocr.imgH). O modelo é exportado pelo exportador TorchScript
+(dynamo=False): o exportador dynamo fixa no grafo o número de passos da largura de exemplo. Esse exportador não aceita
+o AdaptiveAvgPool2d((None, 1)) do EasyOCR, que só tira a média na altura; o modelo exportado faz essa média direto e
+tem uma única entrada (a imagem), já que a entrada de texto não é usada na inferência.
+'''
+def exportar_reconhecedor(reader, caminho):
+  import torch
+  import easyocr.easyocr
+  modelo = reader.recognizer.module if hasattr(reader.recognizer, 'module') else reader.recognizer
+
+  class Exportavel(torch.nn.Module):
+    def __init__(self):
+      super().__init__()
+      self.modelo = modelo
+
+    def forward(self, imagem):
+      visual = self.modelo.FeatureExtraction(imagem).permute(0, 3, 1, 2).mean(3)
+      return self.modelo.Prediction(self.modelo.SequenceModeling(visual).contiguous())
+
+  exportavel = Exportavel().to('cpu').eval()
+  imagem = torch.rand(1, 1, easyocr.easyocr.imgH, LARGURA_EXPORTACAO)
+  with torch.no_grad():
+    torch.onnx.export(exportavel, (imagem,), caminho, input_names=['imagem'], output_names=['saida'],
+                      dynamic_axes={'imagem': {0: 'lote', 3: 'largura'}, 'saida': {0: 'lote', 1: 'passos'}},
+                      opset_version=17, dynamo=False)
+
+
+'''
+Quantização dinâmica para int8 dos pesos das camadas que o EasyOCR quantiza no torch (LSTM e lineares, que viram MatMul);
+as ativações continuam em float. As convoluções ficam em fp32: a ConvInteger do ONNX Runtime é mais lenta que a Conv.
+'''
+def quantizar_modelo(caminho_fp32, caminho_int8):
+  from onnxruntime.quantization import quantize_dynamic, QuantType
+  quantize_dynamic(caminho_fp32, caminho_int8, weight_type=QuantType.QInt8, op_types_to_quantize=['MatMul', 'LSTM', 'Gemm'])
+
+
+'''
+Substituto do reader.recognizer (torch.nn.Module) para o EasyOCR: recebe o lote de recortes como tensor e
+devolve as predições como tensor, executando o modelo ONNX. O EasyOCR chama eval() e depois modelo(imagem, texto);
+o texto só é repassado a modelos exportados com essa entrada.
+'''
+class ReconhecedorOnnx:
+  def __init__(self, caminho, threads=0):
+    import onnxruntime as ort
+    opcoes = ort.SessionOptions()
+    opcoes.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opcoes.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if threads:
+      opcoes.intra_op_num_threads = threads
+      opcoes.inter_op_num_threads = 1
+    self.sessao = ort.InferenceSession(caminho, opcoes, providers=['CPUExecutionProvider'])
+    self.entradas = [e.name for e in self.sessao.get_inputs()]
+
+  def eval(self):
+    return self
+
+  def __call__(self, imagem, texto=None):
+    import torch
+    valores = {'imagem': imagem.cpu().numpy(), 'texto': None if texto is None else texto.cpu().numpy()}
+    saida = self.sessao.run(None, {nome: valores[nome] for nome in self.entradas})[0]
+    return torch.from_numpy(saida)
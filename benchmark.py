@@ -0,0 +1,415 @@
+# Micro-benchmarks das etapas do pipeline de OCR
+# Uso: python benchmark.py <nome> [argumentos]   (ex: python benchmark.py binarizacao)
+
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+from binarizacao import binarize
+
+
+'''
+Implementação original da binarização (laço pixel a pixel com getpixel/putpixel).
+Mantida aqui apenas como referência para comparar resultado e tempo com binarizacao.binarize.
+'''
+def binarize_laco(img, thresh=200):
+  img=img.convert('L')
+  width,height=img.size
+  for x in range(width):
+    for y in range(height):
+      if img.getpixel((x,y)) < thresh:
+        img.putpixel((x,y),0)
+      else:
+        img.putpixel((x,y),255)
+  return img
+
+
+'''
+Gera um recorte sintético em tons de cinza com o tamanho informado, já ampliado como no pipeline (IMG_MAG).
+'''
+def recorte_sintetico(largura, altura, mag=4, seed=0):
+  rng = np.random.default_rng(seed)
+  arr = rng.integers(0, 256, size=(altura, largura), dtype=np.uint8)
+  img = Image.fromarray(arr, mode='L')
+  return img.resize((largura*mag, altura*mag), Image.Resampling.LANCZOS)
+
+
+'''
+Mede o tempo médio (em ms) de `funcao(*args)` ao longo de `repeticoes` execuções.
+'''
+def cronometrar(funcao, *args, repeticoes=5):
+  inicio = time.perf_counter()
+  for _ in range(repeticoes):
+    funcao(*args)
+  return (time.perf_counter() - inicio) * 1000 / repeticoes
+
+
+'''
+Compara a binarização antiga com a vetorizada, por recorte (tamanho típico 38x18) e por exame
+(todos os campos de exam_crops do padrão 1). Também confere que as saídas são idênticas bit a bit.
+'''
+def benchmark_binarizacao(thresh=200):
+  from sarmento_ocr import exam_crops, IMG_MAG
+
+  recorte = recorte_sintetico(38, 18, IMG_MAG)
+  assert binarize_laco(recorte, thresh).tobytes() == binarize(recorte, thresh).tobytes()
+  t_laco = cronometrar(binarize_laco, recorte, thresh)
+  t_vetor = cronometrar(binarize, recorte, thresh, repeticoes=200)
+  print('Por recorte (38x18, mag %d): laço %.2f ms | vetorizado %.3f ms | %.0fx' % (IMG_MAG, t_laco, t_vetor, t_laco / t_vetor))
+
+  recortes = [recorte_sintetico(v[2], v[3], IMG_MAG, seed=i) for i, v in enumerate(exam_crops(1).values())]
+  for r in recortes:
+    assert binarize_laco(r, thresh).tobytes() == binarize(r, thresh).tobytes()
+  t_laco = cronometrar(lambda: [binarize_laco(r, thresh) for r in recortes], repeticoes=1)
+  t_vetor = cronometrar(lambda: [binarize(r, thresh) for r in recortes], repeticoes=20)
+  print('Por exame (%d campos): laço %.1f ms | vetorizado %.2f ms | %.0fx' % (len(recortes), t_laco, t_vetor, t_laco / t_vetor))
+
+  for modo in ('otsu', 'adaptativo'):
+    print('Modo %s por exame: %.2f ms' % (modo, cronometrar(lambda: [binarize(r, thresh, modo) for r in recortes], repeticoes=20)))
+
+
+'''
+Tempo de parede (CPU) do OCR dos campos de cada exame, com cada backend de backends_ocr.py, por três caminhos: um
+reader.readtext por campo (caminho padrão, ler_texto), um reader.recognize por campo com a caixa do recorte inteiro
+(a leitura do OCR em lote, sem os lotes) e ocr_lote.reconhecer_lote. Conta os campos em que o lote difere (valor ou
+confiança) do recognize campo a campo e do readtext (que passa pelo detector de texto), que é a equivalência a
+conferir nas imagens reais antes de ligar OCR_LOTE. Como no pipeline com OCR_LOTE, os readers usam o reconhecedor fp32
+(o backend 'onnx', int8, fica de fora).
+Sem imagens, usa recortes sintéticos (recortes_numericos).
+Uso: python benchmark.py ocr_lote [<imagem> ...]
+'''
+def benchmark_ocr_lote(*imagens):
+  import sarmento_ocr as so
+  from ocr_lote import reconhecer_lote, recorte_cinza
+
+  so.OCR_CACHE = False
+  so.diretorio_raiz = so.os.path.dirname(so.__file__)
+  so.OCR_LOTE = True
+  for backend in so.backends_ocr.BACKENDS:
+    if backend == 'onnx':
+      continue
+    so.OCR_BACKEND = backend
+    so.liberar_reader()
+    so.obter_reader(gpu=False)
+    exames = []
+    for caminho in imagens:
+      img = Image.open(caminho)
+      padrao = so.padrao_imagem(img)
+      campos = []
+      for grupo, pontos, preprocessa in (('info', so.info_crops(padrao), so.recorte_info),
+                                         ('exame', so.exam_crops(padrao), so.recorte_exame),
+                                         ('mapa', so.get_map_crops(padrao), so.recorte_mapa)):
+        campos += [(k, recorte_cinza(preprocessa(img, v)), v[4], grupo) for k, v in pontos.items()]
+      exames.append(('%s (padrão %d)' % (caminho, padrao), campos))
+    if not imagens:
+      exames.append(('recortes sintéticos', [(i, arr, '0123456789.', 'exame') for i, (_, arr) in enumerate(recortes_numericos(100))]))
+
+    for nome, campos in exames:
+      inicio = time.perf_counter()
+      por_campo = {k: so.ler_texto(arr, allowlist=allowlist, **so.PARAMETROS_OCR[grupo]) for k, arr, allowlist, grupo in campos}
+      t_readtext = time.perf_counter() - inicio
+
+      inicio = time.perf_counter()
+      por_caixa = {}
+      for k, arr, allowlist, _ in campos:
+        lido = so.reader.recognize(arr, horizontal_list=[[0, arr.shape[1], 0, arr.shape[0]]], free_list=[], allowlist=allowlist or None)
+        por_caixa[k] = (lido[0][1], lido[0][2]) if lido else ('', 0)
+      t_recognize = time.perf_counter() - inicio
+
+      inicio = time.perf_counter()
+      em_lote = reconhecer_lote(so.reader, [(k, arr, allowlist) for k, arr, allowlist, _ in campos])
+      t_lote = time.perf_counter() - inicio
+
+      diferentes = [k for k in por_caixa if por_caixa[k][0] != em_lote[k][0] or abs(por_caixa[k][1] - em_lote[k][1]) > 1e-4]
+      divergentes = [k for k in por_campo if (por_campo[k][0][1] if por_campo[k] else '') != em_lote[k][0]]
+      print('%-9s %s: %d campos | readtext por campo %.0f ms | recognize por campo %.0f ms | lote %.0f ms (%.1fx e %.1fx) | '
+            'lote diferente do recognize em %d e do readtext em %d campos'
+            % (backend, nome, len(campos), t_readtext * 1000, t_recognize * 1000, t_lote * 1000, t_readtext / t_lote,
+               t_recognize / t_lote, len(diferentes), len(divergentes)))
+
+
+'''
+Compara a detecção de layout por OCR (sarmento_ocr.padrao_imagem) com a detecção por miniaturas (layout.detectar_layout)
+nas imagens do ground truth. As referências são calibradas com metade das imagens e avaliadas na outra metade.
+Uso: python benchmark.py layout <diretorio_imagens>
+'''
+def benchmark_layout(diretorio_imagens):
+  import sarmento_ocr as so
+  from layout import exemplos_rotulados, calibrar_layouts, detectar_layout, LAYOUT_DESCONHECIDO
+
+  exemplos = exemplos_rotulados(diretorio_imagens, so.os.path.join(so.os.path.dirname(so.__file__), 'ground_truth.csv'))
+  calibracao, avaliacao = exemplos[0::2], exemplos[1::2]
+  modelos = calibrar_layouts((Image.open(caminho), padrao) for caminho, padrao in calibracao)
+  so.obter_reader(gpu=False)
+
+  for nome, detectar in (('OCR', so.padrao_imagem), ('miniaturas', lambda img: detectar_layout(img, modelos)[0])):
+    acertos = desconhecidos = 0
+    tempo = 0.0
+    for caminho, esperado in avaliacao:
+      img = Image.open(caminho)
+      img.load()
+      inicio = time.perf_counter()
+      padrao = detectar(img)
+      tempo += time.perf_counter() - inicio
+      acertos += padrao == esperado
+      desconhecidos += padrao == LAYOUT_DESCONHECIDO
+    print('%-10s acurácia %.1f%% (%d/%d), %d desconhecidos, %.2f ms por imagem' % (
+      nome, 100 * acertos / len(avaliacao), acertos, len(avaliacao), desconhecidos, 1000 * tempo / len(avaliacao)))
+
+
+'''
+Gera um resultado sintético [pasta, row_data] do padrão 1, com todos os campos preenchidos.
+'''
+def resultado_sintetico(so, i):
+  row_data = {k: 'valor %d' % i for k in so.info_crops(1)}
+  row_data['Eye_2'] = 'OS'
+  for k in list(so.exam_crops(1)) + list(so.get_map_crops(1)):
+    row_data[k] = '%d.%02d' % (500 + i % 100, i % 97)
+    row_data[k + '_conf'] = 0.5 + (i % 50) / 100
+  return ['pasta_%d' % (i // 500), row_data]
+
+
+def _executar_saida(formato, n, diretorio, fila):
+  import resource
+  import sarmento_ocr as so
+  from saida import abrir_escritor
+
+  so.diretorio_raiz = diretorio
+  inicio = time.perf_counter()
+  if formato == 'excel':
+    if not so.create_dataframe([resultado_sintetico(so, i) for i in range(n)]):
+      fila.put(None)  # create_dataframe captura o erro e só o exibe
+      return
+  else:
+    escritor = abrir_escritor(formato, so.os.path.join(diretorio, 'saida.' + formato), so.esquema_saida())
+    for i in range(n):
+      escritor.escrever('exame_%d.png' % i, resultado_sintetico(so, i))
+    escritor.fechar()
+  fila.put((time.perf_counter() - inicio, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+'''
+Tempo de gravação e pico de memória (RSS) das saídas Excel (create_dataframe), CSV e Parquet para `n` exames sintéticos.
+Cada formato roda em um processo separado para que o pico de memória de um não contamine o do outro.
+Uso: python benchmark.py saida [n]
+'''
+def benchmark_saida(n=10000):
+  import multiprocessing
+  import tempfile
+
+  n = int(n)
+  contexto = multiprocessing.get_context('spawn')
+  for formato in ('excel', 'csv', 'parquet'):
+    with tempfile.TemporaryDirectory() as diretorio:
+      os.makedirs(os.path.join(diretorio, 'output'))
+      fila = contexto.Queue()
+      processo = contexto.Process(target=_executar_saida, args=(formato, n, diretorio, fila))
+      processo.start()
+      processo.join()
+      if processo.exitcode != 0:
+        print('%-8s falhou (código %s)' % (formato, processo.exitcode))
+        continue
+      medida = fila.get()
+      if medida is None:
+        print('%-8s falhou (create_dataframe retornou False)' % formato)
+        continue
+      tempo, rss = medida
+      print('%-8s %d exames: %.2f s, pico de RSS %.0f MB' % (formato, n, tempo, rss))
+
+
+'''
+Tempo de inicialização: importa o sarmento_ocr em um processo novo e confere que easyocr, torch e pandas
+não foram carregados (eles só devem ser importados quando o OCR ou as planilhas forem de fato usados).
+Uso: python benchmark.py inicializacao [repeticoes]
+'''
+def benchmark_inicializacao(repeticoes=5):
+  import subprocess
+
+  codigo = ('import sys, time; t = time.perf_counter(); import sarmento_ocr; t = time.perf_counter() - t; '
+            'print(t, *[m for m in ("easyocr", "torch", "pandas") if m in sys.modules])')
+  diretorio = os.path.dirname(os.path.abspath(__file__))
+  tempos = []
+  for _ in range(int(repeticoes)):
+    inicio = time.perf_counter()
+    saida = subprocess.run([sys.executable, '-c', codigo], cwd=diretorio, capture_output=True, text=True, check=True).stdout.split()
+    tempos.append((time.perf_counter() - inicio, float(saida[0])))
+    carregados = saida[1:]
+  print('processo completo: %.0f ms | import sarmento_ocr: %.0f ms (melhor de %d)' % (
+    1000 * min(t for t, _ in tempos), 1000 * min(t for _, t in tempos), len(tempos)))
+  print('módulos pesados carregados no import: %s' % (', '.join(carregados) or 'nenhum'))
+  assert not carregados, 'o import do sarmento_ocr não deve carregar easyocr/torch/pandas'
+
+
+'''
+Pipeline em etapas (pipeline.py) x processamento sequencial, com etapas simuladas: leitura com a latência de um
+disco de rede (`leitura_ms`), decodificação de uma imagem PNG real do tamanho de um exame e OCR de `ocr_ms`
+(time.sleep, que libera o GIL como o torch). Mostra imagens por segundo de cada forma.
+'''
+def benchmark_pipeline(n=40, leitura_ms=30, ocr_ms=60):
+  import io
+  import pipeline
+  n, leitura_ms, ocr_ms = int(n), float(leitura_ms), float(ocr_ms)
+  buffer = io.BytesIO()
+  Image.fromarray(np.random.default_rng(0).integers(0, 255, (1080, 1920, 3), dtype=np.uint8)).save(buffer, 'PNG')
+  dados = buffer.getvalue()
+
+  def ler(i):
+    time.sleep(leitura_ms / 1000)
+    return dados
+
+  def decodificar(conteudo):
+    img = Image.open(io.BytesIO(conteudo))
+    img.load()
+    return img
+
+  def reconhecer(img):
+    time.sleep(ocr_ms / 1000)
+    return img.size
+
+  inicio = time.perf_counter()
+  sequencial = [reconhecer(decodificar(ler(i))) for i in range(n)]
+  t_sequencial = time.perf_counter() - inicio
+
+  inicio = time.perf_counter()
+  etapas = [('leitura', ler, 2), ('decodificacao', decodificar, 1), ('ocr', reconhecer, 1)]
+  em_etapas = list(pipeline.executar(range(n), etapas, 8))
+  t_pipeline = time.perf_counter() - inicio
+  assert em_etapas == sequencial
+
+  print('sequencial: %.1f imagens/s' % (n / t_sequencial))
+  print('pipeline:   %.1f imagens/s (%.2fx)' % (n / t_pipeline, t_sequencial / t_pipeline))
+
+
+
+'''
+Compara os backends de OCR (backends_ocr.py) na CPU com avaliacao.avaliar: acurácia contra o ground_truth.csv e
+imagens por segundo de cada backend, com o mesmo número de threads. O backend 'easyocr' é a referência.
+'''
+def benchmark_backends(diretorio_imagens, limite=None, threads=0):
+  import avaliacao
+  import sarmento_ocr as so
+  so.diretorio_raiz = os.path.dirname(os.path.abspath(so.__file__))
+  so.carregar_layouts(so.diretorio_raiz)
+  so.OCR_CACHE = False
+  so.OCR_THREADS = int(threads)
+  relatorios = {}
+  for backend in so.backends_ocr.BACKENDS:
+    so.OCR_BACKEND = backend
+    so.liberar_reader()
+    so.obter_reader(gpu=False)
+    relatorios[backend] = avaliacao.avaliar(diretorio_imagens, int(limite) if limite else None)
+  referencia = relatorios['easyocr']
+  for backend, r in relatorios.items():
+    print('%-8s acurácia %.4f (%+.4f) | %.2f imagens/s (%.2fx) | OCR %.0f ms por imagem'
+          % (backend, r['acuracia_total'], r['acuracia_total'] - referencia['acuracia_total'], r['imagens_por_segundo'],
+             r['imagens_por_segundo'] / referencia['imagens_por_segundo'] if referencia['imagens_por_segundo'] else 0,
+             sum(t for etapa, t in r['ms_por_etapa'].items() if etapa.startswith('ocr'))))
+
+
+'''
+Recortes sintéticos com números no formato dos campos do exame (ex: 52.71, 509), já em tons de cinza e ampliados.
+'''
+def recortes_numericos(n, seed=0):
+  from PIL import ImageDraw
+  rng = np.random.default_rng(seed)
+  recortes = []
+  for i in range(n):
+    texto = ('%.2f' % rng.uniform(0, 100)) if i % 2 else str(rng.integers(0, 1000))
+    img = Image.new('L', (8 + 7 * len(texto), 18), 255)  # largura variável, como a dos campos
+    ImageDraw.Draw(img).text((4, 3), texto, fill=0)
+    recortes.append((texto, np.asarray(img.resize((img.width * 4, 72), Image.Resampling.LANCZOS))))
+  return recortes
+
+
+'''
+Compara o reconhecedor de cada backend (backends_ocr.py) na CPU sem precisar de imagens rotuladas: lê os mesmos
+`n` recortes (recortes_numericos) com reader.recognize e mostra o tempo por recorte e a concordância dos textos com a
+linha de base da CPU ('easyocr', com a quantização int8 do torch) e com o reconhecedor fp32 do torch (quantize=False),
+que é o modelo exportado pelos backends ONNX. A acurácia contra o ground truth é medida por "benchmark.py backends".
+Uso: python benchmark.py reconhecedor [n] [threads]
+'''
+def benchmark_reconhecedor(n=200, threads=0):
+  import easyocr
+  import backends_ocr
+  n, threads = int(n), int(threads)
+  recortes = recortes_numericos(n)
+  raiz = os.path.dirname(os.path.abspath(__file__))
+  leitores = [('easyocr', lambda: backends_ocr.criar_reader('easyocr', ('pt',), False, threads, raiz)),
+              ('torch_fp32', lambda: easyocr.Reader(['pt'], gpu=False, quantize=False, verbose=False))]
+  leitores += [(b, lambda b=b: backends_ocr.criar_reader(b, ('pt',), False, threads, raiz))
+               for b in backends_ocr.BACKENDS if b != 'easyocr']
+  textos = {}
+  tempos = {}
+  for nome, criar in leitores:
+    reader = criar()
+    reader.recognize(recortes[0][1], allowlist='0123456789.')  # aquecimento
+    inicio = time.perf_counter()
+    textos[nome] = [reader.recognize(img, allowlist='0123456789.', detail=0)[0] for _, img in recortes]
+    tempos[nome] = (time.perf_counter() - inicio) * 1000 / n
+
+  def concordancia(a, b):
+    return 100 * sum(x == y for x, y in zip(textos[a], textos[b])) / n
+
+  for nome, _ in leitores:
+    print('%-10s %.2f ms por recorte (%.2fx) | igual ao easyocr: %.1f%% | igual ao torch_fp32: %.1f%% | texto certo: %.1f%%'
+          % (nome, tempos[nome], tempos['easyocr'] / tempos[nome], concordancia(nome, 'easyocr'),
+             concordancia(nome, 'torch_fp32'), 100 * sum(t == r[0] for t, r in zip(textos[nome], recortes)) / n))
+
+
+'''
+Lê as páginas de um TIFF de `paginas` páginas e os membros de um .zip com as mesmas páginas, pelos caminhos virtuais
+de entradas.py, e mostra o tempo por página. Confere que os metadados do nome (metadados_arquivo) de cada página e de
+cada membro são os do arquivo original, sem o "::<página>" nem o nome do pacote.
+'''
+def benchmark_entradas(paginas=20):
+  import tempfile
+  import zipfile
+  import entradas
+  import sarmento_ocr as so
+  paginas = int(paginas)
+  # data de nascimento no último campo, onde o "::<página>" ficaria grudado
+  nome = 'X_Silva_Joao_Pedro_123_Pachymetry+CPwr_OD_2021-01-01_10-00-00_M_1990-01-01.tif'
+  rng = np.random.default_rng(0)
+  imagens = [Image.fromarray(rng.integers(0, 255, (480, 640), dtype=np.uint8)) for _ in range(paginas)]
+  with tempfile.TemporaryDirectory() as diretorio:
+    tiff = os.path.join(diretorio, nome)
+    imagens[0].save(tiff, save_all=True, append_images=imagens[1:])
+    pacote = os.path.join(diretorio, 'estudo.zip')
+    with zipfile.ZipFile(pacote, 'w') as z:
+      z.write(tiff, 'OD/' + nome)
+    esperado = so.metadados_arquivo(tiff)
+    assert esperado['fName'] == 'Silva, Joao Pedro' and esperado['fDOB'] == '1990-01-01.tif', esperado
+    for arquivo in (tiff, pacote):
+      inicio = time.perf_counter()
+      caminhos = entradas.expandir(arquivo, ('.tif',))
+      for i, caminho in enumerate(caminhos):
+        img = entradas.abrir_imagem(caminho)
+        assert np.array_equal(np.asarray(img), np.asarray(imagens[i])), caminho
+        assert so.metadados_arquivo(caminho) == esperado, (caminho, so.metadados_arquivo(caminho))
+      tempo = time.perf_counter() - inicio
+      assert len(caminhos) == paginas
+      print('%-11s %d páginas, %.2f ms por página, metadados conferidos (ex: %s)'
+            % (os.path.basename(arquivo), len(caminhos), tempo * 1000 / len(caminhos), caminhos[-1][len(diretorio) + 1:]))
+    entradas.abertos.pacote[1].close()
+    entradas.abertos.pacote = None
+
+
+BENCHMARKS = {
+  'binarizacao': benchmark_binarizacao,
+  'ocr_lote': benchmark_ocr_lote,
+  'layout': benchmark_layout,
+  'saida': benchmark_saida,
+  'inicializacao': benchmark_inicializacao,
+  'pipeline': benchmark_pipeline,
+  'backends': benchmark_backends,
+  'reconhecedor': benchmark_reconhecedor,
+  'entradas': benchmark_entradas,
+}
+
+
+if __name__ == "__main__":
+  nome = sys.argv[1] if len(sys.argv) > 1 else 'binarizacao'
+  print('== %s ==' % nome)
+  BENCHMARKS[nome](*sys.argv[2:])
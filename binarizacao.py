@@ -0,0 +1,86 @@
+# Funções de binarização das imagens recortadas antes do OCR
+
+import numpy as np
+from PIL import Image
+
+
+MODOS_BINARIZACAO = ('fixo', 'otsu', 'adaptativo')
+
+
+'''
+Tabela de consulta (lookup table) usada pelo Image.point no modo de limiar fixo.
+Para cada intensidade de 0 a 255 define o valor de saída: 0 (preto) abaixo do limiar e 255 (branco) a partir dele.
+As tabelas são guardadas por limiar para não serem recriadas a cada recorte.
+'''
+_tabelas_limiar = {}
+
+def tabela_limiar(thresh):
+  tabela = _tabelas_limiar.get(thresh)
+  if tabela is None:
+    tabela = [0 if i < thresh else 255 for i in range(256)]
+    _tabelas_limiar[thresh] = tabela
+  return tabela
+
+
+'''
+Calcula o limiar de Otsu a partir do histograma da imagem em tons de cinza.
+Escolhe o valor que maximiza a variância entre as classes "fundo" e "texto".
+'''
+def limiar_otsu(img):
+  hist = np.asarray(img.convert('L').histogram(), dtype=np.float64)
+  total = hist.sum()
+  if total == 0:
+    return 0
+  niveis = np.arange(256, dtype=np.float64)
+  peso_fundo = np.cumsum(hist)             # Quantidade de pixels com intensidade <= t
+  soma_fundo = np.cumsum(hist * niveis)
+  peso_texto = total - peso_fundo
+  media_fundo = np.divide(soma_fundo, peso_fundo, out=np.zeros(256), where=peso_fundo > 0)
+  media_texto = np.divide(soma_fundo[-1] - soma_fundo, peso_texto, out=np.zeros(256), where=peso_texto > 0)
+  variancia = peso_fundo * peso_texto * (media_fundo - media_texto) ** 2
+  # O pixel vai para o preto quando é menor que o limiar, por isso soma-se 1 ao índice t
+  return int(np.argmax(variancia)) + 1
+
+
+'''
+Binarização adaptativa pela média local.
+Cada pixel é comparado com a média da sua vizinhança (janela de tamanho `bloco`) menos uma constante `c`,
+o que tolera variações de fundo dentro do mesmo recorte. A média é obtida por imagem integral (soma acumulada).
+'''
+def binarize_adaptativo(img, bloco=15, c=10):
+  arr = np.asarray(img.convert('L'), dtype=np.int64)
+  altura, largura = arr.shape
+  r = bloco // 2
+  integral = np.zeros((altura + 1, largura + 1), dtype=np.int64)
+  integral[1:, 1:] = arr.cumsum(axis=0).cumsum(axis=1)
+
+  ys = np.arange(altura)
+  xs = np.arange(largura)
+  y0 = np.clip(ys - r, 0, altura)[:, None]
+  y1 = np.clip(ys + r + 1, 0, altura)[:, None]
+  x0 = np.clip(xs - r, 0, largura)[None, :]
+  x1 = np.clip(xs + r + 1, 0, largura)[None, :]
+  soma = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+  media = soma / ((y1 - y0) * (x1 - x0))
+
+  saida = np.where(arr < media - c, 0, 255).astype(np.uint8)
+  return Image.fromarray(saida, mode='L')
+
+
+'''
+Função de binarização de imagem.
+Converte a imagem para tons de cinza e aplica um limiar para transformá-la em uma imagem binária (preto e branco).
+Modos disponíveis:
+- 'fixo': limiar `thresh` via tabela de consulta (resultado idêntico ao antigo laço pixel a pixel);
+- 'otsu': limiar calculado automaticamente pelo histograma do recorte;
+- 'adaptativo': limiar local pela média da vizinhança (ver binarize_adaptativo).
+'''
+def binarize(img, thresh=200, modo='fixo'):
+  img = img.convert('L') # Converte a imagem para escala de cinza
+  if modo == 'fixo':
+    return img.point(tabela_limiar(thresh))
+  elif modo == 'otsu':
+    return img.point(tabela_limiar(limiar_otsu(img)))
+  elif modo == 'adaptativo':
+    return binarize_adaptativo(img)
+  raise ValueError('modo de binarização desconhecido: %s' % modo)
@@ -0,0 +1,152 @@
+# Cache em disco (SQLite) dos resultados do OCR, endereçado pelo conteúdo do recorte e pelos parâmetros da leitura
+
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.util
+import sqlite3
+import threading
+import time
+
+
+INTERVALO_LIMPEZA = 1000  # Número de inserções entre duas verificações do tamanho máximo do cache
+INTERVALO_USOS = 500      # Número de resultados com acertos acumulados antes de gravar os horários de uso (ultimo_uso) no banco
+
+conexao = None            # Conexão com o banco do cache (uma por processo)
+max_itens = 0             # Quantidade máxima de resultados guardados (0 = sem limite)
+insercoes = 0             # Inserções desde a última limpeza
+contadores = None         # Contadores de acertos/falhas do cache, compartilháveis entre processos
+prefixo_chave = ''        # Incluído na chave dos resultados (ex: o backend de OCR), para não misturar resultados de leitores diferentes
+usos = {}                 # chave -> horário do último acerto, ainda não gravado no banco
+trava = threading.RLock() # Protege a conexão, `usos` e `insercoes` (no servico_ocr.py várias requisições usam o cache ao mesmo tempo)
+
+
+'''
+Cria os contadores de acertos e falhas do cache.
+São valores compartilhados (multiprocessing.Value) para que os processos do pool somem nos mesmos contadores.
+'''
+def novos_contadores(contexto=multiprocessing):
+  return {'acertos': contexto.Value('q', 0), 'falhas': contexto.Value('q', 0)}
+
+
+'''
+Abre (ou cria) o banco do cache. Deve ser chamada uma vez por processo antes de readtext_com_cache.
+`prefixo` separa os resultados de leitores diferentes no mesmo banco ('' para o EasyOCR original).
+'''
+def abrir_cache(caminho, limite=0, contadores_compartilhados=None, prefixo=''):
+  global conexao, max_itens, contadores, prefixo_chave
+  # check_same_thread=False: o OCR roda em outras threads (pipeline.py, servico_ocr.py); todo acesso à conexão é feito sob `trava`,
+  # para que a transação de gravar_usos não receba (nem desfaça) os comandos de outra thread
+  conexao = sqlite3.connect(caminho, timeout=60, isolation_level=None, check_same_thread=False)
+  conexao.execute('PRAGMA journal_mode=WAL')
+  conexao.execute('PRAGMA synchronous=NORMAL')
+  conexao.execute('CREATE TABLE IF NOT EXISTS cache (chave TEXT PRIMARY KEY, resultado TEXT, ultimo_uso INTEGER)')
+  conexao.execute('CREATE INDEX IF NOT EXISTS cache_ultimo_uso ON cache (ultimo_uso)')
+  max_itens = limite
+  contadores = contadores_compartilhados or novos_contadores()
+  prefixo_chave = prefixo
+  # Grava os horários de uso pendentes quando o processo termina (também nos processos do pool, que não rodam o atexit)
+  multiprocessing.util.Finalize(None, gravar_usos, exitpriority=10)
+
+
+'''
+Grava no banco, em uma única transação, os horários de uso acumulados desde a última gravação.
+Os acertos não escrevem no banco um a um: cada escrita disputaria a trava de escrita do SQLite com os outros processos.
+Horários perdidos (ex: processo interrompido) só tornam a ordem do LRU um pouco mais grossa.
+'''
+def gravar_usos():
+  global usos
+  with trava:
+    pendentes, usos = usos, {}
+    if not pendentes or conexao is None:
+      return
+    conexao.execute('BEGIN')
+    try:
+      conexao.executemany('UPDATE cache SET ultimo_uso = ? WHERE chave = ?', [(t, c) for c, t in pendentes.items()])
+    except Exception:
+      conexao.execute('ROLLBACK')
+      raise
+    conexao.execute('COMMIT')
+
+
+def fechar_cache():
+  global conexao
+  with trava:
+    if conexao is not None:
+      gravar_usos()
+      conexao.close()
+      conexao = None
+
+
+'''
+Chave do cache: hash dos bytes do recorte (com formato e tipo do array) e de todos os parâmetros do readtext
+(allowlist, min_size, paragraph, ...), precedidos de prefixo_chave. Qualquer mudança no pré-processamento ou nos parâmetros gera outra chave.
+'''
+def chave_cache(img_array, parametros):
+  h = hashlib.sha1(prefixo_chave.encode('utf-8'))
+  h.update(str((img_array.shape, img_array.dtype.str, sorted(parametros.items()))).encode('utf-8'))
+  h.update(img_array.tobytes())
+  return h.hexdigest()
+
+
+'''
+Converte os tipos do numpy presentes no resultado do EasyOCR (coordenadas e confiança) para tipos do JSON.
+'''
+def _para_json(valor):
+  if hasattr(valor, 'item'):
+    return valor.item()
+  return valor.tolist()
+
+
+def _incrementa(nome):
+  with contadores[nome].get_lock():
+    contadores[nome].value += 1
+
+
+'''
+Substituto do reader.readtext com cache.
+Em caso de acerto devolve o resultado guardado (mesma estrutura do readtext: lista de [caixa, texto, confiança]);
+em caso de falha executa o OCR, guarda o resultado e o devolve.
+O horário de uso de cada acerto é acumulado e gravado quando INTERVALO_USOS resultados tiverem acertos (gravar_usos).
+A cada INTERVALO_LIMPEZA inserções os resultados usados há mais tempo são removidos até respeitar max_itens (LRU).
+Pode ser chamada por várias threads: o banco só é usado sob `trava`, que não fica presa durante o OCR.
+'''
+def readtext_com_cache(reader, img_array, **parametros):
+  global insercoes
+  chave = chave_cache(img_array, parametros)
+  agora = time.time_ns()
+
+  with trava:
+    linha = conexao.execute('SELECT resultado FROM cache WHERE chave = ?', (chave,)).fetchone()
+    if linha is not None:
+      usos[chave] = agora
+      if len(usos) >= INTERVALO_USOS:
+        gravar_usos()
+  if linha is not None:
+    _incrementa('acertos')
+    return json.loads(linha[0])
+
+  _incrementa('falhas')
+  resultado = reader.readtext(img_array, **parametros)
+  with trava:
+    conexao.execute('INSERT OR REPLACE INTO cache (chave, resultado, ultimo_uso) VALUES (?, ?, ?)',
+                    (chave, json.dumps(resultado, default=_para_json), agora))
+    insercoes += 1
+    if max_itens and insercoes >= INTERVALO_LIMPEZA:
+      insercoes = 0
+      gravar_usos()
+      excesso = conexao.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - max_itens
+      if excesso > 0:
+        conexao.execute('DELETE FROM cache WHERE chave IN (SELECT chave FROM cache ORDER BY ultimo_uso LIMIT ?)', (excesso,))
+  return resultado
+
+
+'''
+Texto com o resumo de acertos e falhas do cache na execução atual.
+'''
+def resumo_cache():
+  acertos = contadores['acertos'].value
+  falhas = contadores['falhas'].value
+  total = acertos + falhas
+  taxa = 100 * acertos / total if total else 0
+  return 'Cache de OCR: %d acertos, %d falhas (%.1f%% de acerto)' % (acertos, falhas, taxa)
@@ -0,0 +1,63 @@
+# Checkpoint incremental dos resultados do OCR, para permitir retomar execuções interrompidas
+
+import hashlib
+import json
+import os
+
+
+'''
+Calcula o hash (SHA-1) do conteúdo de um arquivo, lendo em blocos para não carregar o arquivo inteiro na memória.
+'''
+def hash_arquivo(caminho, tamanho_bloco=1 << 20):
+  h = hashlib.sha1()
+  with open(caminho, 'rb') as f:
+    for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+      h.update(bloco)
+  return h.hexdigest()
+
+
+'''
+Calcula o hash (SHA-1) dos pixels decodificados de uma imagem (modo, tamanho e conteúdo), independente do arquivo:
+a mesma imagem regravada em outro formato sem perdas ou com outros metadados (PNG recomprimido, TIFF, BMP) tem o mesmo hash.
+`abrir` é a função que abre a imagem (padrão Image.open; entradas.abrir_imagem para páginas e membros de pacotes).
+'''
+def hash_pixels(caminho, abrir=None):
+  from PIL import Image
+  with (abrir or Image.open)(caminho) as img:
+    h = hashlib.sha1(('%s %dx%d ' % (img.mode, img.width, img.height)).encode('ascii'))
+    h.update(img.tobytes())
+  return h.hexdigest()
+
+
+'''
+Lê o arquivo de checkpoint (JSON lines, um registro por imagem processada).
+Retorna um dicionário (caminho, hash) -> [pasta, row_data], no mesmo formato retornado por extrair_infomacoes_arquivo.
+Linhas incompletas (ex: gravação interrompida no meio) são ignoradas.
+'''
+def carregar_checkpoint(caminho):
+  processados = {}
+  if not os.path.exists(caminho):
+    return processados
+  with open(caminho, encoding='utf-8') as f:
+    for linha in f:
+      try:
+        registro = json.loads(linha)
+      except ValueError:
+        continue
+      processados[(registro['arquivo'], registro['hash'])] = [registro['pasta'], registro['dados']]
+  return processados
+
+
+'''
+Acrescenta ao final do arquivo de checkpoint os registros pendentes e força a gravação em disco.
+Cada registro é uma tupla (caminho, hash, [pasta, row_data]).
+'''
+def gravar_checkpoint(caminho, registros):
+  if not registros:
+    return
+  with open(caminho, 'a', encoding='utf-8') as f:
+    for arquivo, hash_conteudo, (pasta, dados) in registros:
+      f.write(json.dumps({'arquivo': arquivo, 'hash': hash_conteudo, 'pasta': pasta, 'dados': dados},
+                         ensure_ascii=False, default=float) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
@@ -0,0 +1,215 @@
+# Conjunto de recortes empacotado: todos os recortes pré-processados de uma execução em arquivos binários lidos por
+# memória mapeada, com uma tabela de índice (exame, campo, valor, confiança, posição no arquivo), no lugar de um .jpg
+# por recorte com o valor no nome do arquivo
+#
+# Estrutura (um diretório por execução, em RECORTES_DIR; uma parte por processo de OCR):
+#   <execucao>/parte_<pid>.bin           recortes em uint8, um após o outro (altura x largura x canais, sem compressão)
+#   <execucao>/parte_<pid>.indice.jsonl  uma linha por exame: {"exame": ..., "recortes": [[campo, valor, conf, offset, altura, largura, canais], ...]}
+#   <execucao>/parte_<pid>.indice.npz    índice compilado em colunas, só com abrir_dataset(..., cache_indice=True) (refeito se o .jsonl mudar)
+# Os recortes de cada exame são gravados no .bin antes da linha do índice, portanto uma execução interrompida
+# continua legível até o último exame completo.
+#
+# Consulta:
+#   ds = abrir_dataset('recortes/recortes_20250101-120000')
+#   i = ds.filtrar(campo='CO_POD', conf_max=0.6); ds.amostrar(10, i); ds.recorte(i[0])
+#   ds.acuracia('ground_truth.csv', por=['grupo', 'campo'])  (ou reconciliacao.reconciliar(ds.leituras(), ground_truth))
+
+import glob
+import json
+import os
+import numpy as np
+
+
+'''
+Escritor de uma parte do conjunto (usado pela thread de gravação de arquivo_recortes, um por processo).
+'''
+class EscritorDataset:
+  def __init__(self, diretorio):
+    os.makedirs(diretorio, exist_ok=True)
+    base = os.path.join(diretorio, 'parte_%d' % os.getpid())
+    self.dados = open(base + '.bin', 'ab')
+    self.indice = open(base + '.indice.jsonl', 'a', encoding='utf-8')
+    self.offset = self.dados.tell()
+
+  '''
+  Grava os recortes de um exame. `recortes` é uma lista de (campo, valor, confiança ou None, recorte PIL ou array).
+  '''
+  def gravar_exame(self, exame, recortes):
+    linhas = []
+    for campo, valor, conf, img in recortes:
+      arr = np.ascontiguousarray(np.asarray(img), dtype=np.uint8)
+      altura, largura = arr.shape[:2]
+      canais = arr.shape[2] if arr.ndim == 3 else 1
+      self.dados.write(arr.tobytes())
+      linhas.append([campo, valor, conf, self.offset, altura, largura, canais])
+      self.offset += arr.nbytes
+    self.dados.flush()
+    self.indice.write(json.dumps({'exame': exame, 'recortes': linhas}, ensure_ascii=False, default=float) + '\n')
+    self.indice.flush()
+
+  def fechar(self):
+    self.dados.close()
+    self.indice.close()
+
+
+'''
+Indica se o diretório contém um conjunto de recortes (alguma parte_*.bin).
+'''
+def eh_dataset(diretorio):
+  return os.path.isdir(diretorio) and bool(glob.glob(os.path.join(diretorio, 'parte_*.bin')))
+
+
+'''
+Lista as execuções (diretórios com conjunto de recortes) em `diretorio`, da mais antiga para a mais recente.
+'''
+def listar_execucoes(diretorio):
+  execucoes = [os.path.join(diretorio, d) for d in sorted(os.listdir(diretorio)) if eh_dataset(os.path.join(diretorio, d))]
+  return sorted(execucoes, key=os.path.getmtime)
+
+
+def _compilar_indice(base):
+  exames, campos, registros = [], {}, []
+  with open(base + '.indice.jsonl', encoding='utf-8') as f:
+    for linha in f:
+      try:
+        registro = json.loads(linha)
+      except ValueError:
+        continue  # Linha incompleta (execução interrompida durante a gravação)
+      exames.append(registro['exame'])
+      for campo, valor, conf, offset, altura, largura, canais in registro['recortes']:
+        registros.append((len(exames) - 1, campos.setdefault(campo, len(campos)), valor,
+                          np.nan if conf is None else conf, offset, altura, largura, canais))
+  colunas = list(zip(*registros)) if registros else [[]] * 8
+  indice = {
+    'exames': np.array(exames, dtype=str), 'campos': np.array(list(campos), dtype=str),
+    'exame': np.array(colunas[0], dtype=np.int32), 'campo': np.array(colunas[1], dtype=np.int32),
+    'valor': np.array(colunas[2], dtype=str), 'conf': np.array(colunas[3], dtype=np.float32),
+    'offset': np.array(colunas[4], dtype=np.int64),
+    'forma': np.array(colunas[5:8], dtype=np.int32).T.reshape(-1, 3),
+  }
+  return indice
+
+
+'''
+Índice de uma parte, compilado do .jsonl na memória. Com `cache`, o índice compilado é guardado no .indice.npz ao lado
+da parte e reaproveitado nas próximas aberturas enquanto o .jsonl não mudar; sem ele, nada é gravado no diretório.
+'''
+def _carregar_indice(base, cache=False):
+  compilado = base + '.indice.npz'
+  if cache and os.path.exists(compilado) and os.path.getmtime(compilado) >= os.path.getmtime(base + '.indice.jsonl'):
+    with np.load(compilado) as dados:
+      return {k: dados[k] for k in dados.files}
+  indice = _compilar_indice(base)
+  if cache:
+    np.savez(compilado, **indice)
+  return indice
+
+
+'''
+Conjunto de recortes de uma execução (todas as partes), com o índice em colunas numpy:
+- exame, campo: índices em `exames` / `campos` (nomes); valor: texto lido; conf: confiança (NaN nos campos de info);
+- parte, offset, forma: onde está cada recorte (arquivo .bin da parte, posição em bytes, [altura, largura, canais]).
+Os arquivos .bin são abertos com np.memmap: só os recortes consultados são lidos do disco.
+Com cache_indice, o índice compilado de cada parte é guardado em disco (ver _carregar_indice).
+'''
+class DatasetRecortes:
+  def __init__(self, diretorio, cache_indice=False):
+    self.diretorio = diretorio
+    bases = [caminho[:-len('.bin')] for caminho in sorted(glob.glob(os.path.join(diretorio, 'parte_*.bin')))]
+    indices = [_carregar_indice(base, cache_indice) for base in bases]
+    self.dados = [np.memmap(base + '.bin', dtype=np.uint8, mode='r') if os.path.getsize(base + '.bin') else
+                  np.zeros(0, dtype=np.uint8) for base in bases]
+
+    # Unifica as partes: nomes de exames e campos de todas as partes em uma única numeração
+    self.exames = np.concatenate([ind['exames'] for ind in indices]) if indices else np.array([], dtype=str)
+    self.campos = np.array(sorted({c for ind in indices for c in ind['campos']}), dtype=str)
+    deslocamento = np.cumsum([0] + [len(ind['exames']) for ind in indices])[:-1]
+    self.exame = np.concatenate([ind['exame'] + d for ind, d in zip(indices, deslocamento)] or [np.zeros(0, np.int32)])
+    self.campo = np.concatenate([np.searchsorted(self.campos, ind['campos'])[ind['campo']] if len(ind['campo']) else
+                                 np.zeros(0, np.int64) for ind in indices] or [np.zeros(0, np.int64)]).astype(np.int32)
+    self.valor = np.concatenate([ind['valor'] for ind in indices] or [np.array([], dtype=str)])
+    self.conf = np.concatenate([ind['conf'] for ind in indices] or [np.zeros(0, np.float32)])
+    self.parte = np.concatenate([np.full(len(ind['offset']), i, dtype=np.int16) for i, ind in enumerate(indices)]
+                                or [np.zeros(0, np.int16)])
+    self.offset = np.concatenate([ind['offset'] for ind in indices] or [np.zeros(0, np.int64)])
+    self.forma = np.concatenate([ind['forma'] for ind in indices] or [np.zeros((0, 3), np.int32)])
+
+  def __len__(self):
+    return len(self.offset)
+
+  '''
+  Recorte i como array (altura x largura ou altura x largura x 3), lido do arquivo mapeado.
+  '''
+  def recorte(self, i):
+    altura, largura, canais = self.forma[i]
+    inicio = self.offset[i]
+    arr = self.dados[self.parte[i]][inicio:inicio + altura * largura * canais]
+    return arr.reshape((altura, largura) if canais == 1 else (altura, largura, canais))
+
+  '''
+  Chave do ground truth do recorte i: "<exame>_<campo>" (ver sarmento_ocr.nome_paciente_base).
+  '''
+  def chave(self, i):
+    return self.exames[self.exame[i]] + '_' + self.campos[self.campo[i]]
+
+  '''
+  Índices dos recortes que atendem a todos os filtros informados:
+  - campo / exame: nome (ou lista de nomes) do campo / exame;
+  - conf_min / conf_max: faixa de confiança (recortes sem confiança, campos de info, ficam de fora se usados);
+  - valor: texto lido exatamente igual.
+  '''
+  def filtrar(self, campo=None, exame=None, conf_min=None, conf_max=None, valor=None):
+    filtro = np.ones(len(self), dtype=bool)
+    if campo is not None:
+      filtro &= np.isin(self.campo, np.flatnonzero(np.isin(self.campos, np.atleast_1d(campo))))
+    if exame is not None:
+      filtro &= np.isin(self.exame, np.flatnonzero(np.isin(self.exames, np.atleast_1d(exame))))
+    if conf_min is not None:
+      filtro &= self.conf >= conf_min
+    if conf_max is not None:
+      filtro &= self.conf < conf_max
+    if valor is not None:
+      filtro &= self.valor == valor
+    return np.flatnonzero(filtro)
+
+  '''
+  Amostra aleatória de até n índices (entre `indices`, ou entre todos os recortes).
+  '''
+  def amostrar(self, n, indices=None, seed=None):
+    indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+    return np.random.default_rng(seed).choice(indices, size=min(n, len(indices)), replace=False)
+
+  '''
+  Leituras dos recortes (todos ou `indices`) no formato longo de reconciliacao.carregar_saida, para comparar com o
+  ground truth por reconciliacao.reconciliar: grupo, paciente, arquivo, campo, lido, conf e recorte (índice no conjunto).
+  '''
+  def leituras(self, indices=None):
+    import pandas as pd
+    from reconciliacao import SEPARADOR_PASTA
+    indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+    exames = pd.Series(self.exames, dtype=object).str.partition(SEPARADOR_PASTA)
+    exame = self.exame[indices]
+    codigos, nomes = pd.factorize(self.exames)  # Um exame pode aparecer em mais de uma parte (ex: execução retomada)
+    return pd.DataFrame({
+      'grupo': pd.Categorical(exames[0].to_numpy()[exame]),
+      'paciente': pd.Categorical(exames[2].to_numpy()[exame]),
+      'arquivo': pd.Categorical.from_codes(codigos[exame], nomes),
+      'campo': pd.Categorical.from_codes(self.campo[indices], self.campos),
+      'lido': self.valor[indices].astype(object),
+      'conf': self.conf[indices].astype(float),
+      'recorte': indices,
+    })
+
+  '''
+  Acurácia das leituras (todas ou `indices`) contra o ground truth, agrupada pelas colunas `por` (reconciliacao.acuracia).
+  `ground_truth` é o caminho do ground_truth.csv ou o índice já carregado por reconciliacao.carregar_ground_truth.
+  '''
+  def acuracia(self, ground_truth, por=('campo',), indices=None):
+    import reconciliacao
+    if isinstance(ground_truth, str):
+      ground_truth = reconciliacao.carregar_ground_truth(ground_truth, self.campos)
+    return reconciliacao.acuracia(reconciliacao.reconciliar(self.leituras(indices), ground_truth), list(por))
+
+
+def abrir_dataset(diretorio, cache_indice=False):
+  return DatasetRecortes(diretorio, cache_indice)
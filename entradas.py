@@ -0,0 +1,218 @@
+# Adaptadores de entrada: páginas de TIFFs com várias páginas e de PDFs (rasterizados localmente) e membros de
+# arquivos .zip/.tar são lidos direto do arquivo original, sem extrair nada para o disco.
+#
+# Cada página ou membro é identificado por um caminho virtual "<arquivo>::<membro>[::<página>]", usado no lugar do
+# caminho do arquivo em todo o processamento (checkpoint, deduplicação, saída e serviço):
+# - "imagens/PASTA/exame.tif::2": página 2 de um TIFF;
+# - "imagens/PASTA/relatorio.pdf::1": página 1 de um PDF;
+# - "imagens/estudo.zip::OD/exame.png": membro de um .zip (ou .tar, .tar.gz...);
+# - "imagens/estudo.zip::exame.pdf::3": página 3 de um PDF dentro de um .zip.
+# Imagens soltas e TIFFs de uma única página continuam com o caminho do próprio arquivo.
+#
+# Para o agrupamento por pasta e para o nome base dos recortes, cada entrada tem também um caminho lógico (caminho_logico),
+# o caminho que ela teria se o arquivo fosse extraído: um .zip/.tar vale como uma pasta com o nome do arquivo sem a
+# extensão (os membros em subpastas ficam nessas subpastas) e a página n de "<nome>__<resto>" vira "<nome>_p<n>__<resto>".
+
+import functools
+import hashlib
+import io
+import os
+import tarfile
+import threading
+import zipfile
+from PIL import Image
+from checkpoint import hash_arquivo
+
+
+SEPARADOR = '::'          # Separa o arquivo, o membro e a página no caminho virtual
+EXTENSOES_PACOTES = ('.zip', '.tar', '.tgz', '.tar.gz', '.tar.bz2', '.tar.xz') # Arquivos cujos membros são lidos como imagens
+EXTENSOES_PAGINAS = ('.tif', '.tiff', '.pdf') # Arquivos que podem ter várias páginas (cada página é um exame)
+PDF_DPI = 96              # Resolução da rasterização dos PDFs; precisa reproduzir o tamanho em pixels das exportações em imagem
+
+abertos = threading.local() # abertos.pacote: (caminho, .zip/.tar aberto) da thread atual, reaproveitado entre membros seguidos
+
+
+def eh_pacote(nome):
+  return nome.lower().endswith(EXTENSOES_PACOTES)
+
+
+def _sem_extensao(nome):
+  minusculo = nome.lower()
+  for extensao in sorted(EXTENSOES_PACOTES, key=len, reverse=True):
+    if minusculo.endswith(extensao):
+      return nome[:-len(extensao)]
+  return os.path.splitext(nome)[0]
+
+
+'''
+Divide um caminho virtual em (arquivo, membro, página). membro é None fora de pacotes e página é None (imagem inteira)
+ou o número da página, começando em 1.
+'''
+def dividir(caminho):
+  partes = caminho.split(SEPARADOR)
+  arquivo, membro, pagina = partes[0], None, None
+  resto = partes[1:]
+  if resto and eh_pacote(arquivo):
+    membro = resto.pop(0)
+  if resto:
+    pagina = int(resto[0])
+  return arquivo, membro, pagina
+
+
+'''
+Caminho que a entrada teria se o pacote e as páginas fossem extraídos para o disco (ver o início do módulo).
+Para imagens soltas, é o próprio caminho.
+'''
+def caminho_logico(caminho):
+  arquivo, membro, pagina = dividir(caminho)
+  if membro is not None:
+    diretorio = os.path.join(os.path.dirname(arquivo), _sem_extensao(os.path.basename(arquivo)))
+    arquivo = os.path.join(diretorio, *membro.split('/'))
+  if pagina is not None:
+    base, extensao = os.path.splitext(os.path.basename(arquivo))
+    i = base.find('__') if '__' in base else len(base)
+    arquivo = os.path.join(os.path.dirname(arquivo), base[:i] + '_p%d' % pagina + base[i:] + extensao)
+  return arquivo
+
+
+'''
+Nome do arquivo de uma entrada, sem o pacote e sem o número da página: o nome do membro (sem as subpastas) para membros
+de pacotes e o do próprio arquivo nos demais casos. É o nome de onde vêm os metadados do exame (metadados_arquivo);
+o caminho lógico não serve para isso porque o "_p<n>" das páginas desloca os campos do nome.
+'''
+def nome_arquivo(caminho):
+  arquivo, membro, _ = dividir(caminho)
+  return os.path.basename(membro.split('/')[-1] if membro is not None else arquivo)
+
+
+def _pacote(arquivo):
+  # .zip/.tar aberto na thread atual; abrir de novo a cada membro releria o diretório do pacote
+  atual = getattr(abertos, 'pacote', None)
+  if atual is not None and atual[0] == arquivo:
+    return atual[1]
+  if atual is not None:
+    atual[1].close()
+  pacote = zipfile.ZipFile(arquivo) if zipfile.is_zipfile(arquivo) else tarfile.open(arquivo)
+  abertos.pacote = (arquivo, pacote)
+  return pacote
+
+
+def _ler_membro(arquivo, membro):
+  pacote = _pacote(arquivo)
+  if isinstance(pacote, zipfile.ZipFile):
+    return pacote.read(membro)
+  return pacote.extractfile(membro).read()
+
+
+def _pdfium():
+  try:
+    import pypdfium2
+  except ImportError:
+    raise RuntimeError('pypdfium2 não está instalado (pip install pypdfium2), necessário para ler PDFs')
+  return pypdfium2
+
+
+'''
+Número de páginas de um TIFF ou PDF (`fonte`: caminho ou bytes).
+'''
+def contar_paginas(nome, fonte):
+  if nome.lower().endswith('.pdf'):
+    pdf = _pdfium().PdfDocument(fonte)
+    try:
+      return len(pdf)
+    finally:
+      pdf.close()
+  with Image.open(io.BytesIO(fonte) if isinstance(fonte, bytes) else fonte) as img:
+    return getattr(img, 'n_frames', 1)
+
+
+def _rasterizar(fonte, pagina):
+  pdf = _pdfium().PdfDocument(fonte)
+  try:
+    return pdf[pagina - 1].render(scale=PDF_DPI / 72).to_pil()
+  finally:
+    pdf.close()
+
+
+'''
+Abre a imagem de um caminho virtual (ou de um arquivo comum, com Image.open). Membros de pacotes são lidos para a
+memória, páginas de TIFF são selecionadas com seek e páginas de PDF são rasterizadas com o pypdfium2 (dependência
+opcional, importada só aqui). O filename da imagem é o caminho lógico, usado por nome_paciente_base.
+'''
+def abrir_imagem(caminho):
+  if SEPARADOR not in caminho:
+    return Image.open(caminho)
+  arquivo, membro, pagina = dividir(caminho)
+  nome = membro if membro is not None else arquivo
+  fonte = _ler_membro(arquivo, membro) if membro is not None else arquivo
+  if pagina is not None and nome.lower().endswith('.pdf'):
+    img = _rasterizar(fonte, pagina)
+  else:
+    img = Image.open(io.BytesIO(fonte) if isinstance(fonte, bytes) else fonte)
+    if pagina is not None:
+      img.seek(pagina - 1)
+  img.filename = caminho_logico(caminho)
+  return img
+
+
+@functools.lru_cache(maxsize=32)
+def _hash_arquivo(arquivo, tamanho, modificacao):
+  return hash_arquivo(arquivo)
+
+
+'''
+Hash (SHA-1) do conteúdo de uma entrada, usado pelo checkpoint e pela deduplicação por conteúdo: o do arquivo para
+imagens soltas (checkpoint.hash_arquivo), o dos bytes do membro para membros de pacotes e, para páginas, o hash do
+arquivo (ou membro) com o número da página. O hash de um TIFF/PDF é calculado uma única vez para todas as páginas.
+'''
+def hash_entrada(caminho):
+  if SEPARADOR not in caminho:
+    return hash_arquivo(caminho)
+  arquivo, membro, pagina = dividir(caminho)
+  if membro is not None:
+    h = hashlib.sha1(_ler_membro(arquivo, membro)).hexdigest()
+  else:
+    estado = os.stat(arquivo)
+    h = _hash_arquivo(arquivo, estado.st_size, estado.st_mtime_ns)
+  if pagina is None:
+    return h
+  return hashlib.sha1((h + SEPARADOR + str(pagina)).encode('ascii')).hexdigest()
+
+
+def _paginas(caminho, nome, fonte):
+  n = contar_paginas(nome, fonte)
+  if n == 1 and not nome.lower().endswith('.pdf'):
+    return [caminho]
+  return [caminho + SEPARADOR + str(i) for i in range(1, n + 1)]
+
+
+'''
+Caminhos (virtuais) das entradas de um arquivo: o próprio arquivo para imagens comuns, uma entrada por página para TIFFs
+de várias páginas e PDFs e uma por membro (ou página de membro) para pacotes. Nos pacotes só entram os membros com as
+extensões `extensoes` ou PDF, na ordem do pacote; pacotes dentro de pacotes não são abertos.
+'''
+def expandir(caminho, extensoes):
+  nome = os.path.basename(caminho)
+  if eh_pacote(nome):
+    entradas = []
+    if zipfile.is_zipfile(caminho):
+      pacote = zipfile.ZipFile(caminho)
+      membros = [m.filename for m in pacote.infolist() if not m.is_dir()]
+      ler = pacote.read
+    else:
+      pacote = tarfile.open(caminho)
+      membros = [m.name for m in pacote.getmembers() if m.isfile()]
+      ler = lambda m: pacote.extractfile(m).read()
+    try:
+      for membro in membros:
+        minusculo = membro.lower()
+        if not minusculo.endswith(tuple(extensoes) + ('.pdf',)):
+          continue
+        virtual = caminho + SEPARADOR + membro
+        entradas.extend(_paginas(virtual, membro, ler(membro)) if minusculo.endswith(EXTENSOES_PAGINAS) else [virtual])
+    finally:
+      pacote.close()
+    return entradas
+  if nome.lower().endswith(EXTENSOES_PAGINAS):
+    return _paginas(caminho, nome, caminho)
+  return [caminho]
@@ -0,0 +1,128 @@
+# Detecção rápida do padrão de layout dos exames (sem OCR), por comparação com miniaturas de referência
+# Uso: python layout.py calibrar <diretorio_imagens> [arquivo_saida]
+
+import csv
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+
+LAYOUT_DESCONHECIDO = 0       # Padrão retornado quando nenhum layout conhecido é reconhecido com segurança
+TAMANHO_MINIATURA = (48, 64)  # Largura e altura da miniatura usada na comparação
+LIMIAR_SIMILARIDADE = 0.8     # Similaridade mínima com a referência para aceitar o layout
+MARGEM_MINIMA = 0.05          # Diferença mínima entre o melhor e o segundo melhor layout
+LAYOUT_FILE = 'layouts.npz'   # Arquivo com as referências de cada layout (gerado pela calibração)
+
+
+'''
+Gera a miniatura de uma imagem de exame: tons de cinza, reduzida para TAMANHO_MINIATURA,
+com média zero e norma 1. O produto escalar entre duas miniaturas é a correlação cruzada normalizada entre elas.
+'''
+def miniatura(img):
+  arr = np.asarray(img.convert('L').resize(TAMANHO_MINIATURA, Image.Resampling.BOX), dtype=np.float32).ravel()
+  arr -= arr.mean()
+  norma = np.linalg.norm(arr)
+  return arr / norma if norma > 0 else arr
+
+
+'''
+Constrói as referências de cada layout a partir de exemplos rotulados.
+Recebe um iterável de (imagem, padrão) e retorna um dicionário padrão -> {'miniatura': média normalizada, 'tamanhos': {(largura, altura)}}.
+Novos formatos de exportação do RTVue são suportados apenas incluindo exemplos rotulados com um novo número de padrão.
+'''
+def calibrar_layouts(exemplos):
+  somas = {}
+  tamanhos = {}
+  for img, padrao in exemplos:
+    somas[padrao] = somas.get(padrao, 0) + miniatura(img)
+    tamanhos.setdefault(padrao, set()).add(img.size)
+  modelos = {}
+  for padrao, soma in somas.items():
+    modelos[padrao] = {'miniatura': soma / np.linalg.norm(soma), 'tamanhos': tamanhos[padrao]}
+  return modelos
+
+
+def salvar_modelos(caminho, modelos):
+  arrays = {}
+  for padrao, modelo in modelos.items():
+    arrays['miniatura_%d' % padrao] = modelo['miniatura']
+    arrays['tamanhos_%d' % padrao] = np.array(sorted(modelo['tamanhos']), dtype=np.int32).reshape(-1, 2)
+  np.savez(caminho, **arrays)
+
+
+def carregar_modelos(caminho):
+  modelos = {}
+  with np.load(caminho) as arrays:
+    for nome in arrays.files:
+      if nome.startswith('miniatura_'):
+        padrao = int(nome.split('_')[1])
+        modelos[padrao] = {
+          'miniatura': arrays[nome],
+          'tamanhos': set(map(tuple, arrays['tamanhos_%d' % padrao].tolist())),
+        }
+  return modelos
+
+
+'''
+Identifica o layout de uma imagem de exame.
+Retorna (padrão, confiança), em que a confiança é a correlação normalizada com a referência do layout escolhido.
+Layouts cujo tamanho de imagem nunca foi visto na calibração são descartados antes da comparação.
+Se a melhor similaridade for menor que LIMIAR_SIMILARIDADE, ou muito próxima da segunda melhor (MARGEM_MINIMA),
+retorna LAYOUT_DESCONHECIDO.
+'''
+def detectar_layout(img, modelos):
+  candidatos = {p: m for p, m in modelos.items() if img.size in m['tamanhos']} or modelos
+  if not candidatos:
+    return LAYOUT_DESCONHECIDO, 0.0
+  mini = miniatura(img)
+  scores = sorted(((float(np.dot(mini, m['miniatura'])), p) for p, m in candidatos.items()), reverse=True)
+  melhor, padrao = scores[0]
+  segundo = scores[1][0] if len(scores) > 1 else -1.0
+  if melhor < LIMIAR_SIMILARIDADE or melhor - segundo < MARGEM_MINIMA:
+    return LAYOUT_DESCONHECIDO, melhor
+  return padrao, melhor
+
+
+'''
+Lê o ground_truth.csv e devolve o padrão esperado de cada paciente ("<pasta>___<paciente>").
+Pacientes com dados de ambos os olhos (campo Eye_2) são do padrão 1; os demais, do padrão 2.
+'''
+def padroes_ground_truth(caminho_ground_truth):
+  padroes = {}
+  with open(caminho_ground_truth, newline='', encoding='utf-8') as csvfile:
+    for row in csv.DictReader(csvfile, delimiter=';'):
+      chave = row['variavel'].strip()
+      if chave.endswith('_Eye_2'):
+        padroes[chave[:-len('_Eye_2')]] = 1
+      elif chave.endswith('_Eye'):
+        padroes.setdefault(chave[:-len('_Eye')], 2)
+  return padroes
+
+
+'''
+Percorre as subpastas de `diretorio_imagens` e devolve (caminho, padrão esperado) para cada imagem presente no ground truth.
+'''
+def exemplos_rotulados(diretorio_imagens, caminho_ground_truth):
+  padroes = padroes_ground_truth(caminho_ground_truth)
+  exemplos = []
+  for pasta in sorted(os.listdir(diretorio_imagens)):
+    if not os.path.isdir(os.path.join(diretorio_imagens, pasta)):
+      continue
+    for f in sorted(os.listdir(os.path.join(diretorio_imagens, pasta))):
+      paciente = pasta + '___' + f.split('__')[0]
+      if paciente in padroes:
+        exemplos.append((os.path.join(diretorio_imagens, pasta, f), padroes[paciente]))
+  return exemplos
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3 or sys.argv[1] != 'calibrar':
+    print('Uso: python layout.py calibrar <diretorio_imagens> [arquivo_saida]')
+    sys.exit(1)
+  raiz = os.path.dirname(os.path.abspath(__file__))
+  exemplos = exemplos_rotulados(sys.argv[2], os.path.join(raiz, 'ground_truth.csv'))
+  modelos = calibrar_layouts((Image.open(caminho), padrao) for caminho, padrao in exemplos)
+  saida = sys.argv[3] if len(sys.argv) > 3 else os.path.join(raiz, LAYOUT_FILE)
+  salvar_modelos(saida, modelos)
+  print('Referências de %d layouts (%d exemplos) gravadas em %s' % (len(modelos), len(exemplos), saida))
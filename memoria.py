@@ -0,0 +1,111 @@
+# Controle de memória do modo com memória limitada (MEMORIA_LIMITADA): medição do RSS, pausa na entrada de novas imagens
+# quando o RSS passa do teto e resumo do pico de memória no final da execução
+#
+# O RSS inclui os processos do pool: com o psutil, todos os descendentes do processo atual; sem ele, os processos
+# filhos do multiprocessing, lidos em /proc/<pid>/statm (só no Linux; fora dele o limite não é aplicado).
+
+import gc
+import multiprocessing
+import os
+import sys
+import time
+
+
+esperas = 0               # Quantas vezes a entrada de imagens foi pausada por falta de memória
+tempo_espera = 0.0        # Tempo total (s) de pausa na entrada
+
+
+def _rss_proc(pid):
+  with open('/proc/%s/statm' % pid) as f:
+    return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+'''
+RSS atual em MB do processo atual e, se `incluir_filhos`, dos processos filhos (pool).
+Retorna None se não for possível medir (sem psutil fora do Linux).
+'''
+def rss_mb(incluir_filhos=True):
+  try:
+    import psutil
+  except ImportError:
+    psutil = None
+  if psutil is not None:
+    processo = psutil.Process()
+    total = processo.memory_info().rss
+    if incluir_filhos:
+      for filho in processo.children(recursive=True):
+        try:
+          total += filho.memory_info().rss
+        except psutil.Error:
+          pass
+    return total / (1 << 20)
+  try:
+    total = _rss_proc('self')
+  except (OSError, ValueError, AttributeError):
+    return None
+  if incluir_filhos:
+    for filho in multiprocessing.active_children():
+      try:
+        total += _rss_proc(filho.pid)
+      except (OSError, ValueError):
+        pass  # O processo terminou entre a listagem e a leitura
+  return total / (1 << 20)
+
+
+'''
+Pico de RSS em MB do processo atual e do maior processo filho já encerrado (getrusage; indisponível no Windows).
+'''
+def pico_mb():
+  try:
+    import resource
+  except ImportError:
+    return None, None
+  escala = 1 / (1 << 20) if sys.platform == 'darwin' else 1 / 1024  # ru_maxrss: bytes no macOS, KB no Linux
+  return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * escala,
+          resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * escala)
+
+
+'''
+Repassa os itens de `itens`, pausando antes de cada um enquanto o RSS estiver acima de `limite_mb`
+(as imagens em andamento terminam e liberam memória). Cada pausa dura no máximo `espera_max` segundos:
+se a memória não baixar (ex: o próprio modelo passa do limite), a entrada continua sem pausas até o RSS voltar
+a ficar abaixo do limite, para não travar a execução. Se o RSS não puder ser medido, avisa e repassa tudo sem pausas.
+'''
+def limitar_entrada(itens, limite_mb, espera_max=60, intervalo=0.2):
+  global esperas, tempo_espera
+  if rss_mb() is None:
+    print('Aviso: não é possível medir o RSS neste sistema sem o psutil (pip install psutil); o limite de %d MB não será aplicado'
+          % limite_mb)
+    yield from itens
+    return
+  sem_pausas = False
+  for item in itens:
+    rss = rss_mb()
+    if rss is not None and rss > limite_mb and not sem_pausas:
+      gc.collect()
+      inicio = time.perf_counter()
+      esperas += 1
+      while rss is not None and rss > limite_mb and time.perf_counter() - inicio < espera_max:
+        time.sleep(intervalo)
+        rss = rss_mb()
+      tempo_espera += time.perf_counter() - inicio
+      if rss is not None and rss > limite_mb:
+        print('Aviso: a memória continua acima do limite (%.0f MB > %d MB) após %d s de pausa; a entrada segue sem pausas'
+              % (rss, limite_mb, espera_max))
+        sem_pausas = True
+    elif sem_pausas and rss is not None and rss <= limite_mb:
+      sem_pausas = False
+    yield item
+
+
+'''
+Texto com o pico de memória e as pausas na entrada da execução atual.
+'''
+def resumo_memoria(limite_mb=None):
+  proprio, filhos = pico_mb()
+  linhas = ['Memória: pico de %s MB no processo principal' % ('%.0f' % proprio if proprio is not None else '?')]
+  if filhos:
+    linhas[0] += ', %.0f MB no maior processo de OCR' % filhos
+  if limite_mb:
+    linhas.append('  limite %d MB: entrada pausada %d vezes (%.1f s)' % (limite_mb, esperas, tempo_espera))
+  return '\n'.join(linhas)
@@ -0,0 +1,218 @@
+# Métricas de execução: tempo de cada etapa por imagem, contadores de falhas e leituras vazias, log em JSON lines
+# e resumo no fim da execução (p50/p95 por etapa, imagens por segundo)
+# Uso: python metricas.py resumo <arquivo.jsonl>
+#      python metricas.py perfil <imagem> [--pyinstrument] [--saida arquivo]
+
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+arquivo_log = None        # Arquivo JSON lines aberto pelo processo atual (um registro por imagem)
+trava_log = threading.Lock() # Gravação no log (as etapas do pipeline.py finalizam imagens em threads diferentes)
+ecoar = False             # Também imprime cada registro no console (VERBOSE)
+estado = threading.local() # estado.atual: registro da imagem em andamento na thread, {'arquivo', 'etapas', 'contadores'}
+
+
+def _atual():
+  return getattr(estado, 'atual', None)
+
+
+'''
+Abre o log (em modo append: os processos do pool gravam no mesmo arquivo, uma linha por vez).
+'''
+def abrir_log(caminho, verbose=False):
+  global arquivo_log, ecoar
+  fechar_log()
+  arquivo_log = open(caminho, 'a', encoding='utf-8')
+  ecoar = verbose
+
+
+def fechar_log():
+  global arquivo_log
+  if arquivo_log is not None:
+    arquivo_log.close()
+    arquivo_log = None
+
+
+'''
+Começa o registro de uma imagem na thread atual. As etapas e contadores seguintes são somados nele até finalizar_imagem.
+Retorna o registro, para que outra thread continue a mesma imagem (retomar_imagem).
+'''
+def iniciar_imagem(arquivo):
+  estado.atual = {'arquivo': arquivo, 'pid': os.getpid(), 'inicio': time.time(), 'etapas': {}, 'contadores': {}}
+  estado.atual['_t0'] = time.perf_counter()
+  return estado.atual
+
+
+'''
+Passa a somar as etapas e contadores da thread atual no registro `registro` (retornado por iniciar_imagem).
+Usado quando as etapas de uma imagem rodam em threads diferentes; None desassocia a thread da imagem.
+'''
+def retomar_imagem(registro):
+  estado.atual = registro
+
+
+'''
+Mede o tempo do bloco e o soma à etapa `etapa` da imagem em andamento (sem imagem em andamento, não faz nada).
+'''
+@contextmanager
+def cronometro(etapa):
+  inicio = time.perf_counter()
+  try:
+    yield
+  finally:
+    atual = _atual()
+    if atual is not None:
+      atual['etapas'][etapa] = atual['etapas'].get(etapa, 0.0) + time.perf_counter() - inicio
+
+
+def contar(nome, n=1):
+  atual = _atual()
+  if atual is not None:
+    atual['contadores'][nome] = atual['contadores'].get(nome, 0) + n
+
+
+'''
+Fecha o registro da imagem em andamento e grava a linha no log. `erro` é a mensagem da exceção, se a imagem falhou.
+'''
+def finalizar_imagem(erro=None):
+  registro = _atual()
+  if registro is None:
+    return
+  estado.atual = None
+  registro['total'] = time.perf_counter() - registro.pop('_t0')
+  if erro is not None:
+    registro['erro'] = str(erro)
+  linha = json.dumps(registro, ensure_ascii=False)
+  with trava_log:
+    if arquivo_log is not None:
+      arquivo_log.write(linha + '\n')
+      arquivo_log.flush()
+  if ecoar:
+    print(linha)
+
+
+def _percentil(valores, p):
+  ordenados = sorted(valores)
+  return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+'''
+Resumo de um log: quantidade de imagens, imagens por segundo (entre o início da primeira e o fim da última),
+p50/p95/total de cada etapa (imagens em que a etapa não ocorreu não entram) e a soma dos contadores.
+'''
+def resumir(caminho):
+  registros = []
+  with open(caminho, encoding='utf-8') as f:
+    for linha in f:
+      if linha.strip():
+        registros.append(json.loads(linha))
+  if not registros:
+    return {'imagens': 0}
+
+  por_etapa = {'total': [r['total'] for r in registros]}
+  contadores = {}
+  for r in registros:
+    for etapa, duracao in r['etapas'].items():
+      por_etapa.setdefault(etapa, []).append(duracao)
+    for nome, n in r['contadores'].items():
+      contadores[nome] = contadores.get(nome, 0) + n
+  duracao_execucao = max(r['inicio'] + r['total'] for r in registros) - min(r['inicio'] for r in registros)
+  return {
+    'imagens': len(registros),
+    'imagens_com_erro': sum(1 for r in registros if 'erro' in r),
+    'imagens_por_segundo': len(registros) / duracao_execucao if duracao_execucao > 0 else 0,
+    'etapas_ms': {etapa: {'p50': 1000 * _percentil(v, 50), 'p95': 1000 * _percentil(v, 95), 'total': 1000 * sum(v)}
+                  for etapa, v in por_etapa.items()},
+    'contadores': contadores,
+  }
+
+
+'''
+Texto do resumo para o console.
+'''
+def texto_resumo(resumo):
+  if not resumo['imagens']:
+    return 'Métricas: nenhuma imagem registrada'
+  linhas = ['Métricas: %d imagens (%d com erro), %.2f imagens/s' % (resumo['imagens'], resumo['imagens_com_erro'],
+                                                                    resumo['imagens_por_segundo'])]
+  for etapa, t in sorted(resumo['etapas_ms'].items(), key=lambda item: -item[1]['total']):
+    linhas.append('  %-24s p50 %8.1f ms | p95 %8.1f ms | total %10.0f ms' % (etapa, t['p50'], t['p95'], t['total']))
+  for nome, n in sorted(resumo['contadores'].items()):
+    linhas.append('  %-24s %d' % (nome, n))
+  return '\n'.join(linhas)
+
+
+'''
+Executa funcao(*args) sob um profiler e imprime (ou grava em `saida`) o resultado.
+ferramenta: 'cprofile' (biblioteca padrão; `saida` recebe o arquivo .prof) ou 'pyinstrument' (precisa estar instalado;
+`saida` recebe o relatório HTML).
+'''
+def perfilar(funcao, *args, ferramenta='cprofile', saida=None):
+  if ferramenta == 'pyinstrument':
+    try:
+      from pyinstrument import Profiler
+    except ImportError:
+      raise RuntimeError('pyinstrument não está instalado (pip install pyinstrument)')
+    profiler = Profiler()
+    profiler.start()
+    resultado = funcao(*args)
+    profiler.stop()
+    if saida:
+      with open(saida, 'w', encoding='utf-8') as f:
+        f.write(profiler.output_html())
+    else:
+      print(profiler.output_text(unicode=True, color=False))
+    return resultado
+
+  import cProfile
+  import pstats
+  profiler = cProfile.Profile()
+  resultado = profiler.runcall(funcao, *args)
+  if saida:
+    profiler.dump_stats(saida)
+  else:
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(30)
+  return resultado
+
+
+'''
+Processa uma única imagem com sarmento_ocr.extrair_infomacoes_arquivo sob o profiler, com as métricas no console.
+O leitor EasyOCR é criado antes, para que o profiler mostre só o processamento da imagem.
+'''
+def perfilar_imagem(caminho, ferramenta='cprofile', saida=None):
+  global ecoar
+  import sarmento_ocr as so
+  so.diretorio_raiz = os.path.dirname(os.path.abspath(so.__file__))
+  so.carregar_layouts(so.diretorio_raiz)
+  so.OCR_CACHE = False
+  so.obter_reader()
+  caminho = os.path.abspath(caminho)
+  ecoar = True
+  resultado = perfilar(so.extrair_infomacoes_arquivo, {}, [caminho, os.path.basename(os.path.dirname(caminho))],
+                       ferramenta=ferramenta, saida=saida)
+  so.arquivo_recortes.encerrar_gravador()
+  return resultado
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Resumo das métricas de uma execução e profiling de uma imagem')
+  comandos = parser.add_subparsers(dest='comando', required=True)
+  resumo = comandos.add_parser('resumo', help='resumo (p50/p95 por etapa) de um log de métricas')
+  resumo.add_argument('log')
+  resumo.add_argument('--json', action='store_true', help='imprime o resumo em JSON')
+  perfil = comandos.add_parser('perfil', help='processa uma imagem sob o profiler')
+  perfil.add_argument('imagem')
+  perfil.add_argument('--pyinstrument', action='store_true', help='usa o pyinstrument em vez do cProfile')
+  perfil.add_argument('--saida', default=None, help='arquivo .prof (cProfile) ou .html (pyinstrument)')
+  args = parser.parse_args()
+
+  if args.comando == 'resumo':
+    r = resumir(args.log)
+    print(json.dumps(r, indent=2, ensure_ascii=False) if args.json else texto_resumo(r))
+  else:
+    perfilar_imagem(args.imagem, 'pyinstrument' if args.pyinstrument else 'cprofile', args.saida)
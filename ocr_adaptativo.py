@@ -0,0 +1,90 @@
+# Releitura adaptativa: cada campo é lido primeiro com um pré-processamento barato e só é relido, com variantes
+# mais pesadas, quando a leitura é fraca (confiança abaixo do corte ou valor fora do formato esperado do campo)
+
+import multiprocessing
+
+
+contadores = None         # Tentativas e leituras aceitas por nível, compartilháveis entre processos
+
+
+'''
+Cria os contadores por nível (multiprocessing.Array, para que os processos do pool somem nos mesmos contadores):
+- 'tentativas': quantas leituras foram feitas em cada nível;
+- 'aceitas': quantas dessas leituras foram aceitas (o campo não precisou subir de nível);
+- 'recusadas': campos que não foram aceitos em nenhum nível (fica o melhor resultado entre os níveis).
+'''
+def novos_contadores(n_niveis, contexto=multiprocessing):
+  return {'tentativas': contexto.Array('q', n_niveis), 'aceitas': contexto.Array('q', n_niveis),
+          'recusadas': contexto.Value('q', 0)}
+
+
+def iniciar_contadores(n_niveis, contadores_compartilhados=None):
+  global contadores
+  contadores = contadores_compartilhados or novos_contadores(n_niveis)
+
+
+'''
+Uma leitura é aceita quando há texto, o texto respeita o formato do campo (expressão regular, se houver)
+e, nos campos com confiança, a confiança é de pelo menos `corte`.
+'''
+def leitura_aceita(ocr_result, formato, com_conf, corte):
+  if not ocr_result:
+    return False
+  if formato is not None and not formato.fullmatch(ocr_result[0][1]):
+    return False
+  return not com_conf or ocr_result[0][2] >= corte
+
+
+'''
+Posição em `niveis` do primeiro nível em que o campo é lido.
+Sem formato e sem confiança (ex: Patient, Algorithm_Ver, MRR), qualquer texto seria aceito, e uma leitura errada do
+nível barato nunca subiria de nível: esses campos começam na configuração padrão ({}, ou o primeiro nível se ela não
+estiver em `niveis`).
+'''
+def nivel_inicial(niveis, formato, com_conf):
+  if formato is None and not com_conf and {} in niveis:
+    return niveis.index({})
+  return 0
+
+
+'''
+Lê um campo subindo de nível, a partir de nivel_inicial, até a leitura ser aceita.
+`ler(i, nivel)` pré-processa o recorte com a configuração `nivel` (i é a posição em `niveis`) e executa o OCR,
+retornando (recorte, ocr_result). Retorna (recorte, ocr_result, i) da leitura aceita; se nenhuma for aceita,
+o melhor resultado entre os níveis (formato válido, depois maior confiança, depois o nível mais alto).
+'''
+def ler_em_niveis(ler, niveis, formato, com_conf, corte):
+  melhor = None
+  for i in range(nivel_inicial(niveis, formato, com_conf), len(niveis)):
+    nivel = niveis[i]
+    img_cropped, ocr_result = ler(i, nivel)
+    _incrementa('tentativas', i)
+    if leitura_aceita(ocr_result, formato, com_conf, corte):
+      _incrementa('aceitas', i)
+      return img_cropped, ocr_result, i
+    valido = bool(ocr_result) and (formato is None or formato.fullmatch(ocr_result[0][1]) is not None)
+    conf = ocr_result[0][2] if ocr_result and com_conf else 0
+    if melhor is None or (valido, conf) >= melhor[0]:
+      melhor = ((valido, conf), img_cropped, ocr_result, i)
+  with contadores['recusadas'].get_lock():
+    contadores['recusadas'].value += 1
+  return melhor[1], melhor[2], melhor[3]
+
+
+def _incrementa(nome, i):
+  with contadores[nome].get_lock():
+    contadores[nome][i] += 1
+
+
+'''
+Texto com as tentativas e a taxa de aceitação de cada nível na execução atual.
+'''
+def resumo_niveis(niveis):
+  linhas = ['Releitura adaptativa:']
+  for i, nivel in enumerate(niveis):
+    tentativas = contadores['tentativas'][i]
+    aceitas = contadores['aceitas'][i]
+    taxa = 100 * aceitas / tentativas if tentativas else 0
+    linhas.append('  nível %d %s: %d leituras, %d aceitas (%.1f%%)' % (i, nivel or '(padrão)', tentativas, aceitas, taxa))
+  linhas.append('  campos não aceitos em nenhum nível: %d' % contadores['recusadas'].value)
+  return '\n'.join(linhas)
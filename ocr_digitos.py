@@ -0,0 +1,221 @@
+# Reconhecedor leve para os campos numéricos (exames e mapas): comparação dos glifos com modelos da fonte do RTVue,
+# sem rede neural. Os campos cuja leitura não atinge o corte de similaridade voltam para o EasyOCR.
+#
+# O banco de glifos é montado a partir dos recortes salvos em RECORTES_DIR (o valor vem do ground_truth.csv quando
+# o campo está lá, senão do nome do arquivo do recorte):
+#   python ocr_digitos.py construir [--recortes recortes] [--saida banco_digitos.npz]
+#
+# Reconhecimento de um recorte:
+# - binarização pelo limiar de Otsu (o texto é a classe minoritária, seja ele escuro ou claro);
+# - segmentação pela projeção das colunas: cada sequência de colunas com texto é um glifo (a fonte não tem glifos encostados);
+# - cada glifo, na altura da linha de texto, é redimensionado para ALTURA_GLIFO x LARGURA_GLIFO e comparado por correlação
+#   normalizada com os modelos do grupo do campo (exame ou mapa), restritos à allowlist do campo;
+# - a confiança do campo é a menor similaridade entre os seus glifos.
+
+import argparse
+import io
+import os
+import tarfile
+import zipfile
+import numpy as np
+from PIL import Image
+
+from binarizacao import limiar_otsu
+import dataset_recortes
+
+
+CARACTERES = '-0123456789.'  # Caracteres reconhecidos; campos com outros caracteres na allowlist vão direto para o EasyOCR
+BANCO_DIGITOS_FILE = 'banco_digitos.npz' # Arquivo do banco de glifos, no diretório raiz
+ALTURA_GLIFO = 24
+LARGURA_GLIFO = 16
+CONTRASTE_MINIMO = 64        # Recortes com menos contraste (ex: campo vazio) não são segmentados
+AREA_MINIMA = 0.01           # Sequências de colunas com menos pixels de texto que isso (fração da altura²) são ruído
+TOLERANCIA_PROPORCAO = 1.6   # Razão máxima entre a proporção (largura/altura) do glifo e a do modelo
+
+
+'''
+Banco de glifos carregado de BANCO_DIGITOS_FILE:
+- caracteres: caractere de cada modelo; grupos: grupo ('exame' ou 'mapa') de cada modelo;
+- modelos: glifos médios normalizados (N x ALTURA_GLIFO*LARGURA_GLIFO, média zero e norma 1);
+- proporcoes: proporção média (largura/altura da linha) de cada modelo; amostras: quantos glifos formaram cada modelo.
+'''
+class BancoGlifos:
+  def __init__(self, caracteres, grupos, modelos, proporcoes, amostras):
+    self.caracteres = np.asarray(caracteres)
+    self.grupos = np.asarray(grupos)
+    self.modelos = np.asarray(modelos, dtype=np.float32)
+    self.proporcoes = np.asarray(proporcoes, dtype=np.float32)
+    self.amostras = np.asarray(amostras, dtype=np.int32)
+    self._indices = {}
+
+  '''
+  Índices dos modelos de um grupo cujos caracteres estão na allowlist (guardados por grupo e allowlist).
+  '''
+  def indices(self, grupo, allowlist):
+    chave = (grupo, allowlist)
+    if chave not in self._indices:
+      self._indices[chave] = np.flatnonzero((self.grupos == grupo) & np.isin(self.caracteres, list(allowlist)))
+    return self._indices[chave]
+
+  def salvar(self, caminho):
+    np.savez_compressed(caminho, caracteres=self.caracteres, grupos=self.grupos, modelos=self.modelos,
+                        proporcoes=self.proporcoes, amostras=self.amostras)
+
+
+def carregar_banco(caminho):
+  with np.load(caminho) as dados:
+    return BancoGlifos(dados['caracteres'], dados['grupos'], dados['modelos'], dados['proporcoes'], dados['amostras'])
+
+
+'''
+Indica se um campo pode ser lido pelo reconhecedor de glifos (allowlist não vazia, só com caracteres de CARACTERES).
+'''
+def campo_numerico(allowlist):
+  return bool(allowlist) and set(allowlist) <= set(CARACTERES)
+
+
+'''
+Segmenta o recorte (array em tons de cinza ou colorido) em glifos.
+Retorna (vetores, proporcoes): um vetor normalizado por glifo (G x ALTURA_GLIFO*LARGURA_GLIFO) e a proporção
+largura/altura da linha de cada glifo, ou None se o recorte não tiver contraste ou texto.
+'''
+def segmentar(arr):
+  cinza = arr if arr.ndim == 2 else np.asarray(Image.fromarray(arr).convert('L'))
+  if int(cinza.max()) - int(cinza.min()) < CONTRASTE_MINIMO:
+    return None
+  texto = cinza < limiar_otsu(Image.fromarray(cinza))
+  if texto.mean() > 0.5:  # Texto claro sobre fundo escuro
+    texto = ~texto
+
+  linhas = np.flatnonzero(texto.any(axis=1))
+  if len(linhas) == 0:
+    return None
+  faixa = texto[linhas[0]:linhas[-1] + 1]
+  altura = faixa.shape[0]
+  colunas = np.concatenate(([False], faixa.any(axis=0), [False]))
+  bordas = np.flatnonzero(colunas[1:] != colunas[:-1])
+
+  vetores, proporcoes = [], []
+  for inicio, fim in zip(bordas[::2], bordas[1::2]):
+    glifo = faixa[:, inicio:fim]
+    if glifo.sum() < AREA_MINIMA * altura * altura:
+      continue
+    redimensionado = Image.fromarray(glifo.astype(np.uint8) * 255).resize((LARGURA_GLIFO, ALTURA_GLIFO), Image.Resampling.BILINEAR)
+    vetores.append(_normalizar(np.asarray(redimensionado, dtype=np.float32).ravel()))
+    proporcoes.append((fim - inicio) / altura)
+  if not vetores:
+    return None
+  return np.stack(vetores), np.asarray(proporcoes, dtype=np.float32)
+
+
+def _normalizar(vetor):
+  vetor = vetor - vetor.mean()
+  norma = np.linalg.norm(vetor)
+  return vetor / norma if norma > 0 else vetor
+
+
+'''
+Lê um recorte de um campo do grupo `grupo` ('exame' ou 'mapa') restrito a `allowlist`.
+Retorna o resultado no formato do reader.readtext ([[caixa, texto, confiança]]), com a confiança igual à menor
+similaridade entre os glifos, ou [] se o recorte não puder ser segmentado ou não houver modelos para o campo.
+'''
+def reconhecer(banco, arr, grupo, allowlist):
+  indices = banco.indices(grupo, allowlist)
+  if len(indices) == 0:
+    return []
+  segmentos = segmentar(arr)
+  if segmentos is None:
+    return []
+  vetores, proporcoes = segmentos
+
+  similaridade = vetores @ banco.modelos[indices].T                       # G x modelos
+  razao = proporcoes[:, None] / banco.proporcoes[indices][None, :]
+  similaridade[(razao > TOLERANCIA_PROPORCAO) | (razao < 1 / TOLERANCIA_PROPORCAO)] = 0
+  melhores = similaridade.argmax(axis=1)
+  texto = ''.join(banco.caracteres[indices][melhores])
+  confianca = float(similaridade[np.arange(len(melhores)), melhores].min())
+  altura, largura = arr.shape[:2]
+  return [[[[0, 0], [largura, 0], [largura, altura], [0, altura]], texto, max(confianca, 0.0)]]
+
+
+'''
+Percorre os recortes salvos em `diretorio` (arquivos .jpg soltos, agrupados em .tar/.zip ou conjuntos empacotados
+de cada execução, ver arquivo_recortes.py). Produz (nome do arquivo do recorte, imagem PIL); para os conjuntos
+empacotados, o nome é montado a partir do índice no mesmo formato dos arquivos soltos.
+'''
+def _ler_recortes(diretorio):
+  for nome in sorted(os.listdir(diretorio)):
+    caminho = os.path.join(diretorio, nome)
+    if dataset_recortes.eh_dataset(caminho):
+      ds = dataset_recortes.abrir_dataset(caminho)
+      for i in range(len(ds)):
+        yield ds.chave(i) + '_valor_' + (ds.valor[i] or '-') + '.jpg', Image.fromarray(np.array(ds.recorte(i)))
+    elif nome.endswith('.jpg'):
+      with Image.open(caminho) as img:
+        yield nome, img.copy()
+    elif nome.endswith('.tar'):
+      with tarfile.open(caminho) as tar:
+        for membro in tar.getmembers():
+          yield membro.name, Image.open(io.BytesIO(tar.extractfile(membro).read()))
+    elif nome.endswith('.zip'):
+      with zipfile.ZipFile(caminho) as zf:
+        for membro in zf.namelist():
+          yield membro, Image.open(io.BytesIO(zf.read(membro)))
+
+
+'''
+Monta o banco de glifos a partir dos recortes salvos.
+O nome de cada recorte é "<paciente_base>_<campo>_valor_<valor>.jpg" (ver sarmento_ocr.salvar_recorte); o valor usado
+é o do ground truth (chave "<paciente_base>_<campo>") quando houver, senão o do nome do arquivo.
+Só entram os recortes de campos numéricos em que a segmentação encontra exatamente um glifo por caractere do valor.
+- grupos: {campo: grupo} dos campos numéricos ('exame' ou 'mapa');
+- ground_truth: {chave: valor}.
+'''
+def construir_banco(diretorio, grupos, ground_truth=None):
+  ground_truth = ground_truth or {}
+  acumulados = {}
+  usados = 0
+  for nome, img in _ler_recortes(diretorio):
+    chave, separador, valor = os.path.splitext(nome)[0].rpartition('_valor_')
+    campo = max((c for c in grupos if chave.endswith('_' + c)), key=len, default=None)
+    if not separador or campo is None:
+      continue
+    valor = ground_truth.get(chave, valor if valor != '-' else '').strip()  # '-' no nome é leitura vazia
+    if not valor or not set(valor) <= set(CARACTERES):
+      continue
+    segmentos = segmentar(np.asarray(img))
+    if segmentos is None or len(segmentos[0]) != len(valor):
+      continue
+    usados += 1
+    for caractere, vetor, proporcao in zip(valor, *segmentos):
+      soma = acumulados.setdefault((grupos[campo], caractere), [np.zeros_like(vetor), 0.0, 0])
+      soma[0] += vetor
+      soma[1] += proporcao
+      soma[2] += 1
+
+  chaves = sorted(acumulados)
+  banco = BancoGlifos([c for _, c in chaves], [g for g, _ in chaves],
+                      [_normalizar(acumulados[k][0] / acumulados[k][2]) for k in chaves] or np.zeros((0, ALTURA_GLIFO * LARGURA_GLIFO)),
+                      [acumulados[k][1] / acumulados[k][2] for k in chaves], [acumulados[k][2] for k in chaves])
+  return banco, usados
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Banco de glifos do reconhecedor de campos numéricos')
+  comandos = parser.add_subparsers(dest='comando', required=True)
+  construir = comandos.add_parser('construir', help='monta o banco a partir dos recortes salvos')
+  construir.add_argument('--recortes', default='recortes', help='diretório dos recortes (RECORTES_DIR)')
+  construir.add_argument('--saida', default=BANCO_DIGITOS_FILE, help='arquivo do banco')
+  args = parser.parse_args()
+
+  import sarmento_ocr as so
+  grupos = {}
+  for tabela in so.obter_registro().values():
+    for grupo in ('exame', 'mapa'):
+      grupos.update((campo, grupo) for campo, v in tabela.pontos[grupo].items() if campo_numerico(v[4]))
+  caminho_gt = os.path.join(os.path.dirname(os.path.abspath(so.__file__)), 'ground_truth.csv')
+  banco, usados = construir_banco(args.recortes, grupos, so.carregar_ground_truth() if os.path.exists(caminho_gt) else None)
+  banco.salvar(args.saida)
+  print('%d recortes usados; %d modelos gravados em %s' % (usados, len(banco.caracteres), args.saida))
+  for grupo, caractere, n in zip(banco.grupos, banco.caracteres, banco.amostras):
+    print('  %-6s %s: %d glifos' % (grupo, caractere, n))
@@ -0,0 +1,86 @@
+# Reconhecimento em lote dos recortes de posição fixa, sem passar pelo detector de texto (CRAFT)
+#
+# Cada recorte é tratado como uma única caixa de texto do seu tamanho, como no reader.recognize com
+# horizontal_list=[[0, largura, 0, altura]]. O reader.recognize, na CPU, lê as caixas uma por vez; aqui os recortes
+# vão juntos para o reconhecedor (easyocr.recognition.get_text, que monta lotes de `batch_size` recortes).
+# O get_text completa todos os recortes do lote até uma mesma largura (múltiplo da altura do modelo); para que cada
+# recorte seja lido exatamente como no recognize campo a campo, os lotes só juntam recortes com a mesma largura final.
+#
+# Só é aceito com o reconhecedor fp32 (backends_ocr.criar_reader com fp32=True; reader.reconhecedor_fp32): nos
+# reconhecedores int8 (o EasyOCR na CPU e o backend 'onnx') a escala da quantização dinâmica das ativações é calculada
+# sobre o lote inteiro, e a leitura de um recorte passaria a depender dos outros recortes do lote.
+# Diferenças em relação ao caminho padrão (reader.readtext por campo): não há o detector de texto (CRAFT), nem o
+# paragraph=True dos campos de info e o min_size de PARAMETROS_OCR; cada recorte é lido como uma caixa só. A
+# equivalência com o readtext ainda não foi medida com os pesos reais (python benchmark.py ocr_lote <imagens>).
+# Usa funções internas do EasyOCR (recognition.get_text e utils.get_image_list), conferidas com o easyocr 1.7.2.
+
+import numpy as np
+from PIL import Image
+
+
+'''
+Converte um recorte (PIL.Image ou array) para array 2D em tons de cinza.
+'''
+def recorte_cinza(img_cropped):
+  if isinstance(img_cropped, np.ndarray):
+    if img_cropped.ndim == 2:
+      return img_cropped
+    img_cropped = Image.fromarray(img_cropped)
+  if img_cropped.mode != 'L':
+    img_cropped = img_cropped.convert('L')
+  return np.asarray(img_cropped, dtype=np.uint8)
+
+
+'''
+Redimensiona o recorte para a altura do modelo, como o reader.recognize faz com a caixa do recorte inteiro.
+Retorna (recorte redimensionado, largura até a qual o reconhecedor o completa), ou (None, 0) para recortes vazios.
+'''
+def preparar_recorte(arr):
+  from easyocr.easyocr import imgH
+  from easyocr.utils import get_image_list
+  altura, largura = arr.shape
+  lista, largura_lote = get_image_list([[0, largura, 0, altura]], [], arr, model_height=imgH)
+  if not lista:
+    return None, 0
+  return lista[0][1], largura_lote
+
+
+'''
+Lê de uma vez recortes já preparados (preparar_recorte) com a mesma largura de lote, pelo reconhecedor do reader
+(easyocr.Reader de qualquer backend de backends_ocr.py). Usa os mesmos parâmetros padrão do reader.recognize.
+Retorna a lista de (valor, confiança), na ordem dos recortes.
+'''
+def reconhecer_recortes(reader, recortes, largura_lote, allowlist=None, batch_size=32):
+  from easyocr.easyocr import imgH
+  from easyocr.recognition import get_text
+  ignore_char = ''.join(set(reader.character) - set(allowlist or reader.lang_char))
+  lidos = get_text(reader.character, imgH, int(largura_lote), reader.recognizer, reader.converter,
+                   [(None, r) for r in recortes], ignore_char, batch_size=batch_size, workers=0, device=reader.device)
+  return [(valor, conf) for _, valor, conf in lidos]
+
+
+'''
+Executa o OCR de vários recortes de uma vez.
+Recebe `campos` como uma lista de (chave, recorte, allowlist) e retorna um dicionário chave -> (valor, confiança).
+Como as coordenadas dos campos já são conhecidas, o detector de texto é ignorado: os recortes são agrupados por allowlist
+e largura de lote e lidos em lotes pelo reconhecedor (reconhecer_recortes); o resultado de cada recorte é o mesmo do
+reader.recognize com a caixa do recorte inteiro.
+Campos sem resultado recebem ('', 0), igual ao tratamento das funções getting_*.
+'''
+def reconhecer_lote(reader, campos, batch_size=32):
+  if not getattr(reader, 'reconhecedor_fp32', False):
+    raise ValueError('o OCR em lote requer o reconhecedor fp32 (backends_ocr.criar_reader com fp32=True)')
+  resultados = {}
+  grupos = {}
+  for chave, img_cropped, allowlist in campos:
+    recorte, largura_lote = preparar_recorte(recorte_cinza(img_cropped))
+    if recorte is None:
+      resultados[chave] = ('', 0)
+    else:
+      grupos.setdefault((allowlist, largura_lote), []).append((chave, recorte))
+
+  for (allowlist, largura_lote), itens in grupos.items():
+    lidos = reconhecer_recortes(reader, [recorte for _, recorte in itens], largura_lote, allowlist, batch_size)
+    for (chave, _), resultado in zip(itens, lidos):
+      resultados[chave] = resultado
+  return resultados
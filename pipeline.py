@@ -0,0 +1,89 @@
+# Pipeline em etapas (threads e filas limitadas) para sobrepor a leitura dos arquivos, a decodificação,
+# o pré-processamento e o OCR: enquanto o reconhecedor trabalha em uma imagem, as próximas já estão sendo lidas do disco
+#
+# As etapas do OCR (torch) e da decodificação/redimensionamento (PIL) liberam o GIL, por isso threads bastam
+# para sobrepor as etapas mesmo em um único processo.
+
+import queue
+import threading
+
+
+_FIM = object()           # Marca de fim da fila de uma etapa
+
+
+'''
+Falha de uma etapa: o item segue pelas etapas seguintes sem ser processado e a exceção é relançada na saída.
+'''
+class _Falha:
+  def __init__(self, erro):
+    self.erro = erro
+
+
+'''
+Executa os itens de `entradas` por uma sequência de etapas e produz os resultados na mesma ordem das entradas.
+- etapas: lista de (nome, funcao, n_threads); cada funcao recebe o resultado da etapa anterior (a primeira recebe o item).
+  Etapas que usam um recurso que não pode ser compartilhado (ex: o leitor EasyOCR) devem ter n_threads = 1.
+- max_em_andamento: quantidade máxima de itens entre a entrada e a saída (lidos e ainda não consumidos), o que limita
+  a memória: quando o limite é atingido, a leitura das entradas espera o consumidor.
+A iteração de `entradas` também acontece em uma thread, portanto a listagem (e o hash) dos arquivos é sobreposta ao OCR.
+Uma exceção em qualquer etapa interrompe a execução e é relançada para quem consome os resultados.
+'''
+def executar(entradas, etapas, max_em_andamento=8):
+  vagas = threading.Semaphore(max_em_andamento)
+  filas = [queue.Queue(maxsize=max_em_andamento) for _ in range(len(etapas) + 1)]
+  erro_entrada = []
+
+  def alimentar():
+    try:
+      for i, item in enumerate(entradas):
+        vagas.acquire()
+        filas[0].put((i, item))
+    except Exception as e:
+      erro_entrada.append(e)
+    for _ in range(etapas[0][2]):
+      filas[0].put(_FIM)
+
+  def trabalhar(k, funcao, restantes):
+    while True:
+      item = filas[k].get()
+      if item is _FIM:
+        break
+      i, valor = item
+      if not isinstance(valor, _Falha):
+        try:
+          valor = funcao(valor)
+        except Exception as e:
+          valor = _Falha(e)
+      filas[k + 1].put((i, valor))
+    with restantes[1]:
+      restantes[0] -= 1
+      ultima = restantes[0] == 0
+    if ultima:  # A última thread da etapa avisa as threads da próxima
+      for _ in range(etapas[k + 1][2] if k + 1 < len(etapas) else 1):
+        filas[k + 1].put(_FIM)
+
+  threads = [threading.Thread(target=alimentar, name='pipeline-entrada', daemon=True)]
+  for k, (nome, funcao, n_threads) in enumerate(etapas):
+    restantes = [n_threads, threading.Lock()]
+    threads += [threading.Thread(target=trabalhar, args=(k, funcao, restantes), name='pipeline-%s-%d' % (nome, j),
+                                 daemon=True) for j in range(n_threads)]
+  for t in threads:
+    t.start()
+
+  # Com várias threads na mesma etapa os itens podem chegar fora de ordem: ficam guardados até chegar a vez deles
+  proximo = 0
+  prontos = {}
+  while True:
+    item = filas[-1].get()
+    if item is _FIM:
+      break
+    prontos[item[0]] = item[1]
+    while proximo in prontos:
+      valor = prontos.pop(proximo)
+      if isinstance(valor, _Falha):
+        raise valor.erro
+      yield valor
+      proximo += 1
+      vagas.release()
+  if erro_entrada:
+    raise erro_entrada[0]
@@ -0,0 +1,250 @@
+# Reconciliação dos resultados do OCR com o ground_truth.csv em operações vetorizadas (pandas), sem laço por campo
+#
+# As chaves do ground truth ("<pasta>___<paciente>_<campo>", ver sarmento_ocr.nome_paciente_base) são decompostas uma
+# única vez em um índice em colunas (grupo, paciente, campo, olho); a saída do OCR (CSV ou Parquet, uma linha por
+# imagem) é convertida para o mesmo formato longo, e a comparação é um merge seguido de comparações de colunas.
+# Os valores são normalizados antes da comparação: caracteres trocados por sarmento_ocr.limpar_valor, espaços,
+# números (57,470 == 57.47) e datas (9/9/2021 == 09-09-2021).
+#
+# Uso:
+#   python reconciliacao.py output/RTVue_20250101-120000.csv [--por grupo campo] [--erros erros.csv] [--saida acuracia.csv]
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from entradas import caminho_logico
+from saida import COLUNAS_FIXAS, SUFIXO_BRUTO
+
+
+SEPARADOR_PASTA = '___'   # Separa a pasta (grupo) do paciente nas chaves do ground truth
+RE_OLHO = r'(?:^|_|[EP])(OD|OS)(?:_|\d|$)'  # Olho no nome do campo: SSI_OD, EOD_I1, CO_POS, Pachy_Y_Pachmetry_OS...
+RE_NUMERO = r'^-?\d+(?:\.\d+)?$'
+RE_DATA = r'^(\d{1,2})-(\d{1,2})-(\d{4})$'
+TOLERANCIA_NUMERO = 1e-9  # Diferença máxima entre dois valores numéricos considerados iguais
+CHAVE_JUNCAO = ['grupo', 'paciente', 'campo']
+
+
+'''
+Decompõe as chaves do ground truth (Series de texto) no índice em colunas grupo, paciente, campo e olho.
+O paciente e o campo são separados pelo sufixo mais longo da chave que é um campo conhecido (`campos`); as chaves sem
+campo conhecido ficam com campo vazio (NA). O olho vem do nome do campo (OD/OS) ou, nos campos sem olho no nome,
+do valor do campo 'Eye' do mesmo paciente (`valores`, opcional).
+'''
+def indexar_chaves(chaves, campos, valores=None):
+  chaves = chaves.astype(str).str.strip().reset_index(drop=True)
+  partes = chaves.str.partition(SEPARADOR_PASTA)
+  resto = partes[2]
+  indice = pd.DataFrame({'chave': chaves, 'grupo': partes[0]})
+  indice['paciente'] = pd.Series(pd.NA, index=chaves.index, dtype='string')
+  indice['campo'] = pd.Series(pd.NA, index=chaves.index, dtype='string')
+
+  # Um extract por quantidade de '_' no nome do campo, do campo mais longo para o mais curto
+  campos = set(campos)
+  for n in range(max((c.count('_') for c in campos), default=-1), -1, -1):
+    partes = resto.str.extract(r'^(.*)_((?:[^_]*_){%d}[^_]*)$' % n)
+    encontrado = indice['campo'].isna() & partes[1].isin(campos)
+    indice.loc[encontrado, 'paciente'] = partes.loc[encontrado, 0]
+    indice.loc[encontrado, 'campo'] = partes.loc[encontrado, 1]
+
+  indice['olho'] = indice['campo'].str.extract(RE_OLHO, expand=False)
+  if valores is not None:
+    eh_olho = (indice['campo'] == 'Eye').fillna(False)
+    olhos = pd.DataFrame({'grupo': indice['grupo'], 'paciente': indice['paciente'],
+                          'olho_exame': normalizar(pd.Series(valores).reset_index(drop=True)).str.upper()})[eh_olho]
+    olhos = olhos[olhos['olho_exame'].isin(['OD', 'OS'])].drop_duplicates(['grupo', 'paciente'])
+    indice = indice.merge(olhos, on=['grupo', 'paciente'], how='left')
+    indice['olho'] = indice['olho'].fillna(indice['olho_exame'])
+    indice = indice.drop(columns='olho_exame')
+  return indice
+
+
+'''
+Normaliza uma Series de valores lidos ou esperados para comparação (texto):
+- troca os mesmos caracteres que sarmento_ocr.limpar_valor ('/' -> '-', '(', ')' e ',' -> '_') e remove espaços
+  nas pontas e repetidos;
+- números com vírgula decimal ("57_47" depois da troca) passam a usar ponto;
+- datas d-m-aaaa ficam com dia e mês em dois dígitos (dd-mm-aaaa).
+Valores ausentes viram ''.
+'''
+def normalizar(valores):
+  texto = valores.astype('string').fillna('')
+  texto = (texto.str.replace('/', '-', regex=False).str.replace('(', '_', regex=False).str.replace(')', '_', regex=False)
+           .str.replace(',', '_', regex=False).str.strip().str.replace(r'\s+', ' ', regex=True))
+  texto = texto.str.replace(r'^(-?\d+)_(\d+)$', r'\1.\2', regex=True)
+  data = texto.str.extract(RE_DATA)
+  eh_data = data[0].notna()
+  texto[eh_data] = data[0][eh_data].str.zfill(2) + '-' + data[1][eh_data].str.zfill(2) + '-' + data[2][eh_data]
+  return texto
+
+
+'''
+Valor numérico de cada valor já normalizado (NaN nos que não são números).
+'''
+def numeros(normalizados):
+  eh_numero = normalizados.str.match(RE_NUMERO).fillna(False).astype(bool)
+  return pd.to_numeric(normalizados.where(eh_numero), errors='coerce').astype(float)
+
+
+'''
+Lê o ground_truth.csv (variavel;valor) e devolve o índice em colunas com o valor esperado:
+chave, grupo, paciente, campo, olho, esperado. `campos` são os campos conhecidos (ver indexar_chaves).
+'''
+def carregar_ground_truth(caminho, campos):
+  gt = pd.read_csv(caminho, sep=';', dtype=str, keep_default_na=False)
+  indice = indexar_chaves(gt['variavel'], campos, gt['valor'])
+  indice['esperado'] = gt['valor'].str.strip().to_numpy()
+  return indice
+
+
+'''
+Campos de uma saída: todas as colunas menos as fixas, as de confiança e as de texto bruto (os metadados do nome do
+arquivo entram, mas não estão no ground truth).
+'''
+def campos_saida(colunas):
+  return [c for c in colunas if c not in COLUNAS_FIXAS and not c.endswith(('_conf', SUFIXO_BRUTO))]
+
+
+'''
+Lê a saída do OCR (arquivo CSV ou Parquet gerado por saida.abrir_escritor) em formato longo:
+uma linha por (imagem, campo lido) com grupo (pasta), paciente, arquivo, campo, lido (texto) e conf (NaN nos campos de info).
+'''
+def carregar_saida(caminho):
+  if caminho.endswith('.parquet'):
+    largo = pd.read_parquet(caminho)
+  else:
+    largo = pd.read_csv(caminho, sep=';', dtype=str, keep_default_na=False, na_values=[''])
+  return formato_longo(largo)
+
+
+'''
+Converte a saída larga (uma linha por imagem, uma coluna por campo) para o formato longo de carregar_saida.
+grupo, paciente, arquivo e campo são categóricos (códigos inteiros repetidos, sem copiar os textos linha a linha).
+'''
+def formato_longo(largo):
+  campos = campos_saida(largo.columns)
+  n = len(largo)
+  # Mesma decomposição das chaves do ground truth, a partir de "<pasta>___<paciente>" (sarmento_ocr.nome_paciente_base,
+  # que usa o caminho lógico das páginas e dos membros de pacotes); astype(str) e reindex para saídas sem nenhuma linha
+  logicos = largo['arquivo'].astype(str).map(caminho_logico)
+  nomes = logicos.str.replace('\\', '/', regex=False).str.rsplit('/', n=1).str[-1].str.split('__').str[0].astype(str)
+  ids = (largo['pasta'].astype(str) + SEPARADOR_PASTA + nomes).str.strip().str.partition(SEPARADOR_PASTA).reindex(columns=[0, 1, 2])
+  ids['arquivo'] = largo['arquivo'].astype(str).to_numpy()
+
+  def por_imagem(valores):
+    codigos, categorias = pd.factorize(valores)
+    return pd.Categorical.from_codes(np.repeat(codigos, len(campos)), categorias)
+
+  lidos = largo[campos].to_numpy(dtype=object)
+  confiancas = np.full((n, len(campos)), np.nan)
+  for j, campo in enumerate(campos):
+    if campo + SUFIXO_BRUTO in largo.columns:
+      # Texto que não virou número na saída (ex: "57,47"): é o que o OCR leu, e a normalização ainda pode aceitá-lo
+      vazios = pd.isna(lidos[:, j])
+      lidos[vazios, j] = largo[campo + SUFIXO_BRUTO].to_numpy(dtype=object)[vazios]
+    if campo + '_conf' in largo.columns:
+      confiancas[:, j] = pd.to_numeric(largo[campo + '_conf'], errors='coerce')
+  return pd.DataFrame({
+    'grupo': por_imagem(ids[0]),
+    'paciente': por_imagem(ids[2]),
+    'arquivo': por_imagem(ids['arquivo']),
+    'campo': pd.Categorical.from_codes(np.tile(np.arange(len(campos)), n), campos),
+    'lido': pd.Series(lidos.ravel(), dtype=object).where(pd.notna(lidos.ravel()), None),
+    'conf': confiancas.ravel(),
+  })
+
+
+'''
+Aplica `funcao` (de Series para Series) só aos valores distintos de `valores` e espalha o resultado:
+as leituras de um arquivo inteiro têm poucos valores distintos em relação à quantidade de campos.
+'''
+def _por_valor_distinto(funcao, valores):
+  codigos, distintos = pd.factorize(valores, use_na_sentinel=False)
+  return funcao(pd.Series(distintos, dtype=object)).to_numpy()[codigos]
+
+
+def _codigos(coluna, categorias):
+  return pd.Index(categorias).get_indexer(coluna)
+
+
+'''
+Junta as leituras (formato longo, ver carregar_saida) com o ground truth indexado (carregar_ground_truth) por
+grupo, paciente e campo, e compara os valores normalizados. Só entram os campos com valor esperado não vazio.
+Colunas acrescentadas: olho, esperado, lido_norm, esperado_norm, acerto. Leituras sem valor lido contam como erro.
+A junção é feita por códigos inteiros (exame e campo) das categorias das leituras, em vez de comparar textos.
+'''
+def reconciliar(leituras, ground_truth):
+  esperados = ground_truth[ground_truth['campo'].notna() & (ground_truth['esperado'] != '')]
+  esperados = esperados.drop_duplicates(CHAVE_JUNCAO, keep='last')
+  leituras = leituras.astype({coluna: 'category' for coluna in CHAVE_JUNCAO})
+  grupos, pacientes, campos = (leituras[coluna].cat.categories for coluna in CHAVE_JUNCAO)
+
+  # Chave inteira (grupo, paciente, campo) nos dois lados; -1 nos valores ausentes do outro lado
+  def chave(codigo_grupo, codigo_paciente, codigo_campo):
+    chaves = (codigo_grupo.astype(np.int64) * len(pacientes) + codigo_paciente) * len(campos) + codigo_campo
+    return np.where((codigo_grupo < 0) | (codigo_paciente < 0) | (codigo_campo < 0), -1, chaves)
+  chave_esperado = chave(_codigos(esperados['grupo'], grupos), _codigos(esperados['paciente'], pacientes),
+                         _codigos(esperados['campo'], campos))
+  chave_lido = chave(*(leituras[coluna].cat.codes.to_numpy() for coluna in CHAVE_JUNCAO))
+  validos = chave_esperado >= 0
+  posicao = pd.Index(chave_esperado[validos]).get_indexer(chave_lido)
+  encontrados = (posicao >= 0) & (chave_lido >= 0)
+
+  tabela = leituras[encontrados].reset_index(drop=True)
+  correspondentes = esperados[validos].iloc[posicao[encontrados]]
+  tabela['olho'] = correspondentes['olho'].to_numpy()
+  tabela['esperado'] = correspondentes['esperado'].to_numpy()
+  tabela['lido_norm'] = _por_valor_distinto(normalizar, tabela['lido'])
+  tabela['esperado_norm'] = _por_valor_distinto(normalizar, tabela['esperado'])
+  numero_lido = _por_valor_distinto(numeros, tabela['lido_norm']).astype(float)
+  numero_esperado = _por_valor_distinto(numeros, tabela['esperado_norm']).astype(float)
+  mesmo_numero = np.isclose(numero_lido, numero_esperado, rtol=0, atol=TOLERANCIA_NUMERO)  # NaN nunca é igual
+  tabela['acerto'] = (tabela['lido_norm'] == tabela['esperado_norm']).to_numpy(dtype=bool) | mesmo_numero
+  return tabela
+
+
+'''
+Tabela de acurácia agrupada pelas colunas `por` (ex: ['grupo'], ['campo'], ['grupo', 'campo'], ['olho']):
+n, acertos, acuracia e a confiança média das leituras certas e erradas.
+'''
+def acuracia(tabela, por=('campo',)):
+  por = list(por)
+  tabela = tabela.assign(conf_acerto=tabela['conf'].where(tabela['acerto']), conf_erro=tabela['conf'].where(~tabela['acerto']))
+  resumo = tabela.groupby(por, dropna=False).agg(n=('acerto', 'size'), acertos=('acerto', 'sum'),
+                                                 conf_media_acertos=('conf_acerto', 'mean'),
+                                                 conf_media_erros=('conf_erro', 'mean'))
+  resumo.insert(2, 'acuracia', resumo['acertos'] / resumo['n'])
+  return resumo.reset_index()
+
+
+'''
+Tabela de erros (leituras diferentes do esperado), das de maior confiança para as de menor.
+'''
+def erros(tabela):
+  colunas = ['grupo', 'paciente', 'campo', 'olho', 'arquivo', 'lido', 'esperado', 'conf']
+  return tabela.loc[~tabela['acerto'], colunas].sort_values('conf', ascending=False, na_position='last')
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Acurácia dos resultados do OCR contra o ground_truth.csv')
+  parser.add_argument('saida_ocr', help='arquivo de resultados (RTVue_*.csv ou .parquet)')
+  parser.add_argument('--ground-truth', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ground_truth.csv'),
+                      help='arquivo do ground truth')
+  parser.add_argument('--por', nargs='+', default=['grupo', 'campo'], help='colunas de agrupamento (grupo, campo, olho)')
+  parser.add_argument('--saida', default=None, help='grava a tabela de acurácia neste CSV')
+  parser.add_argument('--erros', default=None, help='grava a tabela de erros neste CSV')
+  args = parser.parse_args()
+
+  leituras = carregar_saida(args.saida_ocr)
+  tabela = reconciliar(leituras, carregar_ground_truth(args.ground_truth, leituras['campo'].unique()))
+  acertos, total = int(tabela['acerto'].sum()), len(tabela)
+  print('Acurácia total: %.2f%% (%d/%d campos com valor esperado)' % (100 * acertos / total if total else 0, acertos, total))
+  resumo = acuracia(tabela, args.por)
+  if args.saida:
+    resumo.to_csv(args.saida, sep=';', index=False)
+  else:
+    print(resumo.to_string(index=False))
+  if args.erros:
+    erros(tabela).to_csv(args.erros, sep=';', index=False)
+    print('%d erros gravados em %s' % (total - acertos, args.erros))
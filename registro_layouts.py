@@ -0,0 +1,91 @@
+# Registro declarativo dos layouts de exame: coordenadas dos recortes lidas de um arquivo JSON e compiladas uma única vez
+#
+# Formato do arquivo (REGISTRO_FILE):
+# {"formatos": {"<allowlist>": "<expressão regular>", ...},
+#  "layouts": [{"padrao": 1, "nome": "...",
+#               "info": {"campos": {"Patient": [x, y, largura, altura, allowlist], ...}},
+#               "exame": {"campos": {...}},
+#               "mapa": {"largura": 45, "altura": 15, "allowlist": "0123456789", "campos": {"CO_POD": [x, y], ...}}}]}
+# Em cada grupo, "largura", "altura" e "allowlist" são opcionais e valem para os campos informados só como [x, y].
+# "formatos" associa a allowlist de um campo ao formato esperado do valor lido (usado pela releitura adaptativa).
+# Um novo formato de exportação do RTVue é suportado incluindo um novo item em "layouts" (com um novo número de padrão).
+
+import copy
+import json
+import re
+import numpy as np
+
+
+REGISTRO_FILE = 'registro_layouts.json'  # Arquivo do registro, no diretório raiz
+GRUPOS = ('info', 'exame', 'mapa')       # Grupos de campos, cada um com o seu pré-processamento e parâmetros de OCR
+
+
+'''
+Tabela de recortes de um layout, compilada a partir do registro.
+- campos: nomes dos campos, na ordem do arquivo;
+- grupo: índice em GRUPOS de cada campo (array int8);
+- caixas: [x, y, largura, altura] de cada campo (array int32, N x 4);
+- allowlists / id_allowlist: allowlists distintas do layout e o índice da allowlist de cada campo (array int16);
+- pontos: {grupo: {campo: [x, y, largura, altura, allowlist]}}, o formato usado por info_crops/exam_crops/get_map_crops
+  (compartilhado entre as imagens: não deve ser alterado);
+- formatos: {campo: expressão regular compilada} dos campos cuja allowlist tem formato no registro.
+'''
+class TabelaRecortes:
+  def __init__(self, padrao, nome, grupos, formatos=None):
+    self.padrao = padrao
+    self.nome = nome
+    self.campos = []
+    self.pontos = {}
+    self.formatos = {}
+    grupo, caixas, id_allowlist = [], [], []
+    self.allowlists = []
+    for g in GRUPOS:
+      definicao = grupos.get(g, {})
+      self.pontos[g] = {}
+      for campo, valores in definicao.get('campos', {}).items():
+        if len(valores) == 2:
+          valores = valores + [definicao['largura'], definicao['altura'], definicao.get('allowlist', '')]
+        x, y, largura, altura, allowlist = valores
+        if allowlist not in self.allowlists:
+          self.allowlists.append(allowlist)
+        self.campos.append(campo)
+        grupo.append(GRUPOS.index(g))
+        caixas.append([x, y, largura, altura])
+        id_allowlist.append(self.allowlists.index(allowlist))
+        self.pontos[g][campo] = [x, y, largura, altura, allowlist]
+        if formatos and allowlist in formatos:
+          self.formatos[campo] = formatos[allowlist]
+    self.grupo = np.array(grupo, dtype=np.int8)
+    self.caixas = np.array(caixas, dtype=np.int32).reshape(-1, 4)
+    self.id_allowlist = np.array(id_allowlist, dtype=np.int16)
+
+  '''
+  Cópia da tabela com as caixas de todos os campos transformadas para uma imagem desalinhada (alinhamento.py):
+  x' = escala * x + dx, y' = escala * y + dy, largura e altura multiplicadas pela escala (arredondadas para inteiros).
+  A tabela original, compartilhada entre as imagens, não é alterada.
+  '''
+  def alinhada(self, dx, dy, escala=1.0):
+    tabela = copy.copy(self)
+    caixas = self.caixas * float(escala)
+    caixas[:, :2] += (dx, dy)
+    tabela.caixas = np.rint(caixas).astype(np.int32)
+    tabela.pontos = {g: {} for g in GRUPOS}
+    for campo, g, caixa, i in zip(self.campos, self.grupo, tabela.caixas.tolist(), self.id_allowlist):
+      tabela.pontos[GRUPOS[g]][campo] = caixa + [self.allowlists[i]]
+    return tabela
+
+
+'''
+Lê o registro e compila cada layout. Retorna um dicionário padrão -> TabelaRecortes.
+'''
+def carregar_registro(caminho):
+  with open(caminho, encoding='utf-8') as f:
+    dados = json.load(f)
+  formatos = {allowlist: re.compile(expressao) for allowlist, expressao in dados.get('formatos', {}).items()}
+  registro = {}
+  for layout in dados['layouts']:
+    padrao = int(layout['padrao'])
+    if padrao in registro:
+      raise ValueError('padrão %d repetido no registro de layouts' % padrao)
+    registro[padrao] = TabelaRecortes(padrao, layout.get('nome', ''), layout, formatos)
+  return registro
@@ -0,0 +1,219 @@
+# Gravação incremental dos resultados em formato colunar (CSV ou Parquet), exame a exame
+
+import csv
+import math
+import numpy as np
+
+
+FORMATOS_SAIDA = ('excel', 'csv', 'parquet')
+COLUNAS_FIXAS = ['pasta', 'arquivo']   # Colunas de identificação, antes dos campos lidos por OCR
+SUFIXO_BRUTO = '_bruto'                # Coluna de texto com a leitura dos campos numéricos que não virou número
+
+
+'''
+Monta o esquema da saída a partir das tabelas de recortes de todos os padrões.
+Recebe uma lista de dicionários de recortes de informações e outra de recortes numéricos (exames e mapas),
+no formato {campo: [x, y, largura, altura, allowlist]}.
+Retorna uma lista ordenada de (coluna, tipo), com tipo 'texto', 'numero' ou 'bruto':
+- campos de informação (paciente, datas, olho...) são texto;
+- campos de exames e mapas são números, cada um seguido da coluna '<campo>_conf' com a confiança do OCR e da coluna
+  '<campo>_bruto' (tipo 'bruto', gravada como texto) com o texto lido quando ele não pôde ser convertido para número;
+- colunas_numericas (ex.: o alinhamento da imagem) são números sem coluna de confiança, no fim do esquema.
+'''
+def montar_esquema(tabelas_info, tabelas_numericas, colunas_numericas=()):
+  esquema = [(c, 'texto') for c in COLUNAS_FIXAS]
+  vistos = set(COLUNAS_FIXAS)
+  for tabela in tabelas_info:
+    for k in tabela:
+      if k not in vistos:
+        vistos.add(k)
+        esquema.append((k, 'texto'))
+  for tabela in tabelas_numericas:
+    for k in tabela:
+      if k not in vistos:
+        vistos.add(k)
+        esquema.append((k, 'numero'))
+        esquema.append((k + '_conf', 'numero'))
+        esquema.append((k + SUFIXO_BRUTO, 'bruto'))
+  esquema.extend((c, 'numero') for c in colunas_numericas if c not in vistos)
+  return esquema
+
+
+'''
+Converte o valor lido pelo OCR para o tipo da coluna. Valores numéricos inválidos ou vazios viram None (nulo).
+'''
+def converter_valor(valor, tipo):
+  if valor is None:
+    return None
+  if tipo == 'texto':
+    return str(valor)
+  try:
+    numero = float(valor)
+  except (TypeError, ValueError):
+    return None
+  return None if math.isnan(numero) else numero
+
+
+'''
+Valor da coluna `coluna` (do tipo `tipo`) no row_data `dados`. Nas colunas 'bruto', é o texto lido no campo numérico
+correspondente quando ele não é vazio nem número (ou o valor da própria coluna, nos row_data relidos por ler_saida).
+'''
+def valor_coluna(dados, coluna, tipo):
+  if tipo != 'bruto':
+    return converter_valor(dados.get(coluna), tipo)
+  if coluna in dados:
+    return converter_valor(dados[coluna], 'texto')
+  valor = dados.get(coluna[:-len(SUFIXO_BRUTO)])
+  if valor is None or isinstance(valor, float) or str(valor).strip() == '':
+    return None
+  return str(valor) if converter_valor(valor, 'numero') is None else None
+
+
+'''
+Converte um resultado [pasta, row_data] (formato de extrair_infomacoes_arquivo) em uma linha do esquema.
+Se `falhas` ({campo: quantidade}) for informado, conta nele os campos numéricos cujo texto não virou número.
+'''
+def linha_esquema(esquema, caminho, resultado, falhas=None):
+  dados = dict(resultado[1])
+  dados['pasta'] = resultado[0]
+  dados['arquivo'] = caminho
+  linha = [valor_coluna(dados, coluna, tipo) for coluna, tipo in esquema]
+  if falhas is not None:
+    for (coluna, tipo), valor in zip(esquema, linha):
+      if tipo == 'bruto' and valor is not None:
+        campo = coluna[:-len(SUFIXO_BRUTO)]
+        falhas[campo] = falhas.get(campo, 0) + 1
+  return linha
+
+
+'''
+Texto com a quantidade de valores numéricos que não puderam ser convertidos (contados em `falhas` por linha_esquema).
+'''
+def resumo_conversoes(falhas):
+  if not falhas:
+    return 'Todos os valores numéricos lidos foram convertidos'
+  piores = sorted(falhas.items(), key=lambda item: -item[1])[:5]
+  return ('%d valores numéricos não convertidos (texto mantido nas colunas %s), mais frequentes: %s'
+          % (sum(falhas.values()), "'<campo>" + SUFIXO_BRUTO + "'", ', '.join('%s (%d)' % item for item in piores)))
+
+
+'''
+Colunas de um esquema separadas por tipo, compartilhadas pelos registros compactos (RegistroExame) do mesmo esquema.
+'''
+class ColunasRegistro:
+  def __init__(self, esquema):
+    self.textos = [(c, tipo) for c, tipo in esquema if tipo != 'numero' and c not in COLUNAS_FIXAS]
+    self.numeros = [c for c, tipo in esquema if tipo == 'numero']
+
+
+'''
+Registro compacto de um exame, usado no modo com memória limitada no lugar do row_data (dicionário de strings):
+os campos de texto ficam em uma tupla e os numéricos em um array float64 (NaN para nulo), nas colunas de `colunas`.
+Campos fora do esquema são descartados, como na gravação em CSV/Parquet.
+'''
+class RegistroExame:
+  __slots__ = ('colunas', 'pasta', 'arquivo', 'textos', 'numeros')
+
+  def __init__(self, colunas, caminho, resultado):
+    dados = resultado[1]
+    self.colunas = colunas
+    self.pasta = resultado[0]
+    self.arquivo = caminho
+    self.textos = tuple(valor_coluna(dados, c, tipo) for c, tipo in colunas.textos)
+    self.numeros = np.array([converter_valor(dados.get(c), 'numero') for c in colunas.numeros], dtype=np.float64)
+
+  '''
+  row_data equivalente (só as colunas não nulas), para create_dataframe e para as cópias da deduplicação.
+  '''
+  def dados(self):
+    dados = {c: v for (c, _), v in zip(self.colunas.textos, self.textos) if v is not None}
+    dados.update((c, float(v)) for c, v in zip(self.colunas.numeros, self.numeros) if not math.isnan(v))
+    return dados
+
+  def resultado(self):
+    return [self.pasta, self.dados()]
+
+
+'''
+Escritor CSV (separador ';'): cada exame é gravado assim que termina. Valores nulos ficam vazios.
+`falhas` conta, por campo, os valores numéricos que não viraram número (ver resumo_conversoes).
+'''
+class EscritorCSV:
+  def __init__(self, caminho, esquema):
+    self.esquema = esquema
+    self.falhas = {}
+    self.arquivo = open(caminho, 'w', newline='', encoding='utf-8')
+    self.writer = csv.writer(self.arquivo, delimiter=';')
+    self.writer.writerow([coluna for coluna, _ in esquema])
+
+  def escrever(self, caminho, resultado):
+    self.writer.writerow(['' if v is None else v for v in linha_esquema(self.esquema, caminho, resultado, self.falhas)])
+
+  def fechar(self):
+    self.arquivo.close()
+
+
+'''
+Escritor Parquet (requer pyarrow): as linhas são acumuladas em colunas e gravadas em row groups de `tamanho_lote` exames.
+As colunas 'bruto' são gravadas como texto; `falhas` como no EscritorCSV.
+'''
+class EscritorParquet:
+  def __init__(self, caminho, esquema, tamanho_lote=1000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    self.pa = pa
+    self.esquema = esquema
+    self.falhas = {}
+    self.schema = pa.schema([(coluna, pa.float64() if tipo == 'numero' else pa.string()) for coluna, tipo in esquema])
+    self.writer = pq.ParquetWriter(caminho, self.schema)
+    self.tamanho_lote = tamanho_lote
+    self.colunas = [[] for _ in esquema]
+
+  def escrever(self, caminho, resultado):
+    for coluna, valor in zip(self.colunas, linha_esquema(self.esquema, caminho, resultado, self.falhas)):
+      coluna.append(valor)
+    if len(self.colunas[0]) >= self.tamanho_lote:
+      self._gravar_lote()
+
+  def _gravar_lote(self):
+    if self.colunas[0]:
+      self.writer.write_table(self.pa.Table.from_arrays(self.colunas, schema=self.schema))
+      self.colunas = [[] for _ in self.esquema]
+
+  def fechar(self):
+    self._gravar_lote()
+    self.writer.close()
+
+
+def abrir_escritor(formato, caminho, esquema):
+  if formato == 'csv':
+    return EscritorCSV(caminho, esquema)
+  if formato == 'parquet':
+    return EscritorParquet(caminho, esquema)
+  raise ValueError('formato de saída desconhecido: %s' % formato)
+
+
+'''
+Lê de volta uma saída CSV ou Parquet no formato [pasta, row_data] usado por create_dataframe,
+para gerar as planilhas Excel como etapa de pós-processamento. Colunas nulas de cada exame são omitidas do row_data.
+Com `esquema`, o arquivo é lido em partes de `tamanho_parte` linhas e cada exame vira um RegistroExame
+([pasta, RegistroExame]), para que o arquivo inteiro não fique na memória como dicionários.
+'''
+def ler_saida(formato, caminho, esquema=None, tamanho_parte=5000):
+  import pandas as pd
+  if formato == 'parquet':
+    import pyarrow.parquet as pq
+    partes = (lote.to_pandas() for lote in pq.ParquetFile(caminho).iter_batches(batch_size=tamanho_parte))
+  else:
+    partes = pd.read_csv(caminho, sep=';', dtype=str, keep_default_na=False, na_values=[''], chunksize=tamanho_parte)
+  colunas_registro = ColunasRegistro(esquema) if esquema is not None else None
+  dados = []
+  for df in partes:
+    colunas = [c for c in df.columns if c not in COLUNAS_FIXAS]
+    for pasta, arquivo, valores in zip(df['pasta'], df['arquivo'], df[colunas].itertuples(index=False, name=None)):
+      row_data = {c: v for c, v in zip(colunas, valores) if not pd.isna(v)}
+      if colunas_registro is not None:
+        dados.append([pasta, RegistroExame(colunas_registro, arquivo, [pasta, row_data])])
+      else:
+        dados.append([pasta, row_data])
+  return dados
@@ -1,61 +1,137 @@
 # Este script tem o objetivo de ler imagens de exames oftalmológicos e extrair os resultados para análise
+# O easyocr (e o torch) e o pandas são importados apenas quando usados, para que o import deste módulo seja rápido.
 
-import easyocr as ocr
-import pandas as pd
 import numpy as np
 import time
 import os
 from PIL import Image, ImageChops, ImageFilter
-#from joblib import Parallel, delayed
+import multiprocessing
+import multiprocessing.util
 import re
 import csv
+import zlib
+from binarizacao import binarize
+from ocr_lote import reconhecer_lote
+from checkpoint import hash_pixels, carregar_checkpoint, gravar_checkpoint
+from entradas import EXTENSOES_PACOTES, abrir_imagem, caminho_logico, eh_pacote, expandir, hash_entrada, nome_arquivo
+import cache_ocr
+import ocr_adaptativo
+import metricas
+import arquivo_recortes
+import memoria
+import pipeline
+import backends_ocr
+import ocr_digitos
+from saida import montar_esquema, abrir_escritor, ler_saida, resumo_conversoes, ColunasRegistro, RegistroExame
+from layout import LAYOUT_FILE, LAYOUT_DESCONHECIDO, carregar_modelos, detectar_layout
+from registro_layouts import REGISTRO_FILE, TabelaRecortes, carregar_registro
+from alinhamento import ANCORAS_FILE, carregar_ancoras, estimar_alinhamento
 
 
 OCR_CUTOFF = 0.6          # Limite mínimo de confiança para considerar um resultado do OCR
 IMG_MAG = 4               # Fator de ampliação da imagem antes do OCR (aumenta a legibilidade)
 BIN_THRESHOLD = 200       # Valor de limiar para binarização da imagem (0-255)
 IMG_BLUR = 1              # Intensidade do desfoque aplicado antes da binarização
-VERBOSE = False           # Ativa/desativa saída detalhada no console
+VERBOSE = False           # Ativa/desativa saída detalhada no console (imprime as métricas de cada imagem)
 save_step = 500           # Número de imagens processadas antes de salvar os resultados parciais
 OUTPUT_DIR = "output"     # Diretório onde os arquivos de saída serão salvos
+CHECKPOINT_FILE = 'checkpoint.jsonl' # Arquivo (em OUTPUT_DIR) com os resultados parciais, usado para retomar execuções
+DEDUP_IMAGENS = 'desligado' # Imagens repetidas passam pelo OCR uma única vez: 'desligado', 'conteudo' (bytes do arquivo) ou 'pixels_exatos' (SHA-1 exato dos pixels decodificados, não é um hash perceptual: recompressões ou redimensionamentos da mesma imagem não são agrupados); lista e lê todos os arquivos antes do OCR começar
 IMAGES_DIR = "imagens"    # Diretório de entrada contendo as imagens a serem processadas
 RECORTES_DIR = 'recortes' # Diretório onde serão salvas imagens recortadas (regiões de interesse)
+N_PROCESSOS = 1           # Número de processos de OCR em paralelo (cada um com o seu leitor EasyOCR)
+USE_GPU = True            # Usa a GPU no EasyOCR (desative em máquinas somente com CPU)
+OCR_BACKEND = 'easyocr'   # Leitor: 'easyocr' (PyTorch, referência), 'onnx' (reconhecedor int8 no ONNX Runtime, só CPU) ou 'onnx_fp32' (sem quantização); ver backends_ocr.py
+OCR_DIGITOS = True        # Lê os campos numéricos por comparação de glifos quando existe o banco BANCO_DIGITOS_FILE (ver ocr_digitos.py)
+DIGITOS_CORTE = 0.85      # Similaridade mínima da leitura por glifos; abaixo dela o campo é lido pelo EasyOCR
+OCR_THREADS = 0           # Threads de CPU de cada leitor (0: sem GPU, os núcleos são divididos entre os processos)
+OCR_CACHE = True          # Guarda os resultados do OCR em cache, pelo conteúdo do recorte (ver cache_ocr.py)
+OCR_CACHE_FILE = 'ocr_cache.sqlite' # Arquivo (em OUTPUT_DIR) do cache de OCR
+OCR_CACHE_MAX = 500000    # Quantidade máxima de resultados no cache (os menos usados recentemente são descartados)
+EXTENSOES_IMAGENS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp') # Extensões consideradas por listar_arquivos
+LER_PACOTES = True        # Lê cada página de TIFFs/PDFs e cada membro de .zip/.tar direto do arquivo, sem extrair para o disco (ver entradas.py)
+RECORTES_MODO = 'completo' # Recortes salvos em RECORTES_DIR: 'desligado', 'amostrado' (baixa confiança) ou 'completo'
+RECORTES_FORMATO = 'dataset' # 'dataset': um conjunto empacotado por execução, com índice (ver dataset_recortes.py); '' salva cada recorte como .jpg; 'tar' ou 'zip' agrupa os recortes de cada exame em um arquivo
+SAIDA_FORMATO = 'excel'   # Formato da saída: 'excel' (planilhas no final), 'csv' ou 'parquet' (gravados exame a exame)
+EXPORTAR_EXCEL = True     # Nos formatos 'csv'/'parquet', gera também as planilhas Excel a partir do arquivo gravado
+OCR_LOTE = False          # Reconhece todos os recortes de um exame em lote, sem o detector de texto; usa o reconhecedor fp32 (ver ocr_lote.py)
+METRICAS = True           # Grava o tempo de cada etapa por imagem em OUTPUT_DIR/metricas_<data-hora>.jsonl e exibe o resumo no final (ver metricas.py)
+MEMORIA_LIMITADA = False  # Modo com memória limitada: saída sempre gravada exame a exame, registros compactos e pausa na entrada acima de MEMORIA_MAX_MB
+MEMORIA_MAX_MB = 6144     # Teto de RSS (MB) do modo com memória limitada, somando os processos do pool (ver memoria.py)
+TAMANHO_FILA_RECORTES_LIMITADA = 4 # Exames com recortes aguardando gravação no modo com memória limitada (ver arquivo_recortes.py)
+PIPELINE = True           # Com 1 processo, sobrepõe leitura/decodificação, pré-processamento e OCR de imagens diferentes em threads (ver pipeline.py)
+PIPELINE_THREADS = {'leitura': 2, 'preprocessamento': 1} # Threads de cada etapa do pipeline (o OCR tem sempre uma, com o leitor do processo)
+PIPELINE_MAX_IMAGENS = 8  # Imagens em andamento no pipeline ao mesmo tempo (limita a memória usada pelas imagens decodificadas)
+ALINHAMENTO = True        # Alinha cada imagem à referência do seu layout antes dos recortes, quando existe ANCORAS_FILE (ver alinhamento.py)
+ALINHAMENTO_ESCALA = False # Estima também uma pequena diferença de escala, além do deslocamento
+ALINHAMENTO_QUALIDADE_MINIMA = 0.5 # Abaixo dessa qualidade de alinhamento o exame não passa pelo OCR (as leituras seriam lixo)
+OCR_ADAPTATIVO = False    # Lê cada campo primeiro com o nível mais barato de OCR_NIVEIS e só relê os campos fracos (ver ocr_adaptativo.py)
+OCR_NIVEIS = [            # Níveis da releitura adaptativa; cada um altera 'mag' (IMG_MAG), 'bin' (BIN_THRESHOLD) e 'blur' (IMG_BLUR)
+    {'mag': 2},           # Leitura barata: recortes com metade do tamanho passam muito mais rápido pelo reconhecedor
+    {},                   # Configuração padrão
+    {'mag': 6, 'blur': 0},
+]
 
 dictionary_list_p1 = []   # Lista de dicionários da primeira etapa de extração
 dictionary_list_p2 = []   # Lista de dicionários da segunda etapa de extração (se houver)
 row_data = {}             # Dicionário temporário para armazenar dados de uma imagem específica
-ground_truth = {}         # Dicionário para armazenar os valores esperados de cada variável
+modelos_layout = None     # Referências dos layouts (layout.py), carregadas de LAYOUT_FILE se o arquivo existir
+ancoras_layout = None     # Âncoras de alinhamento dos layouts (alinhamento.py), carregadas de ANCORAS_FILE se o arquivo existir
+COLUNAS_METADADOS = ['fName', 'fID', 'fEye', 'fExameDate', 'fExameTime', 'fSex', 'fDOB'] # Campos extraídos do nome do arquivo (metadados_arquivo)
+COLUNAS_ALINHAMENTO = ['alinhamento_dx', 'alinhamento_dy', 'alinhamento_escala', 'alinhamento_qualidade'] # Alinhamento da imagem (alinhar_layout)
+registro = None           # Tabelas de recortes de cada padrão (registro_layouts.py), carregadas de REGISTRO_FILE (ver tabela_layout)
+ground_truth = {}         # Dicionário para armazenar os valores esperados de cada variável (ver carregar_ground_truth)
+reader = None             # Leitor EasyOCR do processo atual (ver obter_reader)
+banco_digitos = None      # Banco de glifos do reconhecedor de campos numéricos (ver obter_banco_digitos); False se não existir
+lote_compartilhado = None # No serviço (servico_ocr.py), reúne os recortes de exames simultâneos nos lotes de getting_data_lote
 
 
 '''
 Leitura da "ground truth" (valores esperados) a partir de um arquivo CSV.
 Esses dados servirão como base de comparação ou validação para os resultados do OCR.
+O arquivo só é lido na primeira chamada (quando a validação é solicitada); as chamadas seguintes reaproveitam o dicionário.
 '''
-with open('ground_truth.csv', newline='', encoding='utf-8') as csvfile:
-    reader = csv.DictReader(csvfile, delimiter=';')
-    for row in reader:
-        chave = row['variavel'].strip()
-        valor = row['valor'].strip()
-        ground_truth[chave] = valor
+def carregar_ground_truth(caminho=None):
+    if not ground_truth:
+        caminho = caminho or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ground_truth.csv')
+        with open(caminho, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile, delimiter=';'):
+                chave = row['variavel'].strip()
+                valor = row['valor'].strip()
+                ground_truth[chave] = valor
+    return ground_truth
 
 
 '''
-Função de binarização de imagem.
-Converte a imagem para tons de cinza e aplica um limiar para transformá-la em uma imagem binária (preto e branco).
-Essa etapa é importante para melhorar a performance do OCR ao eliminar ruído e focar no contraste entre texto e fundo.
+Leitor EasyOCR compartilhado: é criado na primeira chamada e reaproveitado em todas as seguintes do mesmo processo.
+Com gpu=False (ou USE_GPU = False) o EasyOCR vai direto para a CPU, sem verificar se há GPU disponível.
+O leitor é o do backend OCR_BACKEND (backends_ocr.py), com `threads` threads de CPU (padrão OCR_THREADS);
+com OCR_LOTE, o reconhecedor é o fp32, sem a quantização int8 (o backend 'onnx' não é aceito).
+O import do easyocr (e do torch) acontece somente aqui.
 '''
-def binarize(img, thresh=200):  
-  img=img.convert('L') # Converte a imagem para escala de cinza
-  width,height=img.size
+def obter_reader(gpu=None, threads=None):
+    global reader
+    if reader is None:
+        reader = backends_ocr.criar_reader(OCR_BACKEND, ['pt'], USE_GPU if gpu is None else gpu,
+                                           OCR_THREADS if threads is None else threads,
+                                           os.path.dirname(os.path.abspath(__file__)), fp32=OCR_LOTE)
+    return reader
 
-  for x in range(width):  #Varre os pixels da imagem
-    for y in range(height):
 
-      if img.getpixel((x,y)) < thresh:
-        img.putpixel((x,y),0) # Se intensidade menor que o limiar, atribui preto
-      else:
-        img.putpixel((x,y),255) #Se intensidade maior ou igual ao limiar, atribui branco
-  return img
+'''
+Abre o cache de OCR de OUTPUT_DIR. Os resultados de cada backend ficam separados no cache.
+'''
+def abrir_cache_ocr(raiz, contadores=None):
+    cache_ocr.abrir_cache(os.path.join(raiz, OUTPUT_DIR, OCR_CACHE_FILE), OCR_CACHE_MAX, contadores,
+                          '' if OCR_BACKEND == 'easyocr' else OCR_BACKEND)
+
+
+'''
+Libera o leitor compartilhado (e a memória do modelo); a próxima chamada a obter_reader cria um novo.
+'''
+def liberar_reader():
+    global reader
+    reader = None
 
 
 '''
@@ -83,294 +159,184 @@ def resize_img(img, magnification, binarize_thresh=-1):
 
 
 '''
-Função que retorna os recortes (crops) de regiões específicas da imagem com base em um padrão de layout.
+Registro dos layouts (registro_layouts.py): as coordenadas dos recortes de cada padrão ficam em REGISTRO_FILE e são
+compiladas uma única vez, na primeira consulta. obter_registro retorna o dicionário padrão -> TabelaRecortes;
+tabela_layout retorna a tabela de um padrão, ou None se o padrão não estiver no registro; recebendo uma TabelaRecortes
+(a tabela já alinhada a uma imagem, ver alinhar_layout), retorna a própria tabela.
+'''
+def obter_registro():
+    global registro
+    if registro is None:
+        registro = carregar_registro(os.path.join(os.path.dirname(os.path.abspath(__file__)), REGISTRO_FILE))
+    return registro
+
+def tabela_layout(padrao):
+    if isinstance(padrao, TabelaRecortes):
+        return padrao
+    return obter_registro().get(padrao)
+
+
+'''
+Banco de glifos (ocr_digitos.py), carregado de BANCO_DIGITOS_FILE na primeira consulta. Retorna None sem o arquivo.
+'''
+def obter_banco_digitos():
+    global banco_digitos
+    if banco_digitos is None:
+        caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), ocr_digitos.BANCO_DIGITOS_FILE)
+        banco_digitos = ocr_digitos.carregar_banco(caminho) if os.path.exists(caminho) else False
+    return banco_digitos or None
+
+
+'''
+Leitura de um campo numérico pelo reconhecedor de glifos (OCR_DIGITOS). Retorna o resultado no formato do readtext,
+ou None quando o campo não é numérico, não há banco ou a similaridade fica abaixo de DIGITOS_CORTE (o campo vai para o EasyOCR).
+'''
+def ler_digitos(img_array, grupo, allowlist):
+    if not OCR_DIGITOS or grupo == 'info' or not ocr_digitos.campo_numerico(allowlist) or obter_banco_digitos() is None:
+        return None
+    with metricas.cronometro('digitos_' + grupo):
+        ocr_result = ocr_digitos.reconhecer(banco_digitos, img_array, grupo, allowlist)
+    if ocr_result and ocr_result[0][2] >= DIGITOS_CORTE:
+        metricas.contar('digitos_aceitos_' + grupo)
+        return ocr_result
+    metricas.contar('digitos_recusados_' + grupo)
+    return None
+
+
+'''
+Funções que retornam os recortes (crops) de regiões específicas da imagem com base em um padrão de layout.
 Cada entrada no dicionário define uma região de interesse com as seguintes informações: [x, y, largura, altura, caracteres válidos esperados]
-Usado para extrair campos como nome do paciente, data do exame, olho examinado, etc.
+- info_crops: campos como nome do paciente, data do exame, olho examinado, etc.;
+- exam_crops: dados dos exames (curvaturas, espessuras, potências e métricas epiteliais);
+- get_map_crops: valores dos mapas de paquimetria e epitélio. As chaves indicam o tipo de mapa (POD, POS, EOD, EOS),
+  a região (ex: 'S1', 'IN2') e o olho (OD = olho direito, OS = esquerdo).
+Os dicionários vêm já montados do registro (tabela_layout) e são compartilhados entre as imagens: não devem ser alterados.
 '''
 def info_crops(padrao):
-  try:
-    if padrao == 1:
-      return {
-          'Patient': [46, 5, 140, 16, ''],
-          'DOB_age': [60, 18, 140, 16, '01234567890 ()/'],
-          'Algorithm_Ver': [707, 18, 140, 16, ''],
-          'Exam_date_OD': [121, 563, 84, 16, '/01234567890/'],
-          'Exam_date_OS': [752, 563, 84, 16, '/01234567890/'],
-          'Gender': [361, 31, 60, 16, 'MF'],
-          'Eye': [16, 60, 32, 70, 'OSD'],
-          'Eye_2': [890, 64, 32, 70, 'OSD'],
-          'MRR': [161, 421, 46, 29, ''],
-      }
-    else:
-      return {
-          'Patient': [45, 4, 140, 16, ''],
-          'DOB_age': [58, 19, 140, 16, '01234567890 ()/'],
-          'Algorithm_Ver': [390, 19, 140, 16, ''],
-          'Exam_date': [694, 18, 140, 16, '01234567890 /'],
-          'Gender': [362, 32, 60, 16, 'MF'],
-          'Eye': [6, 65, 32, 70, 'OSD'],
-          'MRR': [173, 304, 46, 29, ''],
-      }
-  except Exception as e:
-    pass
+  tabela = tabela_layout(padrao)
+  return tabela.pontos['info'] if tabela else None
+
+def exam_crops(padrao):
+  tabela = tabela_layout(padrao)
+  return tabela.pontos['exame'] if tabela else None
+
+def get_map_crops(padrao):
+  tabela = tabela_layout(padrao)
+  return tabela.pontos['mapa'] if tabela else None
 
 
 '''
-Função que define os recortes das regiões contendo dados dos exames oftalmológicos.
-A estrutura varia conforme o layout identificado pelo parâmetro `padrao`.
-Cada campo é representado por: [x, y, largura, altura, caracteres esperados]
-Esses recortes são usados para extrair informações como curvaturas, espessuras, potências e métricas epiteliais via OCR.
+Funções de pré-processamento de um recorte, uma para cada grupo de campos:
+- info: tons de cinza, ampliação e desfoque;
+- exame: tons de cinza, ampliação com binarização e desfoque;
+- mapa: apenas ampliação (mantém as cores).
+`nivel` é um item de OCR_NIVEIS: as chaves 'mag', 'bin' e 'blur' substituem IMG_MAG, BIN_THRESHOLD e IMG_BLUR.
 '''
-def exam_crops(padrao):
-  try:
-    if padrao == 1:
-      return {
-          'SSI_OD': [250, 563, 60, 16, '.0123456789'],
-          'SSI_OS': [880, 563, 60, 16, '.0123456789'],
-          'Net_Power_OD': [53, 488, 41, 18, '.0123456789'],
-          'Anterior_Power_OD': [107, 489, 41, 18, '.0123456789'],
-          'Posterior_Power_OD': [158, 491, 41, 18, '-0123456789.'],
-          'Anterior_R_OD': [61, 533, 33, 18, '.0123456789'],
-          'Posterior_R_OD': [159, 532, 33, 18, '.0123456789'],
-          'Pachy_SNIT_Pachmetry_OD': [286, 461, 38, 18, '-0123456789.'],
-          'Pachy_SNIT_Pachmetry_OS': [326, 462, 38, 18, '-0123456789.'],
-          'Pachy_SI_Pachmetry_OD': [426, 461, 38, 18, '-0123456789.'],
-          'Pachy_SI_Pachmetry_OS': [466, 461, 38, 18, '-0123456789.'],
-          'Pachy_Min_Pachmetry_OD': [286, 489, 38, 18, '.0123456789'],
-          'Pachy_Min_Pachmetry_OS': [326, 488, 38, 18, '.0123456789'],
-          'Pachy_Y_Pachmetry_OD': [426, 488, 38, 18, '-0123456789.'],
-          'Pachy_Y_Pachmetry_OS': [466, 488, 38, 18, '-0123456789.'],
-          'Pachy_MinMedian_Pachmetry_OD': [286, 515, 38, 18, '-0123456789.'],
-          'Pachy_MinMedian_Pachmetry_OS': [326, 515, 38, 18, '-0123456789.'],
-          'Pachy_MinMax_Pachmetry_OD': [427, 515, 38, 18, '-0123456789.'],
-          'Pachy_MinMax_Pachmetry_OS': [466, 515, 38, 18, '-0123456789.'],
-          'Net_Power_OS': [802, 490, 41, 18, '.0123456789'],
-          'Anterior_Power_OS': [856, 488, 41, 18, '.0123456789'],
-          'Posterior_Power_OS': [908, 491, 41, 18, '-0123456789.'],
-          'Anterior_R_OS': [804, 533, 33, 18, '.0123456789'],
-          'Posterior_R_OS': [902, 534, 33, 18, '.0123456789'],
-          'Epi_Superior_Epithelium_OD': [563, 461, 38, 18, '.0123456789'],
-          'Epi_Superior_Epithelium_OS': [596, 460, 38, 18, '.0123456789'],
-          'Epi_Inferior_Epithelium_OD': [677, 461, 38, 18, '.0123456789'],
-          'Epi_Inferior_Epithelium_OS': [710, 461, 38, 18, '.0123456789'],
-          'Epi_Min_Epithelium_OD': [563, 487, 38, 18, '.0123456789'],
-          'Epi_Min_Epithelium_OS': [596, 487, 38, 18, '.0123456789'],
-          'Epi_Max_Epithelium_OD': [678, 487, 38, 18, '.0123456789'],
-          'Epi_Max_Epithelium_OS': [710, 487, 38, 18, '.0123456789'],
-          'Epi_StdDev_Epithelium_OD': [564, 513, 38, 18, '.0123456789'],
-          'Epi_StdDev_Epithelium_OS': [596, 513, 38, 18, '.0123456789'],  
-          'Epi_MinMax_Epithelium_OD': [677, 515, 30, 18, '-0123456789.'],
-          'Epi_MinMax_Epithelium_OS': [711, 516, 30, 18, '-0123456789.'],
-   
-      }
-    else:
-      return {
-          'SSI': [491, 52, 60, 16, '.0123456789'],
-          'Net_Power': [76, 386, 41, 18, '.0123456789'],
-          'Anterior_Power': [134, 385, 41, 18, '.0123456789.'],
-          'Posterior_Power': [191, 387, 41, 18, '-0123456789.'],
-          'Anterior_R': [83, 474, 33, 18, '.0123456789'],
-          'Posterior_R': [196, 472, 33, 18, '.0123456789'],
-          'Pachy_SNIT': [100, 570, 38, 18, '-0123456789.'],
-          'Pachy_SI': [212, 570, 38, 18, '-0123456789.'],
-          'Pachy_Min': [100, 598, 38, 18, '.0123456789'],
-          'Pachy_Y': [210, 598, 38, 18, '-0123456789.'],
-          'Pachy_MinMedian': [99, 624, 38, 18, '-0123456789.'],
-          'Pachy_MinMax': [210, 626, 38, 18, '-0123456789.'],
-          'Epi_Superior': [98, 730, 38, 18, '.0123456789'],
-          'Epi_Inferior': [210, 730, 38, 18, '.0123456789'],
-          'Epi_Min': [99, 758, 38, 18, '.0123456789'],
-          'Epi_Max': [212, 757, 38, 18, '.0123456789'],
-          'Epi_StdDev': [99, 785, 38, 18, '.0123456789'],
-          'Epi_MinMax': [210, 784, 30, 18, '-0123456789.'],
-      }
-  except Exception as e:
-    pass
-
-
-'''
-Definição das regiões (coordenadas) onde o OCR deve extrair valores específicos de mapas de espessura da córnea
-e da epitélio, tanto para o olho direito (OD) quanto para o olho esquerdo (OS), em dois padrões de layout diferentes.
-'''
-
-# Variáveis de dimensão padrão dos recortes utilizados
-L = 45 # Largura
-A = 15 # Altura
-
-pachymetry_od_crops = { 
-  'CO': [270,230],  # Centro óptico
-  'S1': [268,146],  # Região superior
-  'S2': [268,98],
-  'SN1': [328,172], # Superior-nasal
-  'SN2': [362,134],
-  'N1': [354,230],  # Nasal
-  'N2': [403,231],
-  'IN1': [328,289], # Inferior-nasal
-  'IN2': [364,325],
-  'I1': [270,314],  # Inferior
-  'I2': [269,362],
-  'IT1': [211,290], # Inferior-temporal
-  'IT2': [173,324],
-  'T1': [184,230],  # Temporal
-  'T2': [141,230],
-  'ST1': [210,171], # Superior-temporal   
-  'ST2': [176,138]
-}
+def recorte_info(img, v, nivel=None):
+    nivel = nivel or {}
+    img_cropped = img.crop((v[0], v[1], v[0]+v[2], v[1]+v[3]))
+    img_cropped = resize_img(img_cropped.convert('L'), nivel.get('mag', IMG_MAG))
+    return img_cropped.filter(ImageFilter.BoxBlur(nivel.get('blur', IMG_BLUR)))
 
-pachymetry_os_crops = { 
-  'CO': [650,231],
-  'S1': [650,147],
-  'S2': [651,98],
-  'ST1': [711,171],
-  'ST2': [744,136],
-  'T1': [732,230],
-  'T2': [787,232],
-  'IT1': [710,291],
-  'IT2': [745,325],
-  'I1': [656,319],
-  'I2': [652,363],
-  'IN1': [591,289],
-  'IN2': [558,323],
-  'N1': [567,230],
-  'N2': [520,232],
-  'SN1': [592,170],
-  'SN2': [559,138]
-}
+def recorte_exame(img, v, nivel=None):
+    nivel = nivel or {}
+    img_cropped = img.crop((v[0], v[1], v[0]+v[2], v[1]+v[3]))
+    img_cropped = resize_img(img_cropped.convert('L'), nivel.get('mag', IMG_MAG), nivel.get('bin', BIN_THRESHOLD))
+    return img_cropped.filter(ImageFilter.BoxBlur(nivel.get('blur', IMG_BLUR)))
 
-epithelium_od_crops = { 
-  'CO': [275,741],
-  'S1': [272,656],
-  'S2': [271,610],
-  'SN1': [331,681],
-  'SN2': [366,646],
-  'N1': [356,740],
-  'N2': [405,741],
-  'IN1': [332,800],
-  'IN2': [368,835],
-  'I1': [272,822],
-  'I2': [273,873],
-  'IT1': [214,800],
-  'IT2': [178,835],
-  'T1': [189,742],
-  'T2': [140,741],
-  'ST1': [214,680],  
-  'ST2': [182,648]
-}
+def recorte_mapa(img, v, nivel=None):
+    nivel = nivel or {}
+    img_cropped = img.crop((v[0], v[1], v[0]+v[2], v[1]+v[3]))
+    return resize_img(img_cropped, nivel.get('mag', IMG_MAG))
 
-epithelium_os_crops = { 
- 'CO': [656,742],
-  'S1': [654,654],
-  'S2': [655,610],
-  'ST1': [715,681],
-  'ST2': [748,648],
-  'T1': [740,740],
-  'T2': [788,741],
-  'IT1': [715,800],
-  'IT2': [748,834],
-  'I1': [655,825],
-  'I2': [654,874],
-  'IN1': [594,800],
-  'IN2': [560,834],
-  'N1': [572,742],
-  'N2': [524,744],
-  'SN1': [596,681],
-  'SN2': [564,649]
-}
 
-# Dicionários com coordenadas para o padrão 2
-pachymetry_os_cropsp2 = { 
-  'CO': [450,612], 
-  'S1': [451,538], 
-  'S2': [451,496], 
-  'ST1': [504,558],
-  'ST2': [531,532],
-  'T1': [528,612],
-  'T2': [571,612],
-  'IT1': [508,664],
-  'IT2': [538,696],
-  'I1': [456,685],
-  'I2': [454,727],
-  'IN1': [403,664],
-  'IN2': [374,694],
-  'N1': [379,612],
-  'N2': [339,611],
-  'SN1': [404,558],
-  'SN2': [375,534]
+'''
+Parâmetros do reader.readtext usados em cada grupo de campos (allowlist vem da tabela de recortes de cada campo).
+'''
+PARAMETROS_OCR = {
+    'info': {'paragraph': True, 'min_size': 2},
+    'exame': {'min_size': 2},
+    'mapa': {'min_size': 5},
 }
 
-epithelium_os_cropsp2 = { 
-  'CO': [738,610],
-  'S1': [736,537],
-  'S2': [734,499],
-  'ST1': [788,560],
-  'ST2': [821,530],
-  'T1': [812,613],
-  'T2': [854,612],
-  'IT1': [790,664],
-  'IT2': [822,695],
-  'I1': [738,686],
-  'I2': [740,728],
-  'IN1': [684,661],
-  'IN2': [658,693],
-  'N1': [663,612],
-  'N2': [625,611],
-  'SN1': [687,558],
-  'SN2': [660,532]
-}
 
-# Lista representando as regiões periféricas usadas em análises específicas ou ordenação dos pontos
-lista = ['S', 'ST', 'T', 'IT', 'I', 'IN', 'N', 'SN']
+'''
+Executa o OCR de um recorte já pré-processado, passando pelo cache em disco quando OCR_CACHE está ativo.
+'''
+def ler_texto(img_array, **parametros):
+    if OCR_CACHE:
+        return cache_ocr.readtext_com_cache(reader, img_array, **parametros)
+    return reader.readtext(img_array, **parametros)
 
 
 '''
-Função que constrói um dicionário com os recortes (coordenadas e dimensões) das regiões dos mapas de paquimetria
-e epitélio para serem processadas via OCR. O layout varia conforme o padrão do exame (1 ou 2).
-As chaves indicam o tipo de mapa (POD, POS, EOD, EOS), a região (ex: 'S1', 'IN2'), e o olho (OD = olho direito, OS = esquerdo).
-A estrutura de cada item: [x, y, largura, altura, caracteres esperados].
+Pré-processa (com `preprocessa`) e lê um campo do grupo `grupo` ('info', 'exame' ou 'mapa'). Retorna (recorte, ocr_result).
+- formato: expressão regular do valor esperado (TabelaRecortes.formatos), ou None.
+Com OCR_DIGITOS os campos numéricos são lidos primeiro pelo reconhecedor de glifos (ler_digitos).
+Com OCR_ADAPTATIVO o campo é lido nos níveis de OCR_NIVEIS até a leitura ser aceita (confiança >= OCR_CUTOFF e
+valor no formato).
 '''
-def get_map_crops(padrao):
-  try:
-    if padrao == 1:
-      map_crops = {
-        'CO_POD': [pachymetry_od_crops['CO'][0], pachymetry_od_crops['CO'][1], L, A,'0123456789'],
-        'CO_POS': [pachymetry_os_crops['CO'][0], pachymetry_od_crops['CO'][1], L, A,'0123456789'],
-        'CO_EOD': [epithelium_od_crops['CO'][0], epithelium_od_crops['CO'][1], L, A,'0123456789'],
-        'CO_EOS': [epithelium_os_crops['CO'][0], epithelium_os_crops['CO'][1], L, A,'0123456789']
-      }
-      for l in lista:
-        for i in range(1, 3):
-          map_crops['POD_%s%s' % (l,i)] = [pachymetry_od_crops['%s%s' % (l,i)][0], pachymetry_od_crops['%s%s' % (l,i)][1], L, A,'0123456789']
-
-      for l in lista:
-        for i in range(1, 3):
-          map_crops['POS_%s%s' % (l,i)] = [pachymetry_os_crops['%s%s' % (l,i)][0], pachymetry_os_crops['%s%s' % (l,i)][1], L, A,'0123456789']
-
-      for l in lista:
-        for i in range(1, 3):
-          map_crops['EOD_%s%s' % (l,i)] = [epithelium_od_crops['%s%s' % (l,i)][0], epithelium_od_crops['%s%s' % (l,i)][1], L, A,'0123456789']
-
-      for l in lista:
-        for i in range(1, 3):
-          map_crops['EOS_%s%s' % (l,i)] = [epithelium_os_crops['%s%s' % (l,i)][0], epithelium_os_crops['%s%s' % (l,i)][1], L, A,'0123456789']
+def ler_campo(img, k, v, grupo, preprocessa, formato=None):
+    def ler(i, nivel):
+        with metricas.cronometro('preprocessamento_' + grupo):
+            img_cropped = preprocessa(img, v, nivel)
+        img_array = np.asarray(img_cropped)
+        ocr_result = ler_digitos(img_array, grupo, v[4])
+        if ocr_result is not None:
+            return img_cropped, ocr_result
+        with metricas.cronometro('ocr_' + grupo):
+            return img_cropped, ler_texto(img_array, allowlist=v[4], **PARAMETROS_OCR[grupo])
+
+    if OCR_ADAPTATIVO:
+        img_cropped, ocr_result, _ = ocr_adaptativo.ler_em_niveis(ler, OCR_NIVEIS, formato, grupo != 'info', OCR_CUTOFF)
     else:
-      map_crops = {
-        'CO_POS': [pachymetry_os_cropsp2['CO'][0], pachymetry_os_cropsp2['CO'][1], L, A,'0123456789'],
-        'CO_EOS': [epithelium_os_cropsp2['CO'][0], epithelium_os_cropsp2['CO'][1], L, A,'0123456789']
-      }
+        img_cropped, ocr_result = ler(0, None)
+    if not ocr_result:
+        metricas.contar('leituras_vazias_' + grupo)
+    return img_cropped, ocr_result
 
-      for l in lista:
-        for i in range(1, 3):
-          map_crops['POS_%s%s' % (l,i)] = [pachymetry_os_cropsp2['%s%s' % (l,i)][0], pachymetry_os_cropsp2['%s%s' % (l,i)][1], L, A,'0123456789']
 
-      for l in lista:
-        for i in range(1, 3):
-          map_crops['EOS_%s%s' % (l,i)] = [epithelium_os_cropsp2['%s%s' % (l,i)][0], epithelium_os_cropsp2['%s%s' % (l,i)][1], L, A,'0123456789']
-          
-    return map_crops
+'''
+Nome base usado nos arquivos de recorte e nas chaves do ground truth: "<pasta>___<início do nome do arquivo>".
+Aceita caminhos com separador do Windows ou do Linux.
+'''
+def nome_paciente_base(img):
+    partes = re.split(r'[\\/]', img.filename)
+    return partes[-2] + '___' + partes[-1].split('__')[0]
 
 
-  except Exception as e:
-    print('erro get_map_crops', e)
+'''
+Nome único de um exame: "<pasta>___<nome do arquivo sem extensão>" (o caminho lógico, para entradas de pacotes e páginas).
+Usado no nome dos arquivos .tar/.zip de recortes (RECORTES_FORMATO), que não podem ser compartilhados entre exames.
+'''
+def nome_exame(img):
+    partes = re.split(r'[\\/]', img.filename)
+    return partes[-2] + '___' + os.path.splitext(partes[-1])[0]
+
+
+'''
+Versão do valor lida pelo OCR usada no nome dos recortes (e nos valores do ground truth): sem '/', '(', ')' e ','.
+'''
+def limpar_valor(valor):
+    return valor.replace('/', '-').replace('(', '_').replace(')', '_').replace(',', '_')
+
+
+'''
+Separa o recorte para ser salvo em RECORTES_DIR com o valor extraído (no índice do conjunto empacotado ou, nos outros
+formatos de RECORTES_FORMATO, codificado no nome do arquivo), conforme RECORTES_MODO:
+- 'desligado': nenhum recorte é salvo;
+- 'amostrado': apenas recortes com confiança abaixo de OCR_CUTOFF (campos sem confiança não são salvos);
+- 'completo': todos os recortes lidos.
+A gravação é feita em segundo plano por arquivo_recortes quando o exame termina (ver extrair_infomacoes_arquivo).
+'''
+def salvar_recorte(img_cropped, paciente_base, k, valor, conf=None):
+    if RECORTES_MODO == 'desligado':
+        return
+    if RECORTES_MODO == 'amostrado' and (conf is None or conf >= OCR_CUTOFF):
+        return
+    valor_limpo = limpar_valor(valor) or '-'
+    metricas.contar('recortes_salvos')
+    arquivo_recortes.adicionar_recorte(paciente_base + '_' + k + '_valor_' + valor_limpo + '.jpg', img_cropped, k, valor, conf)
 
 
 '''
@@ -381,75 +347,116 @@ Para cada região (definida em 'pontos'), a função:
 - realiza OCR considerando uma lista de caracteres permitidos;
 - salva a imagem do recorte com o valor extraído no nome;
 - armazena o valor extraído no dicionário row_data.
+`formatos` ({campo: expressão regular}, TabelaRecortes.formatos) é usado pela releitura adaptativa (ver ler_campo).
 '''
-def getting_infos_data(row_data, img, pontos):
+def getting_infos_data(row_data, img, pontos, formatos=None):
     try:
-        paciente_base = img.filename.split('\\')[-2] + '___' + img.filename.split('\\')[-1].split('__')[0]
+        paciente_base = nome_paciente_base(img)
         for k, v in pontos.items():
-            img_cropped = img.crop((v[0], v[1], v[0]+v[2], v[1]+v[3]))
-            img_cropped = resize_img(img_cropped.convert('L'), IMG_MAG)
-            img_cropped = img_cropped.filter(ImageFilter.BoxBlur(IMG_BLUR))
-            ocr_result = reader.readtext(np.array(img_cropped), paragraph=True, min_size=2, allowlist=v[4])
+            img_cropped, ocr_result = ler_campo(img, k, v, 'info', recorte_info, formatos and formatos.get(k))
 
             if len(ocr_result) > 0:
                 valor = ocr_result[0][1]
                 row_data[k] = valor
-                valor_limpo = valor.replace('/', '-').replace('(', '_').replace(')', '_').replace(',', '_') or '-'
-                img_cropped.save(os.path.join(diretorio_raiz, RECORTES_DIR, paciente_base + '_' + k + '_valor_' + valor_limpo + '.jpg'))
+                salvar_recorte(img_cropped, paciente_base, k, valor)
             else:
                 row_data[k] = ''
         return row_data
     except Exception as e:
         print('erro getting_infos_data', e)
+        metricas.contar('falhas_info')
         return row_data
 
-def getting_exam_data(row_data, img, pontos):
+def getting_exam_data(row_data, img, pontos, formatos=None):
     try:
-        paciente_base = img.filename.split('\\')[-2] + '___' + img.filename.split('\\')[-1].split('__')[0]
+        paciente_base = nome_paciente_base(img)
         for k, v in pontos.items():
-            img_cropped = img.crop((v[0], v[1], v[0]+v[2], v[1]+v[3]))
-            img_cropped = resize_img(img_cropped.convert('L'), IMG_MAG, BIN_THRESHOLD)
-            img_cropped = img_cropped.filter(ImageFilter.BoxBlur(IMG_BLUR))
-            ocr_result = reader.readtext(np.array(img_cropped), min_size=2, allowlist=v[4])
+            img_cropped, ocr_result = ler_campo(img, k, v, 'exame', recorte_exame, formatos and formatos.get(k))
 
             if len(ocr_result) > 0:
                 valor = ocr_result[0][1]
                 conf = ocr_result[0][2]
                 row_data[k] = valor
                 row_data[k + '_conf'] = conf
-
-                valor_limpo = valor.replace('/', '-').replace('(', '_').replace(')', '_').replace(',', '_') or '-'
-                img_cropped.save(os.path.join(diretorio_raiz, RECORTES_DIR, paciente_base + '_' + k + '_valor_' + valor_limpo + '.jpg'))
+                salvar_recorte(img_cropped, paciente_base, k, valor, conf)
             else:
                 row_data[k] = ''
                 row_data[k + '_conf'] = 0
         return row_data
     except Exception as e:
         print('erro getting_exam_data', e)
+        metricas.contar('falhas_exame')
         return row_data
     
-def getting_maps_data(row_data, img, pontos):
+def getting_maps_data(row_data, img, pontos, formatos=None):
     try:
-        paciente_base = img.filename.split('\\')[-2] + '___' + img.filename.split('\\')[-1].split('__')[0]
+        paciente_base = nome_paciente_base(img)
         for k, v in pontos.items():
-            img_cropped = img.crop((v[0], v[1], v[0]+v[2], v[1]+v[3]))
-            img_cropped = resize_img(img_cropped, IMG_MAG)
-            ocr_result = reader.readtext(np.array(img_cropped), min_size=5, allowlist=v[4])
+            img_cropped, ocr_result = ler_campo(img, k, v, 'mapa', recorte_mapa, formatos and formatos.get(k))
 
             if len(ocr_result) > 0:
                 valor = ocr_result[0][1]
                 conf = ocr_result[0][2]
                 row_data[k] = valor
                 row_data[k + '_conf'] = conf
-
-                valor_limpo = valor.replace('/', '-').replace('(', '_').replace(')', '_').replace(',', '_') or '-'
-                img_cropped.save(os.path.join(diretorio_raiz, RECORTES_DIR, paciente_base + '_' + k + '_valor_' + valor_limpo + '.jpg'))          
+                salvar_recorte(img_cropped, paciente_base, k, valor, conf)
             else:
                 row_data[k] = ''
                 row_data[k + '_conf'] = 0
         return row_data
     except Exception as e:
         print('erro getting_maps_data', e)
+        metricas.contar('falhas_mapa')
+        return row_data
+
+
+'''
+Versão em lote das três funções acima (usada quando OCR_LOTE = True).
+Pré-processa todos os recortes de info_crops, exam_crops e get_map_crops da mesma forma que as funções getting_*,
+e executa o OCR de todos eles de uma vez com ocr_lote.reconhecer_lote, sem o detector de texto
+(com OCR_DIGITOS, os campos numéricos aceitos pelo reconhecedor de glifos ficam fora do lote).
+No serviço de OCR o lote é entregue ao lote_compartilhado, que o junta aos recortes de outros exames em andamento.
+O preenchimento do row_data segue as mesmas regras: campos de info sem '_conf', campos de exame e mapa com '_conf'.
+'''
+def getting_data_lote(row_data, img, padrao):
+    try:
+        paciente_base = nome_paciente_base(img)
+        grupos = [
+            ('info', info_crops(padrao), recorte_info, False),
+            ('exame', exam_crops(padrao), recorte_exame, True),
+            ('mapa', get_map_crops(padrao), recorte_mapa, True),
+        ]
+        recortes = {}
+        campos = []
+        resultados = {}
+        for grupo, pontos, preprocessa, com_conf in grupos:
+            for k, v in pontos.items():
+                img_cropped = preprocessa(img, v)
+                recortes[k] = (img_cropped, com_conf)
+                ocr_result = ler_digitos(np.asarray(img_cropped), grupo, v[4])
+                if ocr_result is not None:
+                    resultados[k] = (ocr_result[0][1], ocr_result[0][2])
+                else:
+                    campos.append((k, recortes[k][0], v[4]))
+
+        if campos:
+            with metricas.cronometro('ocr_lote'):
+                if lote_compartilhado is not None:
+                    resultados.update(lote_compartilhado.reconhecer(campos))
+                else:
+                    resultados.update(reconhecer_lote(reader, campos))
+
+        for k, (img_cropped, com_conf) in recortes.items():
+            valor, conf = resultados[k]
+            row_data[k] = valor
+            if com_conf:
+                row_data[k + '_conf'] = conf
+            if valor != '':
+                salvar_recorte(img_cropped, paciente_base, k, valor, conf if com_conf else None)
+        return row_data
+    except Exception as e:
+        print('erro getting_data_lote', e)
+        metricas.contar('falhas_lote')
         return row_data
 
 
@@ -483,6 +490,18 @@ def separa_dados_olhos(dados):
     print(e)    
 
 
+'''
+Converte a coluna para numérico quando todos os valores são números; senão a mantém como está
+(o antigo pd.to_numeric(errors='ignore'), que não existe mais no pandas 3).
+'''
+def coluna_numerica(coluna):
+  import pandas as pd
+  try:
+    return pd.to_numeric(coluna)
+  except (ValueError, TypeError):
+    return coluna
+
+
 '''
 Função que cria DataFrames pandas a partir dos dados extraídos e os salva em arquivos Excel.
 Para cada diretório base em 'dados', ela agrupa os dados correspondentes,
@@ -490,55 +509,54 @@ verifica se os dados contêm informações para ambos os olhos ou apenas um,
 e então gera uma ou duas planilhas Excel (separadas por olho) no diretório de saída.
 '''
 def create_dataframe(dados):
+  import pandas as pd
   try:
     print('Criando dataframe...')
 
-    # Lista dos diretórios base extraídos da primeira posição dos elementos em 'dados'
-    lista_diretorios = []
-    d = ''
+    # Agrupa os dados por diretório base (primeira posição dos elementos em 'dados'), em uma única passada
+    dados_por_diretorio = {}
     for dado in dados:
-      if d != dado[0]:
-        lista_diretorios.append(dado[0])
-        d = dado[0]
-      
-    # Processa dados por diretório base
-    for d in lista_diretorios:
+      dados_por_diretorio.setdefault(dado[0], []).append(dado[1])
+
+    # Processa dados por diretório base. Registros compactos (RegistroExame, modo com memória limitada) são expandidos
+    # para dicionários uma pasta por vez, e cada pasta é descartada assim que as planilhas dela são gravadas
+    for d in list(dados_por_diretorio):
+      dados_diretorio = [dado.dados() if isinstance(dado, RegistroExame) else dado for dado in dados_por_diretorio.pop(d)]
       dictionary_list = []      # Para dados de um olho só
       dictionary_list_od = []   # Dados para olho direito (OD)
       dictionary_list_os = []   # Dados para olho esquerdo (OS)
       df_final = None
 
       # Separa os dados daquele diretório em listas específicas
-      for dado in dados:
-        if dado[0] == d:
-          # Se dados para ambos os olhos estão presentes, separa-os
-          if 'Eye_2' in dado[1]:
-            dados_olhos = separa_dados_olhos(dado[1])
-            dictionary_list_os.append(dados_olhos[0])
-            dictionary_list_od.append(dados_olhos[1])
-          else:
-            dictionary_list.append(dado[1])
+      for dado in dados_diretorio:
+        # Se dados para ambos os olhos estão presentes, separa-os
+        if 'Eye_2' in dado:
+          dados_olhos = separa_dados_olhos(dado)
+          dictionary_list_os.append(dados_olhos[0])
+          dictionary_list_od.append(dados_olhos[1])
+        else:
+          dictionary_list.append(dado)
 
       # Caso haja dados para ambos os olhos, cria planilhas separadas para OS e OD
       if len(dictionary_list_os) > 0:
         # DataFrame olho esquerdo
         df_final = pd.DataFrame.from_dict(dictionary_list_os)
         timestr = time.strftime("%Y%m%d-%H%M%S")
-        df_final = df_final.apply(pd.to_numeric, errors='ignore')  # tenta converter valores para numérico
+        df_final = df_final.apply(coluna_numerica)  # tenta converter valores para numérico
         df_final.to_excel(os.path.join(diretorio_raiz, OUTPUT_DIR, d + '_OS_RTVue_' + timestr + '.xlsx'))
 
         # DataFrame olho direito
         df_final = None
         df_final = pd.DataFrame.from_dict(dictionary_list_od)
         timestr = time.strftime("%Y%m%d-%H%M%S")
-        df_final = df_final.apply(pd.to_numeric, errors='ignore')
+        df_final = df_final.apply(coluna_numerica)
         df_final.to_excel(os.path.join(diretorio_raiz, OUTPUT_DIR, d + '_OD_RTVue_' + timestr + '.xlsx'))
 
       else:
         # Caso dados sejam de um olho só, gera apenas um arquivo Excel
         df_final = pd.DataFrame.from_dict(dictionary_list)
         timestr = time.strftime("%Y%m%d-%H%M%S")
-        df_final = df_final.apply(pd.to_numeric, errors='ignore')
+        df_final = df_final.apply(coluna_numerica)
         df_final.to_excel(os.path.join(diretorio_raiz, OUTPUT_DIR, d + '_RTVue_' + timestr + '.xlsx'))
 
   except Exception as e:
@@ -549,29 +567,62 @@ def create_dataframe(dados):
 
 
 '''
-Função para listar arquivos de exames em um diretório base, percorrendo subpastas.
-Para cada arquivo encontrado nas subpastas, adiciona uma lista com:
+Esquema (colunas e tipos) da saída em CSV/Parquet, com os metadados do nome do arquivo, todos os campos de info_crops, exam_crops e get_map_crops
+dos padrões de layout do registro, as colunas '_conf' e '_bruto' dos campos numéricos e as colunas do alinhamento.
+'''
+def esquema_saida():
+  tabelas = [obter_registro()[padrao] for padrao in sorted(obter_registro())]
+  return montar_esquema([COLUNAS_METADADOS] + [t.pontos['info'] for t in tabelas],
+                        [t.pontos['exame'] for t in tabelas] + [t.pontos['mapa'] for t in tabelas],
+                        COLUNAS_ALINHAMENTO)
+
+
+'''
+Função para listar arquivos de exames em um diretório base, percorrendo as subpastas (primeiro nível).
+É um gerador: os arquivos são produzidos um a um, em ordem alfabética de pasta e de nome, sem montar a lista inteira
+e sem alterar o diretório de trabalho do processo. Para cada arquivo produz uma lista com:
 - o caminho completo do arquivo
 - o nome da subpasta onde o arquivo está localizado
+Com LER_PACOTES, TIFFs de várias páginas e PDFs produzem uma entrada por página e os .zip/.tar (nas subpastas ou no
+próprio diretório base, como uma pasta de estudo compactada) uma entrada por membro, com caminhos virtuais lidos
+direto do arquivo (ver entradas.py). A subpasta dessas entradas é a do caminho lógico: a subpasta do membro dentro do
+pacote ou, para membros na raiz do pacote, o nome do pacote sem a extensão.
+Parâmetros:
+- extensoes: apenas arquivos com essas extensões são considerados (padrão EXTENSOES_IMAGENS).
+- shard: tupla (i, N) para dividir o diretório entre N máquinas; só são produzidos os arquivos da parte i (0 <= i < N).
+  A divisão usa o CRC32 do caminho "<subpasta>/<arquivo>" (mais o membro e a página, nos caminhos virtuais),
+  portanto é a mesma em qualquer máquina.
 '''
-def listar_arquivos(diretorio_exames):
-  lista_arquivos = []
+def listar_arquivos(diretorio_exames, extensoes=EXTENSOES_IMAGENS, shard=None):
   try:
     diretorio_imagens = os.path.join(diretorio_raiz, diretorio_exames)
-    for root, dirs, files in os.walk(diretorio_imagens):
-      for d in dirs:
-        os.chdir(os.path.join(diretorio_imagens, d))
-        for f in os.listdir():
-          lista_arquivos.append([os.path.join(diretorio_imagens, d, f), d])
-
-    return lista_arquivos
+    aceitas = tuple(extensoes) + ('.pdf',) + tuple(EXTENSOES_PACOTES) if LER_PACOTES else tuple(extensoes)
+    with os.scandir(diretorio_imagens) as entradas:
+      itens = sorted((e.name, e.is_dir()) for e in entradas if e.is_dir() or (LER_PACOTES and e.is_file() and eh_pacote(e.name)))
+    for d, eh_pasta in itens:
+      if eh_pasta:
+        with os.scandir(os.path.join(diretorio_imagens, d)) as entradas:
+          nomes = [(d + '/' + n, os.path.join(diretorio_imagens, d, n))
+                   for n in sorted(e.name for e in entradas if e.is_file() and e.name.lower().endswith(aceitas))]
+      else:
+        nomes = [(d, os.path.join(diretorio_imagens, d))]
+      for relativo, caminho in nomes:
+        try:
+          caminhos = expandir(caminho, extensoes) if LER_PACOTES else [caminho]
+        except Exception as e:
+          print('Erro ao listar o arquivo "%s": ' % relativo, e)
+          continue
+        for virtual in caminhos:
+          if shard and zlib.crc32((relativo + virtual[len(caminho):]).encode('utf-8')) % shard[1] != shard[0]:
+            continue
+          yield [virtual, os.path.basename(os.path.dirname(caminho_logico(virtual)))]
   except Exception as e:
     print('Erro ao listar os arquivos: ', e)
 
 
 '''
 Função para identificar o padrão da imagem (padrão 1 ou 2) com base no resultado do OCR em uma região específica.
-Recorta uma área fixa na imagem relacionada à paquimetria do olho direito ('CO' em pachymetry_od_crops),
+Recorta uma área fixa na imagem relacionada à paquimetria do olho direito (campo 'CO_POD' do padrão 1),
 redimensiona essa área, realiza OCR buscando números,
 e decide o padrão:
 - Se o OCR extrai algum texto não vazio, retorna 1 (padrão 1).
@@ -580,7 +631,8 @@ Em caso de erro (ex: OCR falha), também retorna 2 como padrão padrão.
 '''
 def padrao_imagem(img):
   try:
-    img_cropped = img.crop((pachymetry_od_crops['CO'][0], pachymetry_od_crops['CO'][1], pachymetry_od_crops['CO'][0] + L, pachymetry_od_crops['CO'][1] + A))
+    v = get_map_crops(1)['CO_POD']
+    img_cropped = img.crop((v[0], v[1], v[0] + v[2], v[1] + v[3]))
     img_cropped = resize_img(img_cropped, IMG_MAG)
     ocr_result = reader.readtext(np.array(img_cropped), min_size=5, allowlist='0123456789')  # Executa OCR, buscando apenas dígitos numéricos
     
@@ -592,6 +644,95 @@ def padrao_imagem(img):
     return 2
 
 
+'''
+Carrega as referências de layout geradas por "python layout.py calibrar" (arquivo LAYOUT_FILE no diretório raiz)
+e as âncoras de alinhamento geradas por "python alinhamento.py calibrar" (arquivo ANCORAS_FILE).
+Sem o primeiro arquivo, a detecção do padrão continua sendo feita por OCR (padrao_imagem); sem o segundo, as imagens
+são recortadas nas coordenadas do registro, sem alinhamento.
+'''
+def carregar_layouts(raiz):
+  global modelos_layout, ancoras_layout
+  caminho = os.path.join(raiz, LAYOUT_FILE)
+  modelos_layout = carregar_modelos(caminho) if os.path.exists(caminho) else None
+  caminho = os.path.join(raiz, ANCORAS_FILE)
+  ancoras_layout = carregar_ancoras(caminho) if os.path.exists(caminho) else None
+
+
+'''
+Identifica o padrão da imagem. Retorna (padrão, confiança).
+Com as referências de layout carregadas usa a comparação de miniaturas (layout.detectar_layout), sem OCR,
+e pode retornar LAYOUT_DESCONHECIDO. Caso contrário usa padrao_imagem e a confiança é None.
+'''
+def detectar_padrao(img):
+  if modelos_layout:
+    return detectar_layout(img, modelos_layout)
+  return padrao_imagem(img), None
+
+
+'''
+Alinha a tabela de recortes do padrão à imagem (alinhamento.py). Retorna (tabela, alinhamento): a TabelaRecortes com as
+caixas deslocadas (aceita no lugar do padrão por info_crops, exam_crops, get_map_crops e getting_data_lote) e o resultado de estimar_alinhamento. Sem âncoras para o padrão (ou com ALINHAMENTO desligado),
+retorna a tabela do registro e None; com qualidade abaixo de ALINHAMENTO_QUALIDADE_MINIMA, a tabela não é deslocada.
+'''
+def alinhar_layout(img, padrao):
+  tabela = tabela_layout(padrao)
+  modelo = ancoras_layout.get(padrao) if ALINHAMENTO and ancoras_layout else None
+  if tabela is None or modelo is None:
+    return tabela, None
+  alinhamento = estimar_alinhamento(img, modelo, ALINHAMENTO_ESCALA)
+  if alinhamento['qualidade'] < ALINHAMENTO_QUALIDADE_MINIMA:
+    return tabela, alinhamento
+  if alinhamento['dx'] or alinhamento['dy'] or alinhamento['escala'] != 1.0:
+    tabela = tabela.alinhada(alinhamento['dx'], alinhamento['dy'], alinhamento['escala'])
+  return tabela, alinhamento
+
+
+'''
+Colunas COLUNAS_ALINHAMENTO da saída a partir do resultado de estimar_alinhamento.
+'''
+def colunas_alinhamento(alinhamento):
+  return {
+    'alinhamento_dx': round(alinhamento['dx'], 1),
+    'alinhamento_dy': round(alinhamento['dy'], 1),
+    'alinhamento_escala': round(alinhamento['escala'], 4),
+    'alinhamento_qualidade': round(alinhamento['qualidade'], 3),
+  }
+
+
+'''
+Metadados do exame extraídos do nome do arquivo (nome, ID, olho, data e hora do exame, sexo, data de nascimento),
+nas colunas COLUNAS_METADADOS. São sempre do próprio arquivo, mesmo quando o resultado do OCR vem de uma cópia idêntica;
+para páginas e membros de pacotes, do nome do TIFF/PDF ou do membro, sem o "::<página>" (entradas.nome_arquivo).
+Nomes fora do padrão de exportação do RTVue geram uma exceção.
+'''
+def metadados_arquivo(caminho):
+  fn_splits = nome_arquivo(caminho).split("_")
+  return {
+    'fName': fn_splits[1]+', '+fn_splits[2]+' '+fn_splits[3],
+    'fID': fn_splits[4],
+    'fEye': fn_splits[6],
+    'fExameDate': fn_splits[7],
+    'fExameTime': fn_splits[8].replace("-", ":"),
+    'fSex': fn_splits[9],
+    'fDOB': fn_splits[10],
+  }
+
+
+'''
+Resultado de uma cópia de uma imagem já processada: os campos lidos por OCR vêm do resultado `original`
+e os metadados do nome do arquivo são os da cópia. Retorna [pasta, row_data], como extrair_infomacoes_arquivo
+(se o nome da cópia estiver fora do padrão, row_data fica vazio, como aconteceria ao processar o arquivo).
+'''
+def resultado_copia(original, arquivo):
+  try:
+    row_data = metadados_arquivo(arquivo[0])
+  except Exception as e:
+    print('falha ao tentar ler o arquivo "%s..."' % arquivo[0].split('\\')[-1][:50], e)
+    return [arquivo[1], {}]
+  row_data.update((k, v) for k, v in original[1].items() if k not in COLUNAS_METADADOS)
+  return [arquivo[1], row_data]
+
+
 '''
 Função que extrai informações de um arquivo de exame oftalmológico.
 Recebe um dicionário inicial (row_data) e uma lista "arquivo" onde o primeiro elemento é o caminho do arquivo
@@ -599,54 +740,361 @@ e o segundo é o nome da subpasta/diretório.
 A função:
 - abre a imagem;
 - extrai dados do nome do arquivo para preencher metadados (nome, ID, olho, data, sexo, data nascimento);
-- detecta o padrão da imagem (padrão 1 ou 2);
+- detecta o padrão da imagem (padrão 1 ou 2); se o layout não for reconhecido, o OCR da imagem não é executado;
+- alinha os recortes do padrão à imagem (alinhar_layout); se a imagem não se alinhar à referência, o OCR também não é executado;
 - extrai dados específicos da imagem por OCR, utilizando funções auxiliares para diferentes partes;
 - retorna uma lista com o nome da subpasta e o dicionário com os dados extraídos.
+O trabalho é dividido em etapa_abrir, etapa_preprocessar e etapa_ocr, executadas aqui uma após a outra;
+com PIPELINE as mesmas etapas rodam em threads separadas, sobrepostas entre imagens (ver pipeline.py).
 '''
 def extrair_infomacoes_arquivo(row_data, arquivo):
+  return etapa_ocr(etapa_preprocessar(etapa_abrir(row_data, arquivo)))
+
 
-  padrao = 0
+'''
+Etapas de extrair_infomacoes_arquivo. O estado da imagem passa de uma etapa para a outra em um dicionário "exame":
+- 'arquivo', 'row_data': os parâmetros de extrair_infomacoes_arquivo;
+- 'img': a imagem aberta e decodificada; 'padrao': o padrão de layout (None enquanto não for detectado);
+- 'tabela': a tabela de recortes do padrão alinhada à imagem (alinhar_layout), usada pelo pré-processamento e pelo OCR;
+- 'metricas': o registro de métricas da imagem (as etapas podem rodar em threads diferentes);
+- 'fim': True quando não há mais nada a fazer (falha, layout desconhecido ou imagem desalinhada); as etapas seguintes só repassam o exame.
+Etapas:
+- etapa_abrir: lê e decodifica o arquivo e extrai os metadados do nome do arquivo (só disco e PIL);
+- etapa_preprocessar: detecta o padrão pelas miniaturas (se houver referências de layout) e alinha os recortes à imagem;
+- etapa_ocr: detecta o padrão por OCR (sem referências de layout), executa o OCR dos campos e envia os recortes
+  para gravação. Retorna [pasta, row_data]. É a única etapa que usa o leitor EasyOCR.
+  Ao terminar (com ou sem sucesso), fecha a imagem.
+'''
+def etapa_abrir(row_data, arquivo):
+  exame = {'arquivo': arquivo, 'row_data': row_data, 'img': None, 'padrao': None, 'tabela': None,
+           'metricas': metricas.iniciar_imagem(arquivo[0]) if METRICAS else None, 'fim': False}
   try:
     print('Processando o arquivo "%s..."' % arquivo[0].split('\\')[-1][:50])
-    img = Image.open(os.path.join(diretorio_raiz, IMAGES_DIR, arquivo[0]))
-    fn_splits = arquivo[0].split("_")
-    row_data['fName'] = fn_splits[1]+', '+fn_splits[2]+' '+fn_splits[3]
-    row_data['fID'] = fn_splits[4]
-    row_data['fEye'] = fn_splits[6]
-    row_data['fExameDate'] = fn_splits[7]
-    row_data['fExameTime'] = fn_splits[8].replace("-", ":")
-    row_data['fSex'] = fn_splits[9]
-    row_data['fDOB'] = fn_splits[10]
-
-    padrao = padrao_imagem(img)
-
-    row_data = getting_infos_data({}, img, info_crops(padrao))
-    row_data = getting_exam_data(row_data, img, exam_crops(padrao))
-    row_data = getting_maps_data(row_data, img, get_map_crops(padrao))
+    with metricas.cronometro('abrir'):
+      img = abrir_imagem(os.path.join(diretorio_raiz, IMAGES_DIR, arquivo[0]))
+      img.load()
+    exame['img'] = img
+    row_data.update(metadados_arquivo(arquivo[0]))
+  except Exception as e:
+    _falha_exame(exame, e)
+  metricas.retomar_imagem(None)
+  return exame
+
+def etapa_preprocessar(exame):
+  if exame['fim']:
+    return exame
+  metricas.retomar_imagem(exame['metricas'])
+  try:
+    if modelos_layout:
+      _detectar_padrao_exame(exame)
+    if not exame['fim'] and exame['padrao'] is not None:
+      _alinhar_exame(exame)
+  except Exception as e:
+    _falha_exame(exame, e)
+  metricas.retomar_imagem(None)
+  return exame
+
+def etapa_ocr(exame):
+  arquivo = exame['arquivo']
+  if exame['fim']:
+    _liberar_exame(exame)
+    return [arquivo[1], exame['row_data']]
+  metricas.retomar_imagem(exame['metricas'])
+  arquivo_recortes.iniciar_exame()
+  try:
+    if exame['padrao'] is None:
+      _detectar_padrao_exame(exame)
+      if not exame['fim']:
+        _alinhar_exame(exame)
+      if exame['fim']:
+        return [arquivo[1], exame['row_data']]
+    img, tabela, row_data = exame['img'], exame['tabela'], exame['row_data']
+    if OCR_LOTE:
+      row_data = getting_data_lote(row_data, img, tabela)
+    else:
+      formatos = tabela.formatos
+      row_data = getting_infos_data(row_data, img, info_crops(tabela), formatos)
+      row_data = getting_exam_data(row_data, img, exam_crops(tabela), formatos)
+      row_data = getting_maps_data(row_data, img, get_map_crops(tabela), formatos)
+    with metricas.cronometro('recortes'):
+      arquivo_recortes.finalizar_exame(nome_paciente_base(img), os.path.join(diretorio_raiz, RECORTES_DIR), RECORTES_FORMATO,
+                                       nome_exame(img))
 
     print('processamento do arquivo "%s..." finalizado' % arquivo[0].split('\\')[-1][:50])
-    
+    metricas.finalizar_imagem()
   except Exception as e:
-    print('falha ao tentar ler o arquivo "%s..."' % arquivo[0].split('\\')[-1][:50], e)
-    
-  return [arquivo[1], row_data]
+    _falha_exame(exame, e)
+  finally:
+    _liberar_exame(exame)
+  return [arquivo[1], exame['row_data']]
+
+def _detectar_padrao_exame(exame):
+  with metricas.cronometro('layout'):
+    exame['padrao'], confianca_layout = detectar_padrao(exame['img'])
+  if exame['padrao'] == LAYOUT_DESCONHECIDO:
+    print('layout não reconhecido no arquivo "%s..." (similaridade %.2f)' % (exame['arquivo'][0].split('\\')[-1][:50], confianca_layout))
+    metricas.contar('layout_desconhecido')
+    metricas.finalizar_imagem()
+    exame['fim'] = True
+
+def _alinhar_exame(exame):
+  with metricas.cronometro('alinhamento'):
+    exame['tabela'], alinhamento = alinhar_layout(exame['img'], exame['padrao'])
+  if alinhamento is None:
+    return
+  exame['row_data'].update(colunas_alinhamento(alinhamento))
+  if alinhamento['qualidade'] < ALINHAMENTO_QUALIDADE_MINIMA:
+    print('imagem desalinhada do layout no arquivo "%s..." (qualidade %.2f)' % (exame['arquivo'][0].split('\\')[-1][:50], alinhamento['qualidade']))
+    metricas.contar('alinhamento_recusado')
+    metricas.finalizar_imagem()
+    exame['fim'] = True
+  elif exame['tabela'] is not tabela_layout(exame['padrao']):
+    metricas.contar('alinhamento_corrigido')
+
+def _liberar_exame(exame):
+  # Fecha a imagem assim que a imagem termina, sem esperar o coletor de lixo
+  if exame['img'] is not None:
+    exame['img'].close()
+  exame['img'] = None
+
+def _falha_exame(exame, e):
+  print('falha ao tentar ler o arquivo "%s..."' % exame['arquivo'][0].split('\\')[-1][:50], e)
+  metricas.finalizar_imagem(e)
+  exame['fim'] = True
+
+
+'''
+Funções usadas pelos processos do pool quando N_PROCESSOS > 1.
+Cada processo cria o seu próprio leitor EasyOCR uma única vez, na inicialização, e o reaproveita para todos os arquivos que receber.
+Sem GPU, os núcleos da máquina são divididos entre os processos para que as threads do torch não disputem a mesma CPU.
+'''
+def inicializar_processo(raiz, gpu, n_processos, contadores_cache, contadores_niveis, caminho_metricas, nome_recortes):
+    global diretorio_raiz
+    arquivo_recortes.nome_execucao = nome_recortes
+    if OCR_CACHE:
+        abrir_cache_ocr(raiz, contadores_cache)
+    if MEMORIA_LIMITADA:
+        arquivo_recortes.iniciar_gravador(TAMANHO_FILA_RECORTES_LIMITADA)
+    ocr_adaptativo.iniciar_contadores(len(OCR_NIVEIS), contadores_niveis)
+    if caminho_metricas:
+        metricas.abrir_log(caminho_metricas, VERBOSE)
+    carregar_layouts(raiz)
+    multiprocessing.util.Finalize(None, arquivo_recortes.encerrar_gravador, exitpriority=10)
+    threads = OCR_THREADS
+    if not threads and not gpu:
+        threads = max(1, (os.cpu_count() or 1) // n_processos)
+    obter_reader(gpu, threads)
+    diretorio_raiz = raiz
+
+'''
+Processa uma tarefa (arquivo, hash, resultado do checkpoint, chave de deduplicação, cópia).
+Se o arquivo já estiver no checkpoint, devolve o resultado guardado. Se for cópia de uma imagem anterior (mesma chave),
+o OCR não é executado: o resultado é montado depois, na ordem da listagem, a partir do resultado da primeira ocorrência.
+Retorna (caminho, hash, [pasta, row_data], novo, chave), em que `novo` indica se o OCR foi executado agora;
+nas cópias, row_data é None.
+'''
+def processar_tarefa(tarefa):
+    arquivo, hash_conteudo, existente, chave, copia = tarefa
+    if existente is not None:
+        return arquivo[0], hash_conteudo, existente, False, chave
+    if copia:
+        return arquivo[0], hash_conteudo, [arquivo[1], None], True, chave
+    return arquivo[0], hash_conteudo, extrair_infomacoes_arquivo({}, arquivo), True, chave
+
+
+'''
+Etapas de processar_tarefa para o pipeline.py: leitura (etapa_abrir), pré-processamento (etapa_preprocessar) e OCR
+(etapa_ocr, uma única thread). Tarefas do checkpoint e cópias já saem prontas da primeira etapa e só atravessam as outras.
+'''
+def etapas_pipeline():
+    def ler_arquivo(tarefa):
+        arquivo, hash_conteudo, existente, chave, copia = tarefa
+        if existente is not None or copia:
+            return tarefa, processar_tarefa(tarefa)
+        return tarefa, etapa_abrir({}, arquivo)
+
+    def preprocessar(item):
+        tarefa, exame = item
+        return item if isinstance(exame, tuple) else (tarefa, etapa_preprocessar(exame))
+
+    def reconhecer(item):
+        tarefa, exame = item
+        if isinstance(exame, tuple):
+            return exame
+        return tarefa[0][0], tarefa[1], etapa_ocr(exame), True, tarefa[3]
+
+    return [('leitura', ler_arquivo, PIPELINE_THREADS['leitura']),
+            ('preprocessamento', preprocessar, PIPELINE_THREADS['preprocessamento']),
+            ('ocr', reconhecer, 1)]
+
+
+'''
+Tarefas de processar_tarefa para os arquivos listados, cada uma com o hash do conteúdo (usado pelo checkpoint).
+Com DEDUP_IMAGENS desligado, a listagem é consumida aos poucos, à medida que o OCR avança.
+Com deduplicação, todos os arquivos são listados e têm a chave calculada antes do OCR começar (hash dos bytes,
+o mesmo do checkpoint, ou SHA-1 exato dos pixels decodificados), para saber quais chaves se repetem; só a primeira ocorrência de cada chave
+passa pelo OCR. Retorna (tarefas, copias), em que `copias` é um Counter chave -> número de arquivos (None sem deduplicação).
+'''
+def montar_tarefas(diretorio_exames, processados, shard=None):
+    from collections import Counter
+    if DEDUP_IMAGENS not in ('desligado', 'conteudo', 'pixels_exatos'):
+        raise ValueError("DEDUP_IMAGENS desconhecido: %r (use 'desligado', 'conteudo' ou 'pixels_exatos')" % (DEDUP_IMAGENS,))
+
+    def com_hash(arquivos):
+        for arquivo in arquivos:
+            caminho = os.path.join(diretorio_raiz, IMAGES_DIR, arquivo[0])
+            h = hash_entrada(caminho)
+            chave = None
+            if DEDUP_IMAGENS == 'conteudo':
+                chave = h
+            elif DEDUP_IMAGENS == 'pixels_exatos':
+                try:
+                    chave = hash_pixels(caminho, abrir_imagem)
+                except Exception:
+                    chave = h  # Imagem ilegível: só é agrupada com cópias idênticas do arquivo
+            yield arquivo, h, chave
+
+    entradas = com_hash(listar_arquivos(diretorio_exames, shard=shard))
+    if DEDUP_IMAGENS == 'desligado':
+        return ((arquivo, h, processados.get((arquivo[0], h)), None, False) for arquivo, h, _ in entradas), None
+
+    entradas = list(entradas)
+    copias = Counter(chave for _, _, chave in entradas)
+
+    def tarefas():
+        vistas = set()
+        for arquivo, h, chave in entradas:
+            existente = processados.get((arquivo[0], h))
+            yield arquivo, h, existente, chave, existente is None and chave in vistas
+            vistas.add(chave)
+    return tarefas(), copias
 
 
 '''
 Função principal para iniciar o processo de leitura das imagens de exames.
-Recebe o diretório base onde as imagens estão armazenadas.
+Recebe o diretório base onde as imagens estão armazenadas, o número de processos e, opcionalmente, o shard (i, N).
 Realiza os seguintes passos:
-- Lista todos os arquivos e suas subpastas dentro do diretório informado.
-- Para cada arquivo listado, extrai as informações usando OCR e outras funções auxiliares.
-- Armazena os resultados em uma lista.
-- Cria dataframes a partir dos dados extraídos e salva-os em arquivos Excel.
+- Percorre os arquivos e suas subpastas dentro do diretório informado; o OCR começa já no primeiro arquivo encontrado.
+- Consulta o checkpoint em OUTPUT_DIR e reaproveita os arquivos já processados (mesmo caminho e mesmo conteúdo).
+- Com DEDUP_IMAGENS, imagens repetidas (mesma chave, em qualquer pasta ou com qualquer nome) passam pelo OCR uma única vez;
+  cada cópia recebe os campos lidos na primeira ocorrência e os metadados do próprio nome. Exibe a taxa de deduplicação.
+- Para cada arquivo restante, extrai as informações usando OCR e outras funções auxiliares.
+  Com n_processos > 1 os arquivos são distribuídos entre um pool de processos; os resultados voltam na mesma ordem da listagem.
+  Com 1 processo e PIPELINE, a listagem, a leitura dos arquivos, o pré-processamento e o OCR rodam em etapas paralelas
+  (pipeline.py), com no máximo PIPELINE_MAX_IMAGENS imagens em andamento; os resultados também saem na ordem da listagem.
+- A cada save_step imagens, grava os resultados parciais no checkpoint.
+- No formato 'excel', cria dataframes a partir dos dados extraídos e salva-os em arquivos Excel.
+  Nos formatos 'csv' e 'parquet', cada exame é gravado em OUTPUT_DIR assim que termina, sem manter os resultados na memória;
+  as planilhas Excel são geradas depois a partir desse arquivo, se EXPORTAR_EXCEL estiver ativo.
+- Com MEMORIA_LIMITADA, os resultados são sempre gravados exame a exame (o formato 'excel' passa por um CSV), as cópias da
+  deduplicação guardam o original como registro compacto (saida.RegistroExame), a entrada de imagens pausa enquanto o RSS
+  passar de MEMORIA_MAX_MB e as planilhas Excel são montadas uma pasta por vez; no final exibe o pico de memória.
+- Com METRICAS, grava o tempo de cada etapa por imagem em OUTPUT_DIR e exibe o resumo por etapa (p50/p95) no final.
+- Exibe o resumo de acertos e falhas do cache de OCR e, com OCR_ADAPTATIVO, a taxa de aceitação de cada nível.
 '''
-def iniciar_processo_leitura_imagens(diretorio_exames):
+def iniciar_processo_leitura_imagens(diretorio_exames, n_processos=1, gpu=USE_GPU, shard=None):
     try:
-        arquivos = listar_arquivos(diretorio_exames)
-        resultado = [extrair_infomacoes_arquivo({}, arquivo) for arquivo in arquivos]
-
-        create_dataframe(resultado)
+        nome_checkpoint = CHECKPOINT_FILE
+        if shard:
+            nome_checkpoint = CHECKPOINT_FILE.replace('.jsonl', '_%dde%d.jsonl' % shard)
+        caminho_checkpoint = os.path.join(diretorio_raiz, OUTPUT_DIR, nome_checkpoint)
+        processados = carregar_checkpoint(caminho_checkpoint)
+
+        tarefas, copias = montar_tarefas(diretorio_exames, processados, shard)
+        if MEMORIA_LIMITADA:
+            tarefas = memoria.limitar_entrada(tarefas, MEMORIA_MAX_MB)
+            arquivo_recortes.iniciar_gravador(TAMANHO_FILA_RECORTES_LIMITADA)
+
+        sufixo = '_%dde%d' % shard if shard else ''
+        data_hora = time.strftime("%Y%m%d-%H%M%S")
+        arquivo_recortes.nome_execucao = 'recortes_' + data_hora + sufixo  # Conjunto de recortes desta execução (RECORTES_FORMATO 'dataset')
+        escritor = None
+        esquema = None
+        formato_saida = SAIDA_FORMATO
+        if MEMORIA_LIMITADA and formato_saida == 'excel':
+            formato_saida = 'csv'  # As planilhas são geradas no final a partir do CSV, sem guardar os resultados na memória
+        if formato_saida != 'excel':
+            extensao = '.parquet' if formato_saida == 'parquet' else '.csv'
+            caminho_saida = os.path.join(diretorio_raiz, OUTPUT_DIR, 'RTVue_' + data_hora + sufixo + extensao)
+            esquema = esquema_saida()
+            escritor = abrir_escritor(formato_saida, caminho_saida, esquema)
+        colunas_registro = ColunasRegistro(esquema) if MEMORIA_LIMITADA else None
+        caminho_metricas = None
+        if METRICAS:
+            caminho_metricas = os.path.join(diretorio_raiz, OUTPUT_DIR, 'metricas_' + data_hora + sufixo + '.jsonl')
+            metricas.abrir_log(caminho_metricas, VERBOSE)
+
+        def gravar_resultados(resultados):
+            resultado = []
+            registros = []
+            total = 0
+            reaproveitados = 0
+            deduplicados = 0  # Cópias montadas nesta execução; as reaproveitadas do checkpoint contam em reaproveitados
+            originais = {}  # chave -> resultado da primeira ocorrência, enquanto faltarem cópias a montar
+            for caminho, hash_conteudo, r, novo, chave in resultados:
+                total += 1
+                if copias is not None:
+                    if r[1] is None:
+                        original = originais[chave]
+                        r = resultado_copia(original.resultado() if colunas_registro else original, [caminho, r[0]])
+                        deduplicados += 1
+                    elif copias[chave] > 1:
+                        originais[chave] = RegistroExame(colunas_registro, caminho, r) if colunas_registro else r
+                    copias[chave] -= 1
+                    if copias[chave] == 0:
+                        originais.pop(chave, None)
+                if escritor:
+                    escritor.escrever(caminho, r)
+                else:
+                    resultado.append(r)
+                if not novo:
+                    reaproveitados += 1
+                elif r[1]:
+                    registros.append((caminho, hash_conteudo, r))
+                if len(registros) >= save_step:
+                    gravar_checkpoint(caminho_checkpoint, registros)
+                    registros = []
+            gravar_checkpoint(caminho_checkpoint, registros)
+            print('%d arquivos processados, %d reaproveitados do checkpoint' % (total, reaproveitados))
+            if copias is not None:
+                novos = total - reaproveitados
+                print('Deduplicação (%s): %d imagens distintas em %d arquivos novos, %d cópias sem OCR (%.1f%%)'
+                      % (DEDUP_IMAGENS, novos - deduplicados, novos, deduplicados, 100 * deduplicados / novos if novos else 0))
+            return resultado
+
+        if n_processos > 1:
+            # Exporta os modelos ONNX uma vez, antes do pool: os processos só os carregam
+            backends_ocr.preparar_modelos(OCR_BACKEND, ['pt'], diretorio_raiz)
+            contexto = multiprocessing.get_context('spawn')
+            with contexto.Pool(n_processos, initializer=inicializar_processo, initargs=(diretorio_raiz, gpu, n_processos, cache_ocr.contadores, ocr_adaptativo.contadores, caminho_metricas, arquivo_recortes.nome_execucao)) as pool:
+                resultado = gravar_resultados(pool.imap(processar_tarefa, tarefas))
+                pool.close()
+                pool.join()  # Aguarda os processos terminarem de gravar os recortes pendentes
+        elif PIPELINE:
+            resultado = gravar_resultados(pipeline.executar(tarefas, etapas_pipeline(), PIPELINE_MAX_IMAGENS))
+            arquivo_recortes.encerrar_gravador()
+        else:
+            resultado = gravar_resultados(processar_tarefa(tarefa) for tarefa in tarefas)
+            arquivo_recortes.encerrar_gravador()
+
+        if escritor:
+            escritor.fechar()
+            print('Resultados gravados em %s' % caminho_saida)
+            print(resumo_conversoes(escritor.falhas))
+            if EXPORTAR_EXCEL or SAIDA_FORMATO == 'excel':
+                create_dataframe(ler_saida(formato_saida, caminho_saida, esquema if MEMORIA_LIMITADA else None))
+        else:
+            create_dataframe(resultado)
+        if OCR_CACHE:
+            print(cache_ocr.resumo_cache())
+        if OCR_ADAPTATIVO:
+            print(ocr_adaptativo.resumo_niveis(OCR_NIVEIS))
+        if METRICAS:
+            metricas.fechar_log()
+            print(metricas.texto_resumo(metricas.resumir(caminho_metricas)))
+            print('Métricas gravadas em %s' % caminho_metricas)
+        if MEMORIA_LIMITADA:
+            print(memoria.resumo_memoria(MEMORIA_MAX_MB))
     except Exception as e:
         print(e)
 
@@ -655,17 +1103,29 @@ def iniciar_processo_leitura_imagens(diretorio_exames):
 Função principal que configura o OCR e inicia o processo de leitura das imagens.
 Parâmetros:
 - diretorio_exames: caminho para o diretório contendo as imagens dos exames.
+- n_processos: número de processos de OCR (padrão N_PROCESSOS). Com 1, tudo roda no processo atual.
+- gpu: se o EasyOCR deve usar a GPU (padrão USE_GPU).
+- shard: tupla (i, N) para processar apenas a parte i de N do diretório (ver listar_arquivos).
 Passos:
-- Inicializa o leitor OCR da biblioteca EasyOCR para a língua portuguesa, utilizando GPU se disponível.
+- Obtém o leitor OCR da biblioteca EasyOCR para a língua portuguesa (obter_reader; no modo multiprocesso, um leitor por processo).
+  Chamadas seguintes no mesmo processo reaproveitam o leitor já carregado.
 - Define o diretório raiz como o diretório onde este script está localizado.
+- Abre o cache de OCR em OUTPUT_DIR (se OCR_CACHE estiver ativo).
 - Chama a função que lista e processa as imagens presentes no diretório especificado.
 '''
-def SarmentoOCR(diretorio_exames):
-    global reader, diretorio_raiz
+def SarmentoOCR(diretorio_exames, n_processos=None, gpu=None, shard=None):
+    global diretorio_raiz
     try:
-        reader = ocr.Reader(['pt'], gpu=True)
+        n_processos = n_processos or N_PROCESSOS
+        gpu = USE_GPU if gpu is None else gpu
         diretorio_raiz = os.path.dirname(__file__)
-        iniciar_processo_leitura_imagens(diretorio_exames)
+        carregar_layouts(diretorio_raiz)
+        if OCR_CACHE:
+            contadores = cache_ocr.novos_contadores(multiprocessing.get_context('spawn'))
+            abrir_cache_ocr(diretorio_raiz, contadores)
+        ocr_adaptativo.iniciar_contadores(len(OCR_NIVEIS), ocr_adaptativo.novos_contadores(len(OCR_NIVEIS), multiprocessing.get_context('spawn')))
+        if n_processos <= 1:
+            obter_reader(gpu)
+        iniciar_processo_leitura_imagens(diretorio_exames, n_processos, gpu, shard)
     except Exception as e:
         print(e)
-
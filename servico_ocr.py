@@ -0,0 +1,281 @@
+# Serviço local de OCR: mantém o leitor (EasyOCR ou outro backend) carregado e atende exames por HTTP, sem o custo
+# de inicialização de uma execução do SarmentoOCR para cada exame exportado
+#
+# Cada requisição é processada em uma thread própria (abertura, layout e pré-processamento em paralelo) pelo mesmo
+# caminho de extrair_infomacoes_arquivo, com as mesmas configurações do sarmento_ocr: por padrão a resposta é igual
+# ao resultado de extrair_infomacoes_arquivo (leitura campo a campo, com o leitor usado por uma requisição de cada vez).
+# Com --ocr-lote o serviço usa o OCR em lote (OCR_LOTE) e reúne os recortes de exames simultâneos em lotes
+# compartilhados do reconhecedor (LoteCompartilhado): o lote é enviado quando atinge TAMANHO_LOTE recortes ou quando
+# o primeiro pedido do lote completa LATENCIA_MAX_MS de espera, o que vier primeiro. As respostas passam a ser as do
+# caminho em lote, que não usa o detector de texto e pode diferir da leitura campo a campo (ver ocr_lote.py e
+# "python benchmark.py ocr_lote"); são iguais às de uma execução do SarmentoOCR com OCR_LOTE = True.
+#
+# Uso:
+#   python servico_ocr.py iniciar [--porta 8765] [--ocr-lote [--latencia-ms 15] [--lote 512]] [--cpu] [--backend onnx]
+#   python servico_ocr.py carga <imagem> [<imagem> ...] [--clientes 8] [--requisicoes 200]   (teste de carga)
+# Requisições:
+#   POST /exame  {"caminho": "<arquivo da imagem>", "pasta": "<subpasta>" (opcional)}
+#     -> {"pasta": ..., "row_data": {...}, "ms": ...}  (o mesmo [pasta, row_data] de extrair_infomacoes_arquivo)
+#   GET /estado  -> exames atendidos, lotes enviados e tamanho médio dos lotes
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import sarmento_ocr as so
+from ocr_lote import reconhecer_lote
+
+
+PORTA = 8765
+LATENCIA_MAX_MS = 15      # Espera máxima de um pedido por outros exames antes do envio do lote ao reconhecedor
+TAMANHO_LOTE = 512        # Recortes a partir dos quais o lote é enviado sem esperar o prazo (um exame tem ~100-200)
+EXAMES_SIMULTANEOS = 8    # Exames em andamento ao mesmo tempo (limita a memória das imagens decodificadas)
+
+
+'''
+Leitor com acesso exclusivo: as chamadas ao modelo (readtext e recognize) de threads diferentes são feitas uma por vez.
+Os demais atributos são os do reader; o reconhecedor (usado pelo ocr_lote.reconhecer_recortes) é entregue com a mesma trava.
+'''
+class ReaderSerializado:
+  def __init__(self, reader):
+    self.reader = reader
+    self.trava = threading.Lock()
+
+  def __getattr__(self, nome):
+    return getattr(self.reader, nome)
+
+  @property
+  def recognizer(self):
+    return ModeloSerializado(self.reader.recognizer, self.trava)
+
+  def readtext(self, *args, **kwargs):
+    with self.trava:
+      return self.reader.readtext(*args, **kwargs)
+
+  def recognize(self, *args, **kwargs):
+    with self.trava:
+      return self.reader.recognize(*args, **kwargs)
+
+
+'''
+Reconhecedor do ReaderSerializado: cada chamada ao modelo (um lote de recortes) é feita com a trava do leitor.
+'''
+class ModeloSerializado:
+  def __init__(self, modelo, trava):
+    self.modelo = modelo
+    self.trava = trava
+
+  def eval(self):
+    return self
+
+  def __call__(self, *args):
+    with self.trava:
+      return self.modelo(*args)
+
+
+'''
+Reúne os recortes de exames simultâneos em lotes compartilhados do reconhecedor (ocr_lote.reconhecer_lote).
+reconhecer(campos) tem a mesma entrada e saída de reconhecer_lote e bloqueia até o lote do pedido ser lido.
+Uma única thread envia os lotes: cada lote junta os pedidos que chegarem até `latencia_max` segundos depois do
+primeiro, ou até somar `tamanho_max` recortes.
+'''
+class LoteCompartilhado:
+  def __init__(self, reader, latencia_max=LATENCIA_MAX_MS / 1000, tamanho_max=TAMANHO_LOTE):
+    self.reader = reader
+    self.latencia_max = latencia_max
+    self.tamanho_max = tamanho_max
+    self.fila = queue.Queue()
+    self.lotes = 0
+    self.pedidos = 0
+    self.recortes = 0
+    threading.Thread(target=self._enviar_lotes, name='lote-compartilhado', daemon=True).start()
+
+  def reconhecer(self, campos):
+    pedido = {'campos': campos, 'chegada': time.perf_counter(), 'pronto': threading.Event(), 'resultado': None, 'erro': None}
+    self.fila.put(pedido)
+    pedido['pronto'].wait()
+    if pedido['erro'] is not None:
+      raise pedido['erro']
+    return pedido['resultado']
+
+  def _enviar_lotes(self):
+    while True:
+      lote = [self.fila.get()]
+      n = len(lote[0]['campos'])
+      prazo = lote[0]['chegada'] + self.latencia_max
+      while n < self.tamanho_max:
+        # Os pedidos que já estão na fila (chegaram durante o lote anterior) sempre entram, mesmo com o prazo vencido
+        restante = prazo - time.perf_counter()
+        try:
+          pedido = self.fila.get(timeout=restante) if restante > 0 else self.fila.get_nowait()
+        except queue.Empty:
+          break
+        lote.append(pedido)
+        n += len(pedido['campos'])
+
+      # As chaves de cada pedido ganham o índice do pedido no lote, para separar os resultados depois
+      campos = [((i, chave), recorte, allowlist) for i, pedido in enumerate(lote) for chave, recorte, allowlist in pedido['campos']]
+      try:
+        resultados = reconhecer_lote(self.reader, campos)
+        for i, pedido in enumerate(lote):
+          pedido['resultado'] = {chave: resultados[(i, chave)] for chave, _, _ in pedido['campos']}
+      except Exception as e:
+        for pedido in lote:
+          pedido['erro'] = e
+      self.lotes += 1
+      self.pedidos += len(lote)
+      self.recortes += n
+      for pedido in lote:
+        pedido['pronto'].set()
+
+  def estado(self):
+    return {'lotes': self.lotes, 'pedidos_por_lote': self.pedidos / self.lotes if self.lotes else 0,
+            'recortes_por_lote': self.recortes / self.lotes if self.lotes else 0}
+
+
+'''
+Prepara o sarmento_ocr para atender exames: carrega layouts, leitor e banco de glifos uma única vez.
+Com ocr_lote liga o OCR em lote com o LoteCompartilhado e o retorna; sem ele, mantém OCR_LOTE como está
+(as respostas são as de extrair_infomacoes_arquivo) e retorna None.
+'''
+def preparar(gpu=None, latencia_max_ms=LATENCIA_MAX_MS, tamanho_lote=TAMANHO_LOTE, ocr_lote=False):
+  so.diretorio_raiz = os.path.dirname(os.path.abspath(so.__file__))
+  so.carregar_layouts(so.diretorio_raiz)
+  so.arquivo_recortes.nome_execucao = 'servico_' + time.strftime("%Y%m%d-%H%M%S")
+  if so.OCR_CACHE:
+    so.abrir_cache_ocr(so.diretorio_raiz)
+  if ocr_lote:
+    so.OCR_LOTE = True  # Antes de criar o leitor: o OCR em lote usa o reconhecedor fp32
+  so.reader = ReaderSerializado(so.obter_reader(gpu))
+  so.obter_banco_digitos()
+  if ocr_lote:
+    so.lote_compartilhado = LoteCompartilhado(so.reader, latencia_max_ms / 1000, tamanho_lote)
+  return so.lote_compartilhado
+
+
+class _Requisicao(BaseHTTPRequestHandler):
+  vagas = threading.BoundedSemaphore(EXAMES_SIMULTANEOS)
+  trava = threading.Lock()
+  atendidos = 0
+
+  def do_GET(self):
+    if self.path != '/estado':
+      return self._responder(404, {'erro': 'caminho desconhecido: %s' % self.path})
+    estado = so.lote_compartilhado.estado() if so.lote_compartilhado is not None else {}
+    self._responder(200, dict(estado, exames=_Requisicao.atendidos))
+
+  def do_POST(self):
+    if self.path != '/exame':
+      return self._responder(404, {'erro': 'caminho desconhecido: %s' % self.path})
+    try:
+      pedido = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+      caminho = os.path.abspath(pedido['caminho'])
+    except (ValueError, KeyError, TypeError) as e:
+      return self._responder(400, {'erro': 'pedido inválido (esperado {"caminho": ...}): %s' % e})
+    if not os.path.isfile(caminho):
+      return self._responder(404, {'erro': 'arquivo não encontrado: %s' % caminho})
+
+    inicio = time.perf_counter()
+    with _Requisicao.vagas:
+      pasta, row_data = so.extrair_infomacoes_arquivo({}, [caminho, pedido.get('pasta') or os.path.basename(os.path.dirname(caminho))])
+    with _Requisicao.trava:
+      _Requisicao.atendidos += 1
+    self._responder(200, {'pasta': pasta, 'row_data': row_data, 'ms': 1000 * (time.perf_counter() - inicio)})
+
+  def _responder(self, status, corpo):
+    dados = json.dumps(corpo, ensure_ascii=False, default=float).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json; charset=utf-8')
+    self.send_header('Content-Length', str(len(dados)))
+    self.end_headers()
+    self.wfile.write(dados)
+
+  def log_message(self, formato, *args):
+    pass  # O processamento de cada exame já é registrado no console pelo sarmento_ocr
+
+
+def iniciar(host='127.0.0.1', porta=PORTA, gpu=None, latencia_max_ms=LATENCIA_MAX_MS, tamanho_lote=TAMANHO_LOTE,
+            ocr_lote=False):
+  inicio = time.perf_counter()
+  preparar(gpu, latencia_max_ms, tamanho_lote, ocr_lote)
+  servidor = ThreadingHTTPServer((host, porta), _Requisicao)
+  servidor.daemon_threads = True
+  print('Serviço de OCR pronto em http://%s:%d (%.1f s de inicialização)' % (host, porta, time.perf_counter() - inicio))
+  try:
+    servidor.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    servidor.server_close()
+    so.arquivo_recortes.encerrar_gravador()
+
+
+'''
+Cliente: envia um exame ao serviço e devolve a resposta ({'pasta', 'row_data', 'ms'}).
+'''
+def enviar_exame(caminho, url='http://127.0.0.1:%d' % PORTA, pasta=None, timeout=300):
+  corpo = json.dumps({'caminho': os.path.abspath(caminho), 'pasta': pasta}).encode('utf-8')
+  pedido = urllib.request.Request(url + '/exame', data=corpo, headers={'Content-Type': 'application/json'})
+  with urllib.request.urlopen(pedido, timeout=timeout) as resposta:
+    return json.loads(resposta.read())
+
+
+def _percentil(valores, p):
+  ordenados = sorted(valores)
+  return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+'''
+Teste de carga: `clientes` clientes simultâneos enviam `requisicoes` exames no total (as imagens são repetidas em
+rodízio). Mede a latência de cada requisição vista pelo cliente e a vazão, e imprime também o estado dos lotes.
+'''
+def carga(imagens, url='http://127.0.0.1:%d' % PORTA, clientes=8, requisicoes=200):
+  def requisitar(i):
+    inicio = time.perf_counter()
+    enviar_exame(imagens[i % len(imagens)], url)
+    return time.perf_counter() - inicio
+
+  enviar_exame(imagens[0], url)  # Aquecimento
+  inicio = time.perf_counter()
+  with ThreadPoolExecutor(clientes) as executor:
+    latencias = list(executor.map(requisitar, range(requisicoes)))
+  duracao = time.perf_counter() - inicio
+  with urllib.request.urlopen(url + '/estado') as resposta:
+    estado = json.loads(resposta.read())
+  print('%d requisições, %d clientes: %.1f exames/s | latência p50 %.0f ms, p99 %.0f ms, máx %.0f ms'
+        % (requisicoes, clientes, requisicoes / duracao, 1000 * _percentil(latencias, 50),
+           1000 * _percentil(latencias, 99), 1000 * max(latencias)))
+  if 'lotes' in estado:
+    print('lotes do reconhecedor: %d, %.1f exames e %.0f recortes por lote'
+          % (estado['lotes'], estado['pedidos_por_lote'], estado['recortes_por_lote']))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Serviço local de OCR com lotes compartilhados entre requisições')
+  comandos = parser.add_subparsers(dest='comando', required=True)
+  servico = comandos.add_parser('iniciar', help='inicia o serviço')
+  servico.add_argument('--host', default='127.0.0.1')
+  servico.add_argument('--porta', type=int, default=PORTA)
+  servico.add_argument('--ocr-lote', action='store_true', help='OCR em lote com lotes compartilhados entre requisições (OCR_LOTE)')
+  servico.add_argument('--latencia-ms', type=float, default=LATENCIA_MAX_MS, help='espera máxima por outros exames (LATENCIA_MAX_MS)')
+  servico.add_argument('--lote', type=int, default=TAMANHO_LOTE, help='recortes por lote (TAMANHO_LOTE)')
+  servico.add_argument('--cpu', action='store_true', help='não usa a GPU')
+  servico.add_argument('--backend', choices=so.backends_ocr.BACKENDS, default=so.OCR_BACKEND, help='backend de OCR (OCR_BACKEND)')
+  teste = comandos.add_parser('carga', help='teste de carga contra um serviço em execução')
+  teste.add_argument('imagens', nargs='+')
+  teste.add_argument('--url', default='http://127.0.0.1:%d' % PORTA)
+  teste.add_argument('--clientes', type=int, default=8)
+  teste.add_argument('--requisicoes', type=int, default=200)
+  args = parser.parse_args()
+
+  if args.comando == 'iniciar':
+    so.OCR_BACKEND = args.backend
+    iniciar(args.host, args.porta, False if args.cpu else None, args.latencia_ms, args.lote, args.ocr_lote)
+  else:
+    carga(args.imagens, args.url, args.clientes, args.requisicoes)
@@ -1,4 +1,20 @@
+import argparse
+
 from sarmento_ocr import SarmentoOCR
 
 if __name__ == "__main__":
-    SarmentoOCR('imagens')
+    parser = argparse.ArgumentParser(description='Leitura dos exames RTVue por OCR')
+    parser.add_argument('diretorio', nargs='?', default='imagens', help='diretório com as subpastas de imagens')
+    parser.add_argument('--processos', type=int, default=None, help='número de processos de OCR')
+    parser.add_argument('--shard', default=None, help='processa apenas a parte i de N do diretório, no formato i/N')
+    args = parser.parse_args()
+
+    shard = None
+    if args.shard:
+        try:
+            shard = tuple(int(p) for p in args.shard.split('/'))
+        except ValueError:
+            shard = ()
+        if len(shard) != 2 or not 0 <= shard[0] < shard[1]:
+            parser.error('--shard deve ter o formato i/N, com 0 <= i < N (recebido: %s)' % args.shard)
+    SarmentoOCR(args.diretorio, n_processos=args.processos, shard=shard)
@@ -0,0 +1,2 @@
+# Testes das partes determinísticas do pipeline (não dependem do EasyOCR nem de imagens reais de exames)
+# Uso, no diretório raiz: python -m unittest
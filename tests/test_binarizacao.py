@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+from PIL import Image
+
+from benchmark import binarize_laco, recorte_sintetico
+from binarizacao import binarize, limiar_otsu, tabela_limiar
+
+
+'''
+O modo 'fixo' (tabela de consulta) tem de dar exatamente a mesma imagem do laço pixel a pixel original.
+'''
+class TestBinarizacaoFixa(unittest.TestCase):
+  def test_igual_ao_laco(self):
+    img = recorte_sintetico(20, 8, mag=2, seed=1)
+    for thresh in (0, 1, 127, 200, 255, 256):
+      with self.subTest(thresh=thresh):
+        esperado = np.asarray(binarize_laco(img, thresh=thresh))
+        obtido = np.asarray(binarize(img, thresh=thresh))
+        np.testing.assert_array_equal(obtido, esperado)
+
+  def test_imagem_colorida(self):
+    arr = np.random.default_rng(2).integers(0, 256, size=(12, 30, 3), dtype=np.uint8)
+    img = Image.fromarray(arr, mode='RGB')
+    np.testing.assert_array_equal(np.asarray(binarize(img, thresh=150)), np.asarray(binarize_laco(img, thresh=150)))
+
+  def test_tabela_limiar(self):
+    tabela = tabela_limiar(200)
+    self.assertEqual(len(tabela), 256)
+    self.assertEqual((tabela[199], tabela[200]), (0, 255))
+    self.assertIs(tabela_limiar(200), tabela)
+
+
+class TestOutrosModos(unittest.TestCase):
+  def test_otsu_separa_duas_intensidades(self):
+    arr = np.full((10, 10), 220, dtype=np.uint8)
+    arr[:, :4] = 30
+    img = Image.fromarray(arr, mode='L')
+    self.assertTrue(30 < limiar_otsu(img) <= 220)
+    np.testing.assert_array_equal(np.asarray(binarize(img, modo='otsu')), np.where(arr == 30, 0, 255))
+
+  def test_adaptativo_binario(self):
+    saida = np.asarray(binarize(recorte_sintetico(16, 8, seed=3), modo='adaptativo'))
+    self.assertTrue(set(np.unique(saida)) <= {0, 255})
+
+  def test_modo_desconhecido(self):
+    with self.assertRaises(ValueError):
+      binarize(Image.new('L', (4, 4)), modo='outro')
+
+
+if __name__ == '__main__':
+  unittest.main()
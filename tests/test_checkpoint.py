@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from PIL import Image
+
+import sarmento_ocr
+from checkpoint import carregar_checkpoint, gravar_checkpoint, hash_arquivo, hash_pixels
+from entradas import hash_entrada
+
+
+def gravar_imagem(caminho, seed, compress_level=6):
+  os.makedirs(os.path.dirname(caminho), exist_ok=True)
+  arr = np.random.default_rng(seed).integers(0, 256, size=(8, 12), dtype=np.uint8)
+  Image.fromarray(arr, mode='L').save(caminho, compress_level=compress_level)
+
+
+class TestArquivoCheckpoint(unittest.TestCase):
+  def setUp(self):
+    self.diretorio = tempfile.mkdtemp()
+    self.caminho = os.path.join(self.diretorio, 'checkpoint.jsonl')
+
+  def tearDown(self):
+    shutil.rmtree(self.diretorio)
+
+  def test_ida_e_volta(self):
+    gravar_checkpoint(self.caminho, [('a.png', 'h1', ['PASTA', {'SSI': '8.1', 'conf': np.float32(0.5)}])])
+    gravar_checkpoint(self.caminho, [('b.png', 'h2', ['PASTA', {'Eye': 'OD'}])])
+    processados = carregar_checkpoint(self.caminho)
+    self.assertEqual(processados, {('a.png', 'h1'): ['PASTA', {'SSI': '8.1', 'conf': 0.5}],
+                                   ('b.png', 'h2'): ['PASTA', {'Eye': 'OD'}]})
+
+  def test_ignora_linha_incompleta(self):
+    gravar_checkpoint(self.caminho, [('a.png', 'h1', ['PASTA', {}])])
+    with open(self.caminho, 'a', encoding='utf-8') as f:
+      f.write(json.dumps({'arquivo': 'b.png', 'hash': 'h2', 'pasta': 'PASTA', 'dados': {}})[:20])
+    self.assertEqual(list(carregar_checkpoint(self.caminho)), [('a.png', 'h1')])
+
+  def test_sem_arquivo(self):
+    self.assertEqual(carregar_checkpoint(self.caminho), {})
+
+  def test_registro_mais_recente_prevalece(self):
+    gravar_checkpoint(self.caminho, [('a.png', 'h1', ['PASTA', {'SSI': '1'}]), ('a.png', 'h1', ['PASTA', {'SSI': '2'}])])
+    self.assertEqual(carregar_checkpoint(self.caminho)[('a.png', 'h1')], ['PASTA', {'SSI': '2'}])
+
+
+'''
+Retomada de uma execução: montar_tarefas reaproveita do checkpoint só os arquivos com o mesmo caminho e o mesmo conteúdo.
+'''
+class TestRetomada(unittest.TestCase):
+  def setUp(self):
+    self.raiz = tempfile.mkdtemp()
+    self.imagens = os.path.join(self.raiz, 'imagens')
+    gravar_imagem(os.path.join(self.imagens, 'PASTA', 'a.png'), 1)
+    gravar_imagem(os.path.join(self.imagens, 'PASTA', 'b.png'), 2)
+    self.globais = mock.patch.multiple(sarmento_ocr, diretorio_raiz=self.raiz, IMAGES_DIR='imagens',
+                                       DEDUP_IMAGENS='desligado', create=True)
+    self.globais.start()
+
+  def tearDown(self):
+    self.globais.stop()
+    shutil.rmtree(self.raiz)
+
+  def tarefas(self, processados):
+    tarefas, copias = sarmento_ocr.montar_tarefas('imagens', processados)
+    return {os.path.basename(arquivo[0]): (h, existente, copia) for arquivo, h, existente, _, copia in tarefas}, copias
+
+  def test_reaproveita_processados(self):
+    caminho_a = os.path.join(self.imagens, 'PASTA', 'a.png')
+    processados = {(caminho_a, hash_entrada(caminho_a)): ['PASTA', {'SSI': '8.1'}]}
+    tarefas, copias = self.tarefas(processados)
+    self.assertIsNone(copias)
+    self.assertEqual(tarefas['a.png'][1], ['PASTA', {'SSI': '8.1'}])
+    self.assertIsNone(tarefas['b.png'][1])
+
+  def test_arquivo_alterado_e_reprocessado(self):
+    caminho_a = os.path.join(self.imagens, 'PASTA', 'a.png')
+    processados = {(caminho_a, hash_entrada(caminho_a)): ['PASTA', {'SSI': '8.1'}]}
+    gravar_imagem(caminho_a, 3)
+    tarefas, _ = self.tarefas(processados)
+    self.assertIsNone(tarefas['a.png'][1])
+
+  def test_deduplicacao(self):
+    shutil.copy(os.path.join(self.imagens, 'PASTA', 'b.png'), os.path.join(self.imagens, 'PASTA', 'c.png'))
+    gravar_imagem(os.path.join(self.imagens, 'PASTA', 'd.png'), 2, compress_level=1)
+    with mock.patch.object(sarmento_ocr, 'DEDUP_IMAGENS', 'conteudo'):
+      tarefas, copias = self.tarefas({})
+    self.assertEqual([tarefas[n][2] for n in ('a.png', 'b.png', 'c.png', 'd.png')], [False, False, True, False])
+    self.assertEqual(sorted(copias.values()), [1, 1, 2])
+    with mock.patch.object(sarmento_ocr, 'DEDUP_IMAGENS', 'pixels_exatos'):
+      tarefas, copias = self.tarefas({})
+    self.assertEqual([tarefas[n][2] for n in ('a.png', 'b.png', 'c.png', 'd.png')], [False, False, True, True])
+    self.assertEqual(sorted(copias.values()), [1, 3])
+
+  def test_modo_desconhecido(self):
+    with mock.patch.object(sarmento_ocr, 'DEDUP_IMAGENS', 'pixels'):
+      with self.assertRaises(ValueError):
+        self.tarefas({})
+
+  def test_hash_pixels_independe_da_compressao(self):
+    d = os.path.join(self.imagens, 'PASTA', 'd.png')
+    gravar_imagem(d, 2, compress_level=1)
+    b = os.path.join(self.imagens, 'PASTA', 'b.png')
+    self.assertNotEqual(hash_arquivo(b), hash_arquivo(d))
+    self.assertEqual(hash_pixels(b), hash_pixels(d))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from reconciliacao import acuracia, formato_longo, indexar_chaves, normalizar, reconciliar
+
+
+CAMPOS = ['Eye', 'Exam_date', 'SSI', 'SSI_OD', 'Pachy_Y_Pachmetry_OD']
+
+
+def ground_truth(linhas):
+  chaves = pd.Series([chave for chave, _ in linhas])
+  valores = pd.Series([valor for _, valor in linhas])
+  indice = indexar_chaves(chaves, CAMPOS, valores)
+  indice['esperado'] = valores.str.strip().to_numpy()
+  return indice
+
+
+class TestIndexarChaves(unittest.TestCase):
+  def test_campo_mais_longo(self):
+    indice = indexar_chaves(pd.Series(['G___X_Silva_Ana_1_Pachy_Y_Pachmetry_OD', 'G___X_Silva_Ana_1_SSI_OD',
+                                       'G___X_Silva_Ana_1_Outro']), CAMPOS)
+    self.assertEqual(indice['grupo'].tolist(), ['G', 'G', 'G'])
+    self.assertEqual(indice['paciente'].tolist()[:2], ['X_Silva_Ana_1', 'X_Silva_Ana_1'])
+    self.assertEqual(indice['campo'].tolist()[:2], ['Pachy_Y_Pachmetry_OD', 'SSI_OD'])
+    self.assertTrue(pd.isna(indice['campo'][2]))
+    self.assertEqual(indice['olho'].tolist()[:2], ['OD', 'OD'])
+
+  def test_olho_pelo_campo_eye(self):
+    indice = indexar_chaves(pd.Series(['G___P_SSI', 'G___P_Eye']), CAMPOS, pd.Series(['7', 'os']))
+    self.assertEqual(indice['olho'].tolist(), ['OS', 'OS'])
+
+  def test_normalizar(self):
+    self.assertEqual(normalizar(pd.Series(['57,470', ' 9/9/2021 ', '62 (1)', None])).tolist(),
+                     ['57.470', '09-09-2021', '62 _1_', ''])
+
+
+'''
+Correspondência entre as chaves do ground truth e as linhas da saída: imagens soltas, membros de pacotes (a pasta é o
+pacote ou a subpasta do membro) e páginas ("_p<n>" no paciente), com a leitura não numérica guardada em "<campo>_bruto".
+'''
+class TestReconciliar(unittest.TestCase):
+  def setUp(self):
+    self.saida = pd.DataFrame({
+      'pasta': ['G', 'OD', 'G'],
+      'arquivo': ['imagens/G/X_Silva_Ana_1__2021.png', 'imagens/estudo.zip::OD/Y_Souza_Bia__2021.png',
+                  'imagens/G/Z_Lima_Caio__2021.tif::2'],
+      'Eye': ['OD', 'OS', None],
+      'Exam_date': ['9/9/2021', None, None],
+      'SSI_OD': [np.nan, 7.5, 3.0],
+      'SSI_OD_conf': [0.4, 0.9, 0.8],
+      'SSI_OD_bruto': ['8,10', None, None],
+      'SSI': [np.nan, np.nan, 62.0],
+      'SSI_conf': [np.nan, np.nan, 0.7],
+    })
+
+  def test_formato_longo(self):
+    longo = formato_longo(self.saida)
+    self.assertEqual(len(longo), 3 * 4)
+    self.assertEqual(longo['paciente'].unique().tolist(), ['X_Silva_Ana_1', 'Y_Souza_Bia', 'Z_Lima_Caio_p2'])
+    self.assertEqual(longo['grupo'].unique().tolist(), ['G', 'OD'])
+    lido = longo.set_index(['paciente', 'campo'])['lido']
+    self.assertEqual(lido[('X_Silva_Ana_1', 'SSI_OD')], '8,10')
+    self.assertIsNone(lido[('Y_Souza_Bia', 'Exam_date')])
+    self.assertNotIn('SSI_OD_bruto', longo['campo'].cat.categories)
+
+  def test_formato_longo_vazio(self):
+    self.assertEqual(len(formato_longo(self.saida.iloc[:0])), 0)
+
+  def test_acertos(self):
+    gt = ground_truth([
+      ('G___X_Silva_Ana_1_SSI_OD', '8.1'),          # lido "8,10" (coluna _bruto)
+      ('G___X_Silva_Ana_1_Exam_date', '09-09-2021'),
+      ('G___X_Silva_Ana_1_Eye', 'OD'),
+      ('OD___Y_Souza_Bia_SSI_OD', '7.6'),           # erro
+      ('OD___Y_Souza_Bia_Exam_date', '01-01-2021'), # sem leitura: erro
+      ('G___Z_Lima_Caio_p2_SSI', '62'),
+      ('G___Z_Lima_Caio_p2_SSI_OD', ''),            # sem valor esperado: ignorado
+      ('G___Outro_Paciente_SSI_OD', '5'),           # sem imagem: ignorado
+    ])
+    tabela = reconciliar(formato_longo(self.saida), gt)
+    resultado = {(p, c): a for p, c, a in zip(tabela['paciente'], tabela['campo'], tabela['acerto'])}
+    self.assertEqual(resultado, {('X_Silva_Ana_1', 'SSI_OD'): True, ('X_Silva_Ana_1', 'Exam_date'): True,
+                                 ('X_Silva_Ana_1', 'Eye'): True, ('Y_Souza_Bia', 'SSI_OD'): False,
+                                 ('Y_Souza_Bia', 'Exam_date'): False, ('Z_Lima_Caio_p2', 'SSI'): True})
+    resumo = acuracia(tabela, ['grupo']).set_index('grupo')
+    self.assertEqual(resumo.loc['G', 'acertos'], 4)
+    self.assertEqual(resumo.loc['OD', 'acuracia'], 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
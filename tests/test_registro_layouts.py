@@ -0,0 +1,51 @@
+import json
+import os
+import unittest
+
+from registro_layouts import GRUPOS, REGISTRO_FILE, carregar_registro
+
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Saída de info_crops, exam_crops e get_map_crops da versão original de sarmento_ocr.py (dicionários no código),
+# por padrão e grupo de campos
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dados', 'recortes_baseline.json')
+
+
+'''
+O registro declarativo (registro_layouts.json) tem de reproduzir os dicionários de recortes originais: mesmos campos,
+na mesma ordem (que define a ordem das colunas da saída), com as mesmas caixas e allowlists.
+'''
+class TestRegistroLayouts(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.registro = carregar_registro(os.path.join(RAIZ, REGISTRO_FILE))
+    with open(BASELINE_FILE, encoding='utf-8') as f:
+      cls.baseline = {int(padrao): grupos for padrao, grupos in json.load(f).items()}
+
+  def test_mesmos_padroes(self):
+    self.assertEqual(sorted(self.registro), sorted(self.baseline))
+
+  def test_pontos_iguais_aos_recortes_originais(self):
+    for padrao, grupos in self.baseline.items():
+      for grupo in GRUPOS:
+        with self.subTest(padrao=padrao, grupo=grupo):
+          pontos = self.registro[padrao].pontos[grupo]
+          self.assertEqual(list(pontos), list(grupos[grupo]))
+          self.assertEqual(pontos, grupos[grupo])
+
+  def test_arrays_coerentes_com_pontos(self):
+    for padrao, tabela in self.registro.items():
+      with self.subTest(padrao=padrao):
+        for campo, g, caixa, i in zip(tabela.campos, tabela.grupo, tabela.caixas.tolist(), tabela.id_allowlist):
+          self.assertEqual(tabela.pontos[GRUPOS[g]][campo], caixa + [tabela.allowlists[i]])
+
+  def test_alinhada_sem_deslocamento(self):
+    tabela = self.registro[1]
+    self.assertEqual(tabela.alinhada(0, 0).pontos, tabela.pontos)
+    deslocada = tabela.alinhada(3, -2)
+    self.assertEqual(deslocada.pontos['info']['Patient'], [49, 3, 140, 16, ''])
+    self.assertEqual(tabela.pontos['info']['Patient'], [46, 5, 140, 16, ''])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,102 @@
+import math
+import os
+import shutil
+import tempfile
+import unittest
+import pyarrow.parquet as pq
+
+from saida import ColunasRegistro, RegistroExame, abrir_escritor, ler_saida, linha_esquema, montar_esquema
+
+
+INFO = {'Patient': [46, 5, 140, 16, ''], 'Eye': [16, 60, 32, 70, 'OSD']}
+EXAME = {'SSI_OD': [250, 563, 60, 16, '.0123456789']}
+MAPA = {'CO_POD': [0, 0, 45, 15, '0123456789'], 'SSI_OD': [0, 0, 1, 1, '']}
+ESQUEMA = montar_esquema([INFO], [EXAME, MAPA], ['alinhamento_dx'])
+
+RESULTADOS = [
+  ('imagens/G/a.png', ['G', {'Patient': 'Ana', 'Eye': 'OD', 'SSI_OD': '8.1', 'SSI_OD_conf': 0.9,
+                             'CO_POD': '57,47', 'CO_POD_conf': 0.3, 'alinhamento_dx': 2, 'Extra': 'x'}]),
+  ('imagens/G/b.png', ['G', {'Patient': 'Bia', 'SSI_OD': '', 'CO_POD': '512'}]),
+]
+
+
+class TestEsquema(unittest.TestCase):
+  def test_ordem_e_tipos(self):
+    self.assertEqual(ESQUEMA, [
+      ('pasta', 'texto'), ('arquivo', 'texto'), ('Patient', 'texto'), ('Eye', 'texto'),
+      ('SSI_OD', 'numero'), ('SSI_OD_conf', 'numero'), ('SSI_OD_bruto', 'bruto'),
+      ('CO_POD', 'numero'), ('CO_POD_conf', 'numero'), ('CO_POD_bruto', 'bruto'),
+      ('alinhamento_dx', 'numero')])
+
+  def test_linha(self):
+    falhas = {}
+    linha = dict(zip([c for c, _ in ESQUEMA], linha_esquema(ESQUEMA, *RESULTADOS[0], falhas=falhas)))
+    self.assertEqual(linha['SSI_OD'], 8.1)
+    self.assertIsNone(linha['SSI_OD_bruto'])
+    self.assertIsNone(linha['CO_POD'])
+    self.assertEqual(linha['CO_POD_bruto'], '57,47')
+    self.assertEqual(linha['alinhamento_dx'], 2.0)
+    self.assertNotIn('Extra', linha)
+    self.assertEqual(falhas, {'CO_POD': 1})
+
+  def test_registro_exame(self):
+    colunas = ColunasRegistro(ESQUEMA)
+    registro = RegistroExame(colunas, *RESULTADOS[0])
+    self.assertEqual(registro.resultado(), ['G', {'Patient': 'Ana', 'Eye': 'OD', 'CO_POD_bruto': '57,47', 'SSI_OD': 8.1,
+                                                  'SSI_OD_conf': 0.9, 'CO_POD_conf': 0.3, 'alinhamento_dx': 2.0}])
+
+
+'''
+Ida e volta pelos escritores CSV e Parquet: as colunas seguem o esquema e ler_saida devolve os mesmos valores.
+'''
+class TestEscritores(unittest.TestCase):
+  def setUp(self):
+    self.diretorio = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.diretorio)
+
+  def gravar(self, formato):
+    caminho = os.path.join(self.diretorio, 'saida.' + formato)
+    escritor = abrir_escritor(formato, caminho, ESQUEMA)
+    for arquivo, resultado in RESULTADOS:
+      escritor.escrever(arquivo, resultado)
+    escritor.fechar()
+    self.assertEqual(escritor.falhas, {'CO_POD': 1})
+    return caminho
+
+  def conferir_leitura(self, formato, caminho):
+    lidos = ler_saida(formato, caminho)
+    self.assertEqual([pasta for pasta, _ in lidos], ['G', 'G'])
+    primeiro, segundo = (dados for _, dados in lidos)
+    self.assertEqual(float(primeiro['SSI_OD']), 8.1)
+    self.assertEqual(primeiro['CO_POD_bruto'], '57,47')
+    self.assertNotIn('CO_POD', primeiro)
+    self.assertEqual(float(segundo['CO_POD']), 512.0)
+    self.assertNotIn('SSI_OD', segundo)
+    self.assertNotIn('Eye', segundo)
+    registros = ler_saida(formato, caminho, esquema=ESQUEMA, tamanho_parte=1)
+    self.assertEqual(registros[1][1].resultado(), ['G', {'Patient': 'Bia', 'CO_POD': 512.0}])
+    self.assertTrue(math.isnan(registros[1][1].numeros[0]))
+
+  def test_csv(self):
+    caminho = self.gravar('csv')
+    with open(caminho, encoding='utf-8') as f:
+      self.assertEqual(f.readline().strip().split(';'), [c for c, _ in ESQUEMA])
+    self.conferir_leitura('csv', caminho)
+
+  def test_parquet(self):
+    caminho = self.gravar('parquet')
+    schema = pq.read_schema(caminho)
+    self.assertEqual(schema.names, [c for c, _ in ESQUEMA])
+    self.assertEqual([str(schema.field(c).type) for c, _ in ESQUEMA],
+                     ['double' if tipo == 'numero' else 'string' for _, tipo in ESQUEMA])
+    self.conferir_leitura('parquet', caminho)
+
+  def test_formato_desconhecido(self):
+    with self.assertRaises(ValueError):
+      abrir_escritor('xml', os.path.join(self.diretorio, 'saida.xml'), ESQUEMA)
+
+
+if __name__ == '__main__':
+  unittest.main()